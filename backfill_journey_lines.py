@@ -0,0 +1,19 @@
+from optparse import OptionParser
+
+from ocean_efficiency.utils.journey_search import backfill_lines
+
+"""
+fill journey.line, its bounding box and length_nm of the journeys written
+before those columns existed, after adding them to the table
+
+eg python backfill_journey_lines.py
+eg python backfill_journey_lines.py -b 500
+"""
+
+parser = OptionParser()
+parser.add_option("-b", "--batch-size", dest="batch_size", type="int", default=1000,
+                  help="journeys updated per transaction")
+
+(options, args) = parser.parse_args()
+
+print('{} journeys updated'.format(backfill_lines(batch_size=options.batch_size)))
@@ -0,0 +1,59 @@
+"""
+Time to import the package's entry modules in a fresh interpreter, and
+whether the import loaded SqlAlchemy or created the engine.
+
+eg python -m benchmarks.import_time
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import subprocess
+import sys
+from optparse import OptionParser
+
+MODULES = [
+    'ocean_efficiency.legacy_model.GeoWKT',
+    'ocean_efficiency.legacy_model.Journey',
+    'ocean_efficiency.xmlparse.route_model_iterparse',
+    'ocean_efficiency.utils.db',
+    'ocean_efficiency.model',
+    'oceanefficiency',
+]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+settings = sys.modules.get('ocean_efficiency.settings')
+print(elapsed, 'sqlalchemy' in sys.modules, settings is not None and settings.engine is not None)
+"""
+
+
+def measure(module):
+    """
+    :return: (seconds, sqlalchemy imported, engine created)
+    """
+    out = subprocess.check_output([sys.executable, '-c', PROBE.format(module=module)])
+    elapsed, sqlalchemy, engine = out.decode().split()
+    return float(elapsed), sqlalchemy == 'True', engine == 'True'
+
+
+def run(modules, repeat):
+    print('%-48s %10s %11s %7s' % ('module', 'import (s)', 'sqlalchemy', 'engine'))
+    for module in modules:
+        runs = [measure(module) for _ in range(repeat)]
+        elapsed = min(r[0] for r in runs)
+        print('%-48s %10.3f %11s %7s' % (module, elapsed, runs[0][1], runs[0][2]))
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-m", "--modules", dest="modules", default=','.join(MODULES),
+                      help="comma separated modules to import")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=5,
+                      help="imports of each module, the fastest is reported")
+    (options, args) = parser.parse_args()
+    run(options.modules.split(','), options.repeat)
@@ -0,0 +1,62 @@
+"""
+Cost of a journey's distance and bearing summaries against building its legs
+and its geometry, from the same route.
+
+eg python -m benchmarks.journey_summary -n 10000
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import time
+import tracemalloc
+from optparse import OptionParser
+
+from tests.fixtures import synthetic_route
+from ocean_efficiency.legacy_model.Journey import Journey
+
+
+def _summary(j):
+    return str(j), j.distance, j.leg_bearings
+
+
+def _legs(j):
+    return [(l.leg_distance, l.leg_straight.incoming_point) for l in j.legs]
+
+
+def _geometry(j):
+    return j.wkt_obj.ewkb
+
+
+def _measure(use, rm):
+    gc.collect()
+    start = time.time()
+    use(Journey.from_route_model(rm))
+    elapsed = time.time() - start
+
+    gc.collect()
+    tracemalloc.start()
+    use(Journey.from_route_model(rm))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def run(n, repeat):
+    rm = synthetic_route(n)
+    print('%-10s %8s %10s %12s %12s' % ('path', 'legs', 'time (s)', 'us/leg', 'peak B/leg'))
+    for name, use in [('summary', _summary), ('legs', _legs), ('geometry', _geometry)]:
+        elapsed, peak = min(_measure(use, rm) for _ in range(repeat))
+        print('%-10s %8d %10.3f %12.1f %12.0f' % (name, n - 1, elapsed, elapsed / (n - 1) * 1e6, peak / (n - 1)))
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", "--waypoints", dest="waypoints", type="int", default=10000,
+                      help="number of waypoints in the synthetic route")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+                      help="runs of each path, the best is reported")
+    (options, args) = parser.parse_args()
+    run(options.waypoints, options.repeat)
@@ -0,0 +1,58 @@
+"""
+Wall time and memory of building a journey's legs and reading their summaries.
+
+eg python -m benchmarks.legs -n 10000
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import time
+import tracemalloc
+from optparse import OptionParser
+
+from ocean_efficiency.legacy_model.Journey import Journey
+from tests.fixtures import synthetic_route
+
+
+def _summarise(j):
+    for _ in range(3):
+        [l.leg_distance for l in j.legs]
+        [l.leg_straight.incoming_point for l in j.legs]
+    return str(j)
+
+
+def _measure(build, rm):
+    gc.collect()
+    start = time.time()
+    j = build(rm)
+    built = time.time()
+    _summarise(j)
+    summarised = time.time()
+    del j
+
+    gc.collect()
+    tracemalloc.start()
+    j = build(rm)
+    _summarise(j)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(j.legs), built - start, summarised - built, retained / len(j.legs), peak / len(j.legs)
+
+
+def run(n):
+    rm = synthetic_route(n)
+    print('%-26s %8s %10s %15s %16s %13s' % ('path', 'legs', 'build (s)', 'summaries (s)', 'retained B/leg', 'peak B/leg'))
+    for name, build in [('from_route_model', Journey.from_route_model),
+                        ('from_route_model_per_leg', Journey.from_route_model_per_leg)]:
+        print('%-26s %8d %10.3f %15.3f %16.0f %13.0f' % ((name,) + _measure(build, rm)))
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", "--waypoints", dest="waypoints", type="int", default=10000,
+                      help="number of waypoints in the synthetic route")
+    (options, args) = parser.parse_args()
+    run(options.waypoints)
@@ -0,0 +1,514 @@
+"""
+End-to-end load test of the web app: lookups, batch lookups and route
+uploads replayed at a target concurrency, with the latency percentiles,
+throughput and error rate of each endpoint.
+
+By default the app is started on this host against a stand-in for the db,
+no outside service is needed: a SpatiaLite file holds the route_job queue,
+served by route_worker.py processes, and synthetic EEZ and border polygons the
+lookups query, as a deployment does (--lookups db). Where SpatiaLite cannot be
+loaded the queue is a plain SQLite file and the lookups are answered by the
+in-process zone index (settings.ZONE_INDEX_ENABLED, --lookups index), which
+bypasses the db: the report says which. With --url an app already running
+elsewhere is loaded instead, eg a gunicorn deployment against PostGIS.
+
+Each client runs one request at a time, the mix gives the weight of each
+kind of request. Requests made during the warm up are not counted.
+
+eg python -m benchmarks.load -c 8 -d 30
+eg python -m benchmarks.load -c 32 -m lookup=6,batch=1,upload=1 --wait-jobs -o load.json
+eg python -m benchmarks.load --url http://localhost:8000 -m lookup=1
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from optparse import OptionParser
+
+import numpy as np
+
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlencode, urlsplit
+except ImportError:
+    from httplib import HTTPConnection
+    from urllib import urlencode
+    from urlparse import urlsplit
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLED_ROUTE = os.path.join(REPO, 'B624.1 - GBSOU - NOSVG.xml')
+
+REQUEST_KINDS = ('lookup', 'batch', 'upload')
+
+# seconds between polls of a job's status with --wait-jobs
+JOB_POLL_INTERVAL = 0.05
+
+PERCENTILES = (50, 95, 99)
+
+# how the stand-in answers lookups
+LOOKUP_MODES = ('db', 'index')
+
+
+def seed_stand_in(db_path, lookups, zones, countries):
+    """
+    Create the route_job table in a new SQLite file, and for db lookups the
+    zone tables with the synthetic polygons in a SpatiaLite one. WAL lets the
+    app and the workers read while one of them writes
+    """
+    from sqlalchemy import create_engine, text
+
+    from ocean_efficiency.model import Base, RouteJob
+    from ocean_efficiency.utils import spatialite
+
+    engine = create_engine('sqlite:///' + db_path)
+    if lookups == 'index':
+        engine.execute('PRAGMA journal_mode=WAL')
+        RouteJob.__table__.create(engine)
+        engine.dispose()
+        return
+
+    spatialite.setup_spatialite(engine)
+    engine.execute('PRAGMA journal_mode=WAL')
+    spatialite.initdb(engine, Base.metadata.sorted_tables)
+    layers = [
+        ('eez_12nm_v2', 'geoname', stand_in_polygons(zones, 0, 'zone %05d')),
+        ('tm_world_borders_v03', 'name', stand_in_polygons(countries, 1, 'country %05d')),
+    ]
+    with engine.begin() as connection:
+        for table, label_column, (labels, polygons) in layers:
+            connection.execute(
+                text("INSERT INTO {} (gid, {}, geom) VALUES "
+                     "(:gid, :label, CastToMultiPolygon(GeomFromText(:wkt, 4326)))".format(table, label_column)),
+                [dict(gid=gid, label=label, wkt=polygon.wkt)
+                 for gid, (label, polygon) in enumerate(zip(labels, polygons), 1)])
+    engine.dispose()
+
+
+def stand_in_polygons(n, seed, label):
+    from benchmarks.zone_index import synthetic_polygons
+
+    polygons = synthetic_polygons(n, seed=seed)[1]
+    return [label % i for i in range(n)], polygons
+
+
+def stand_in_zone_index(zones, countries):
+    """
+    ZoneIndex over synthetic polygons, the EEZ and border layers of the stand-in
+    """
+    from ocean_efficiency.utils.zone_index import PolygonIndex, ZoneIndex
+
+    zone_labels, zone_polygons = stand_in_polygons(zones, 0, 'zone %05d')
+    country_labels, country_polygons = stand_in_polygons(countries, 1, 'country %05d')
+    return ZoneIndex(PolygonIndex(zone_labels, zone_polygons), PolygonIndex(country_labels, country_polygons))
+
+
+def serve(port, zones, countries, lookups):
+    """
+    Run the app on the stand-in, in the process started by StandIn.start
+    """
+    import logging
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    from ocean_efficiency import settings
+    from ocean_efficiency.utils import zone_index
+    from oceanefficiency import app
+
+    if lookups == 'index':
+        zone_index._zone_index = stand_in_zone_index(zones, countries)
+        settings.ZONE_INDEX_ENABLED = True
+
+    # a log line per request would be a good part of the server's work
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    # keep alive, the clients reuse their connection
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    print('serving on port %d' % port, file=sys.stderr)
+    server.serve_forever()
+
+
+class StandIn(object):
+    """
+    The app and route workers on a SQLite stand-in, in child processes
+    """
+
+    def __init__(self, zones, countries, job_workers, lookups):
+        self.lookups = lookups
+        self.zones = zones
+        self.countries = countries
+        self.job_workers = job_workers
+        self.directory = None
+        self.processes = []
+        self.url = None
+
+    def start(self, timeout=60):
+        self.directory = tempfile.mkdtemp(prefix='ocean_efficiency_load_')
+        db_path = os.path.join(self.directory, 'stand_in.db')
+        seed_stand_in(db_path, self.lookups, self.zones, self.countries)
+
+        env = dict(os.environ)
+        env['OCEAN_EFFICIENCY_SQL_ALCHEMY_CONN'] = 'sqlite:///' + db_path
+        if self.lookups == 'index':
+            # a plain SQLite file for the queue, the zone tables are not needed
+            env['OCEAN_EFFICIENCY_SPATIALITE_LIBRARY'] = ''
+        # the index is set by serve, not loaded from the db on import
+        env['OCEAN_EFFICIENCY_ZONE_INDEX_ENABLED'] = 'false'
+        # the full polygons, the stand-in has no companion tables
+        env['OCEAN_EFFICIENCY_USE_SUBDIVIDED_ZONES'] = 'false'
+
+        port = free_port()
+        self.processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.load', '--serve', '--port', str(port),
+             '--zones', str(self.zones), '--countries', str(self.countries), '--lookups', self.lookups],
+            cwd=REPO, env=env))
+        for _ in range(self.job_workers):
+            self.processes.append(subprocess.Popen(
+                [sys.executable, 'route_worker.py', '--poll-interval', str(JOB_POLL_INTERVAL)],
+                cwd=REPO, env=env))
+
+        self.url = 'http://127.0.0.1:%d' % port
+        wait_until_up(self.url, timeout, self.processes[0])
+
+    def stop(self):
+        for p in self.processes:
+            p.terminate()
+        for p in self.processes:
+            p.wait()
+        self.processes = []
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def wait_until_up(url, timeout, process=None):
+    client = Client(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError('the app exited with %s' % process.returncode)
+        try:
+            if client.request('GET', '/metrics')[0] == 200:
+                return
+        except (OSError, IOError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('%s did not answer within %ss' % (url, timeout))
+
+
+class Client(object):
+    """
+    One keep alive HTTP connection, opened again after an error
+    """
+
+    def __init__(self, url, timeout=60):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        :return: (status, response body)
+        """
+        if self.connection is None:
+            self.connection = HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self.connection.request(method, self.prefix + path, body, headers or {})
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except Exception:
+            self.connection.close()
+            self.connection = None
+            raise
+
+
+def multipart(field, filename, content):
+    """
+    :return: (body, content type) of a form posting one file
+    """
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        ('--%s\r\n' % boundary).encode('ascii'),
+        ('Content-Disposition: form-data; name="%s"; filename="%s"\r\n' % (field, filename)).encode('utf-8'),
+        b'Content-Type: text/xml\r\n\r\n',
+        content,
+        ('\r\n--%s--\r\n' % boundary).encode('ascii'),
+    ])
+    return body, 'multipart/form-data; boundary=%s' % boundary
+
+
+def parse_mix(mix):
+    """
+    :param mix: eg 'lookup=8,batch=1,upload=1'
+    :return: (kinds, weights)
+    """
+    kinds, weights = [], []
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in REQUEST_KINDS:
+            raise ValueError('unknown request kind %r, expected one of %s' % (kind, ', '.join(REQUEST_KINDS)))
+        weight = float(weight) if weight else 1.0
+        if weight > 0:
+            kinds.append(kind)
+            weights.append(weight)
+    if not kinds:
+        raise ValueError('the mix has no request with a weight')
+    return kinds, weights
+
+
+class Traffic(object):
+    """
+    Makes the requests of one client and records (endpoint, start, seconds, error)
+    """
+
+    def __init__(self, client, rnd, route_xml, batch_size, wait_jobs):
+        self.client = client
+        self.rnd = rnd
+        self.route_xml = route_xml
+        self.batch_size = batch_size
+        self.wait_jobs = wait_jobs
+        self.records = []
+
+    def timed(self, endpoint, method, path, body=None, headers=None, expect=200):
+        """
+        :return: the response body, or None on an error
+        """
+        start = time.time()
+        try:
+            status, content = self.client.request(method, path, body, headers)
+        except Exception as ex:
+            self.records.append((endpoint, start, time.time() - start, type(ex).__name__))
+            return None
+        error = None if status == expect else 'HTTP %d' % status
+        self.records.append((endpoint, start, time.time() - start, error))
+        return None if error else content
+
+    def point(self):
+        # latitude 0 or longitude 0 fail the form's DataRequired
+        return round(self.rnd.uniform(-179.9, 179.9), 6) or 0.1, round(self.rnd.uniform(-89.9, 89.9), 6) or 0.1
+
+    def lookup(self):
+        lon, lat = self.point()
+        self.timed('lookup_coordinates', 'POST', '/lookup_coordinates',
+                   urlencode(dict(longitude=lon, latitude=lat)),
+                   {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def batch(self):
+        body = json.dumps(dict(points=[self.point() for _ in range(self.batch_size)]))
+        self.timed('lookup_coordinates_batch', 'POST', '/lookup_coordinates/batch',
+                   body, {'Content-Type': 'application/json'})
+
+    def upload(self):
+        body, content_type = multipart('file', 'load_test.xml', self.route_xml)
+        content = self.timed('route_upload', 'POST', '/route_upload', body, {'Content-Type': content_type},
+                             expect=202)
+        if content is None or not self.wait_jobs:
+            return
+
+        # from the upload to the result, polls included
+        start = time.time()
+        status_url = json.loads(content.decode('utf-8'))['status_url']
+        status = None
+        while status not in ('done', 'failed'):
+            time.sleep(JOB_POLL_INTERVAL)
+            content = self.timed('route_upload_status', 'GET', status_url)
+            if content is not None:
+                status = json.loads(content.decode('utf-8'))['status']
+        self.records.append(('route_upload_job', start, time.time() - start,
+                             'job failed' if status == 'failed' else None))
+
+
+def run_client(url, seed, kinds, weights, deadline, route_xml, batch_size, wait_jobs):
+    rnd = random.Random(seed)
+    traffic = Traffic(Client(url), rnd, route_xml, batch_size, wait_jobs)
+    while time.time() < deadline:
+        kind = rnd.choices(kinds, weights)[0]
+        getattr(traffic, kind)()
+    return traffic.records
+
+
+def summarize(records, since, until):
+    """
+    :param records: (endpoint, start, seconds, error) of the requests
+    :param since: requests started before are the warm up, not counted
+    :param until: end of the measured period
+    :return: OrderedDict of endpoint to its figures, with 'all' last
+    """
+    records = [r for r in records if r[1] >= since]
+    period = max(until - since, 1e-9)
+    endpoints = sorted({r[0] for r in records})
+
+    summary = OrderedDict()
+    for endpoint in endpoints + ['all']:
+        rows = [r for r in records if endpoint == 'all' or r[0] == endpoint]
+        if endpoint == 'all':
+            # a job's time is made of the status polls, counted already
+            rows = [r for r in rows if r[0] != 'route_upload_job']
+        if not rows:
+            continue
+        seconds = np.array([r[2] for r in rows])
+        errors = [r[3] for r in rows if r[3] is not None]
+        figures = OrderedDict([
+            ('requests', len(rows)),
+            ('errors', len(errors)),
+            ('error_rate', len(errors) / len(rows)),
+            ('throughput_per_s', len(rows) / period),
+            ('mean_s', float(seconds.mean())),
+        ])
+        for p, value in zip(PERCENTILES, np.percentile(seconds, PERCENTILES)):
+            figures['p%d_s' % p] = float(value)
+        figures['max_s'] = float(seconds.max())
+        # the commonest errors, eg {"HTTP 500": 3}
+        figures['error_kinds'] = OrderedDict(
+            sorted(((e, errors.count(e)) for e in set(errors)), key=lambda kv: -kv[1]))
+        summary[endpoint] = figures
+    return summary
+
+
+def print_summary(summary, out=sys.stdout):
+    print('%-26s %8s %7s %8s %9s %9s %9s %9s' % (
+        'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'), file=out)
+    for endpoint, f in summary.items():
+        print('%-26s %8d %6.2f%% %8.1f %9.1f %9.1f %9.1f %9.1f' % (
+            endpoint, f['requests'], f['error_rate'] * 100, f['throughput_per_s'],
+            f['p50_s'] * 1e3, f['p95_s'] * 1e3, f['p99_s'] * 1e3, f['max_s'] * 1e3), file=out)
+        for error, n in f['error_kinds'].items():
+            print('    %6d x %s' % (n, error), file=out)
+
+
+def run(url, concurrency, duration, warmup, mix, route_xml, batch_size, wait_jobs, seed=0):
+    """
+    :return: summary, see summarize
+    """
+    kinds, weights = parse_mix(mix)
+    start = time.time()
+    deadline = start + warmup + duration
+    results = [None] * concurrency
+
+    def client(i):
+        results[i] = run_client(url, seed + i, kinds, weights, deadline, route_xml, batch_size, wait_jobs)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # clients finish the request they are in after the deadline
+    records = [r for client_records in results for r in client_records if r[1] < deadline]
+    return summarize(records, start + warmup, deadline)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("--url", dest="url",
+                      help="app to load, default one started here on the stand-in")
+    parser.add_option("-c", "--concurrency", dest="concurrency", type="int", default=8,
+                      help="clients making requests at the same time")
+    parser.add_option("-d", "--duration", dest="duration", type="float", default=30,
+                      help="seconds of measured load")
+    parser.add_option("--warmup", dest="warmup", type="float", default=3,
+                      help="seconds of load before the measured period")
+    parser.add_option("-m", "--mix", dest="mix", default="lookup=8,batch=1,upload=1",
+                      help="weights of the requests: " + ', '.join(REQUEST_KINDS))
+    parser.add_option("--batch-size", dest="batch_size", type="int", default=100,
+                      help="points per batch lookup")
+    parser.add_option("--route", dest="route", default=BUNDLED_ROUTE,
+                      help="route XML to upload, default the bundled B624.1")
+    parser.add_option("--route-size", dest="route_size", type="int",
+                      help="upload a synthetic route of this many waypoints instead")
+    parser.add_option("--wait-jobs", dest="wait_jobs", action="store_true", default=False,
+                      help="poll each upload's status until its job is done")
+    parser.add_option("--job-workers", dest="job_workers", type="int", default=2,
+                      help="route_worker.py processes of the stand-in")
+    parser.add_option("--zones", dest="zones", type="int", default=200,
+                      help="synthetic EEZ polygons of the stand-in")
+    parser.add_option("--countries", dest="countries", type="int", default=100,
+                      help="synthetic border polygons of the stand-in")
+    parser.add_option("--lookups", dest="lookups", choices=LOOKUP_MODES,
+                      help="stand-in lookups from the SpatiaLite db or the in-process zone index, "
+                           "default db where SpatiaLite can be loaded")
+    parser.add_option("-o", "--output", dest="output",
+                      help="JSON file to write the results to")
+    parser.add_option("--serve", dest="serve", action="store_true", default=False,
+                      help="run the stand-in app, used by the load test itself")
+    parser.add_option("--port", dest="port", type="int", default=5000)
+    (options, args) = parser.parse_args()
+
+    if options.serve:
+        serve(options.port, options.zones, options.countries, options.lookups)
+        sys.exit(0)
+
+    try:
+        parse_mix(options.mix)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    if options.route_size:
+        from benchmarks.xmlparse import synthetic_route_xml
+        route_xml = synthetic_route_xml(options.route_size)
+    else:
+        with open(options.route, 'rb') as f:
+            route_xml = f.read()
+
+    stand_in = None
+    url = options.url
+    lookups = None
+    if url is None:
+        from ocean_efficiency.utils.spatialite import spatialite_available
+
+        lookups = options.lookups or ('db' if spatialite_available() else 'index')
+        if lookups == 'index':
+            print('Lookups are answered by the in-process zone index, not the db: '
+                  'the deployed lookups query the db', file=sys.stderr)
+        stand_in = StandIn(options.zones, options.countries, options.job_workers, lookups)
+        stand_in.start()
+        url = stand_in.url
+    try:
+        summary = run(url, options.concurrency, options.duration, options.warmup, options.mix, route_xml,
+                      options.batch_size, options.wait_jobs)
+    finally:
+        if stand_in is not None:
+            stand_in.stop()
+
+    if lookups == 'index':
+        print('lookups: in-process zone index, bypassing the db')
+    print_summary(summary)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(OrderedDict([
+                ('meta', OrderedDict([
+                    ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                    ('url', options.url or 'stand-in'),
+                    ('lookups', lookups or 'app'),
+                    ('concurrency', options.concurrency),
+                    ('duration_s', options.duration),
+                    ('mix', options.mix),
+                    ('batch_size', options.batch_size),
+                    ('route_bytes', len(route_xml)),
+                    ('wait_jobs', options.wait_jobs),
+                ])),
+                ('endpoints', summary),
+            ]), f, indent=2)
@@ -0,0 +1,91 @@
+"""
+Latency of the PostGIS point lookups of lookup_coordinates on the full zone
+polygons (before) and on the subdivided / approximated companion tables
+(after), for the same random points, checking both give the same answer.
+Needs the db, with build_subdivided.py run.
+
+Random points are mostly open ocean, --near-coast draws them around the
+polygon vertices instead, where the full polygon tests are most expensive.
+
+eg python -m benchmarks.subdivided -n 2000 --near-coast
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import random
+import time
+from optparse import OptionParser
+
+from sqlalchemy import func
+
+from ocean_efficiency import settings
+from ocean_efficiency.model import EEZ12
+from ocean_efficiency.utils.db import create_session
+from oceanefficiency import lookup_zones_in_db
+
+
+def random_points(n, seed=1):
+    rnd = random.Random(seed)
+    return [(rnd.uniform(-180, 180), rnd.uniform(-90, 90)) for _ in range(n)]
+
+
+def near_coast_points(n, seed=1):
+    """
+    Points up to 0.05 degrees from random EEZ vertices
+    """
+    rnd = random.Random(seed)
+    with create_session() as session:
+        rows = session\
+            .query(func.ST_X(func.ST_PointN(func.ST_ExteriorRing(func.ST_GeometryN(EEZ12.geom, 1)), 1)),
+                   func.ST_Y(func.ST_PointN(func.ST_ExteriorRing(func.ST_GeometryN(EEZ12.geom, 1)), 1)))\
+            .all()
+    return [(lon + rnd.uniform(-0.05, 0.05), lat + rnd.uniform(-0.05, 0.05))
+            for lon, lat in (rnd.choice(rows) for _ in range(n))]
+
+
+def _time(points, use_subdivided):
+    settings.USE_SUBDIVIDED_ZONES = use_subdivided
+    latencies, results = [], []
+    for lon, lat in points:
+        start = time.time()
+        results.append(lookup_zones_in_db(lon, lat))
+        latencies.append(time.time() - start)
+    latencies.sort()
+    return latencies, results
+
+
+def _percentile(latencies, p):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e3
+
+
+def run(n, near_coast):
+    points = near_coast_points(n) if near_coast else random_points(n)
+    # warm the db cache before timing either
+    _time(points[:50], False)
+    _time(points[:50], True)
+
+    print('%12s %10s %10s %10s %10s' % ('tables', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms'))
+    outputs = []
+    for name, use_subdivided in [('full', False), ('subdivided', True)]:
+        latencies, results = _time(points, use_subdivided)
+        outputs.append(results)
+        print('%12s %10.2f %10.2f %10.2f %10.2f' % (
+            name, sum(latencies) / len(latencies) * 1e3,
+            _percentile(latencies, 0.5), _percentile(latencies, 0.95), _percentile(latencies, 0.99)))
+
+    mismatches = [p for p, a, b in zip(points, *outputs) if a != b]
+    print('%d of %d points differ' % (len(mismatches), n))
+    for p in mismatches[:10]:
+        print('  differs at lon %r lat %r' % p)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", "--points", dest="points", type="int", default=1000,
+                      help="number of points to look up")
+    parser.add_option("--near-coast", dest="near_coast", action="store_true", default=False,
+                      help="draw points near the zone boundaries")
+    (options, args) = parser.parse_args()
+    run(options.points, options.near_coast)
@@ -0,0 +1,270 @@
+"""
+Regression benchmarks of the hot paths: route XML parsing, sail vector / leg
+construction, journey geometry, WKT / EWKB writing and reading, and point
+lookups. Every case runs on the bundled B624.1 route and on synthetic routes
+of each size, mixed sail modes and radii.
+
+Results are written as JSON, one record per case and input with the best and
+median time of the repeats, so two runs can be compared:
+
+eg python -m benchmarks.suite -o before.json
+eg python -m benchmarks.suite -s 10,1000 -c parse,legs -o after.json
+eg python -m benchmarks.suite --compare before.json after.json
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+from collections import OrderedDict
+from optparse import OptionParser
+
+import numpy as np
+
+from benchmarks.xmlparse import synthetic_route_xml
+from ocean_efficiency.legacy_model.GeoWKT import CompoundCurve
+from ocean_efficiency.legacy_model.Journey import Journey
+from ocean_efficiency.legacy_model.RouteGeometry import RouteGeometry
+from ocean_efficiency.legacy_model.SailVector import SailVector
+from ocean_efficiency.xmlparse import route_model_parse
+from ocean_efficiency.xmlparse.route_model_iterparse import RouteModelReader
+
+BUNDLED_ROUTE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'B624.1 - GBSOU - NOSVG.xml')
+
+# cases run per Leg / SailVector object with pygeodesy, slow on big routes
+PER_OBJECT_MAX_SIZE = 10000
+
+# polygons of the synthetic layer of the lookup cases
+LOOKUP_POLYGONS = 250
+
+
+class Case(object):
+    """
+    A benchmark: prepare builds the input of run from the route XML, outside
+    the timing, run is timed. Results are per unit, eg per waypoint
+    """
+
+    def __init__(self, name, prepare, run, unit='waypoint', max_size=None, needs=None):
+        self.name = name
+        self.prepare = prepare
+        self.run = run
+        self.unit = unit
+        self.max_size = max_size
+        self.needs = needs
+
+    def available(self):
+        if self.needs is None:
+            return True
+        try:
+            __import__(self.needs)
+            return True
+        except ImportError:
+            return False
+
+
+def _route_model(xml):
+    return route_model_parse.parse(xml)
+
+
+def _sail_vectors(route_model):
+    wps = route_model.waypoints
+    return [SailVector.from_waypoints(wp1, wp2) for wp1, wp2 in zip(wps, wps[1:])]
+
+
+def _wkt_obj(xml):
+    journey = Journey.from_route_model(_route_model(xml))
+    return journey.legs, journey.name
+
+
+def _compound_curve(xml):
+    return Journey.from_route_model(_route_model(xml)).wkt_obj
+
+
+def _lookup_points(xml):
+    """
+    The route's waypoints as lookup points, over a synthetic polygon layer
+    """
+    from benchmarks.zone_index import synthetic_polygons
+    from ocean_efficiency.utils.zone_index import PolygonIndex
+
+    rg = RouteGeometry.from_waypoints(_route_model(xml).waypoints)
+    return PolygonIndex(*synthetic_polygons(LOOKUP_POLYGONS)), rg.lon.tolist(), rg.lat.tolist()
+
+
+def _cached_lookup(xml):
+    from ocean_efficiency.utils.lookup_cache import LRUTTLCache, QuantizedLookupCache
+
+    index, lons, lats = _lookup_points(xml)
+    cached = QuantizedLookupCache(index.lookup, 6, LRUTTLCache(10 ** 6, 3600, 2 ** 30))
+    # warm, every timed lookup is a hit
+    for lon, lat in zip(lons, lats):
+        cached(lon, lat)
+    return cached, lons, lats
+
+
+CASES = [
+    Case('parse', lambda xml: xml, _route_model),
+    Case('parse_stream', lambda xml: xml,
+         lambda xml: RouteGeometry.from_waypoints(RouteModelReader(io.BytesIO(xml)))),
+    Case('sail_vectors', _route_model, _sail_vectors, max_size=PER_OBJECT_MAX_SIZE),
+    Case('legs_per_leg', _route_model, Journey.from_route_model_per_leg, max_size=PER_OBJECT_MAX_SIZE),
+    Case('route_geometry', _route_model, lambda rm: RouteGeometry.from_waypoints(rm.waypoints)),
+    Case('summary', _route_model, lambda rm: Journey.from_route_model(rm).distance),
+    Case('legs', _route_model, lambda rm: Journey.from_route_model(rm).legs),
+    Case('wkt_obj', _wkt_obj, lambda legs_name: Journey(legs_name[1], legs_name[0]).wkt_obj),
+    Case('wkt_format', _compound_curve, lambda cc: cc.wkt),
+    Case('wkt_parse', lambda xml: _compound_curve(xml).wkt, CompoundCurve.from_wkt),
+    Case('ewkb_format', _compound_curve, lambda cc: cc.ewkb),
+    Case('ewkb_parse', lambda xml: _compound_curve(xml).ewkb, CompoundCurve.from_ewkb),
+    Case('zone_lookup', _lookup_points,
+         lambda args: [args[0].lookup(lon, lat) for lon, lat in zip(args[1], args[2])],
+         unit='point', needs='shapely'),
+    Case('zone_lookup_many', _lookup_points, lambda args: args[0].lookup_many(args[1], args[2]),
+         unit='point', needs='shapely'),
+    Case('cached_lookup_hit', _cached_lookup,
+         lambda args: [args[0](lon, lat) for lon, lat in zip(args[1], args[2])],
+         unit='point', needs='shapely'),
+]
+
+
+def inputs(sizes):
+    """
+    :return: list of (input name, waypoints, route XML bytes)
+    """
+    with open(BUNDLED_ROUTE, 'rb') as f:
+        bundled = f.read()
+    result = [('B624.1', bundled.count(b'<Waypoints>'), bundled)]
+    for size in sizes:
+        result.append(('synthetic', size, synthetic_route_xml(size)))
+    return result
+
+
+def measure(case, arg, repeat, min_time):
+    """
+    Time case.run(arg) like timeit: enough calls per repeat to last min_time
+    :return: (calls per repeat, list of seconds per call)
+    """
+    timer = timeit.Timer(lambda: case.run(arg))
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    return number, [t / number for t in timer.repeat(repeat, number)]
+
+
+def git_commit():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                      cwd=os.path.dirname(BUNDLED_ROUTE))
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, case_names, repeat, min_time, verbose=True):
+    cases = [c for c in CASES if not case_names or c.name in case_names]
+    results = []
+    for input_name, size, xml in inputs(sizes):
+        for case in cases:
+            if not case.available() or (case.max_size and size > case.max_size):
+                continue
+            arg = case.prepare(xml)
+            number, times = measure(case, arg, repeat, min_time)
+            record = OrderedDict([
+                ('case', case.name),
+                ('input', input_name),
+                ('size', size),
+                ('unit', case.unit),
+                ('number', number),
+                ('repeat', repeat),
+                ('best_s', min(times)),
+                ('median_s', statistics.median(times)),
+                ('best_us_per_unit', min(times) / size * 1e6),
+            ])
+            results.append(record)
+            if verbose:
+                print('%-18s %-10s %8d %12.6f s %10.3f us/%s' % (
+                    case.name, input_name, size, record['best_s'], record['best_us_per_unit'], case.unit),
+                    file=sys.stderr)
+    return OrderedDict([
+        ('meta', OrderedDict([
+            ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('commit', git_commit()),
+            ('python', platform.python_version()),
+            ('numpy', np.__version__),
+            ('machine', platform.platform()),
+        ])),
+        ('results', results),
+    ])
+
+
+def compare(old, new, threshold):
+    """
+    Print the ratio of the best times of the cases in both runs
+    :return: the (case, input, size) that are slower by more than threshold
+    """
+    key = lambda r: (r['case'], r['input'], r['size'])
+    before = {key(r): r for r in old['results']}
+    regressions = []
+    print('%-18s %-10s %8s %12s %12s %7s' % ('case', 'input', 'size', 'before (s)', 'after (s)', 'ratio'))
+    for r in new['results']:
+        b = before.get(key(r))
+        if b is None:
+            continue
+        ratio = r['best_s'] / b['best_s']
+        flag = ' SLOWER' if ratio > threshold else ''
+        if flag:
+            regressions.append(key(r))
+        print('%-18s %-10s %8d %12.6f %12.6f %7.2f%s' % (
+            r['case'], r['input'], r['size'], b['best_s'], r['best_s'], ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-s", "--sizes", dest="sizes", default="10,100,1000,10000,100000",
+                      help="comma separated waypoint counts of the synthetic routes")
+    parser.add_option("-c", "--cases", dest="cases", default="",
+                      help="comma separated cases to run, default all: " + ','.join(c.name for c in CASES))
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=5,
+                      help="timed repeats of each case, the best and median are reported")
+    parser.add_option("--min-time", dest="min_time", type="float", default=0.05,
+                      help="least seconds per repeat, short cases are looped to reach it")
+    parser.add_option("-o", "--output", dest="output",
+                      help="JSON file to write the results to, default stdout")
+    parser.add_option("--compare", dest="compare", action="store_true", default=False,
+                      help="compare two result files given as arguments, exit 1 on regressions")
+    parser.add_option("--threshold", dest="threshold", type="float", default=1.2,
+                      help="slowdown ratio flagged as a regression by --compare")
+    (options, args) = parser.parse_args()
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error('--compare needs the before and after result files')
+        with open(args[0]) as f_old, open(args[1]) as f_new:
+            regressions = compare(json.load(f_old), json.load(f_new), options.threshold)
+        sys.exit(1 if regressions else 0)
+
+    suite = run(
+        [int(s) for s in options.sizes.split(',') if s],
+        [c for c in options.cases.split(',') if c],
+        options.repeat,
+        options.min_time,
+    )
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(suite, f, indent=2)
+    else:
+        json.dump(suite, sys.stdout, indent=2)
+        print()
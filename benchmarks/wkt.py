@@ -0,0 +1,79 @@
+"""
+Scaling of GeoWKT writing and reading, as WKT text and as EWKB, with the
+number of vertices. The time per vertex should stay flat as the geometry grows.
+With --no-gc the cyclic garbage collector is off for the whole run, to tell
+parser cost from collector cost.
+
+eg python -m benchmarks.wkt --no-gc
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import random
+import time
+from optparse import OptionParser
+
+from ocean_efficiency.legacy_model.GeoWKT import CompoundCurve, CircularString, LineString
+
+
+def synthetic_compound_curve(vertices, seed=0):
+    """
+    Alternating turning arcs and segmented straights, like Journey.wkt_obj,
+    with signed coordinates and the odd exponent
+    """
+    rnd = random.Random(seed)
+    lon, lat = -1.0, 50.0
+    parts = []
+    count = 0
+    while count < vertices:
+        arc = [[lon, lat]]
+        for _ in range(2):
+            lon, lat = lon + rnd.uniform(-1e-3, 1e-3), lat + rnd.uniform(-1e-3, 1e-3)
+            arc.append([lon, lat])
+        parts.append(CircularString.from_lon_lat_list(arc))
+        straight = [[lon, lat]]
+        for _ in range(rnd.randint(1, 50)):
+            lon, lat = lon + rnd.uniform(-0.1, 0.1), lat + rnd.uniform(-1e-5, 1e-5)
+            straight.append([lon, lat])
+        parts.append(LineString.from_lon_lat_list(straight))
+        count += len(arc) + len(straight)
+    return CompoundCurve(parts, srid=4326), count
+
+
+def _time_round_trip(cc, write, read):
+    start = time.time()
+    data = write(cc)
+    written = time.time()
+    read(data)
+    return written - start, time.time() - written, len(data)
+
+
+def run(sizes):
+    formats = [
+        ('wkt', lambda cc: cc.wkt, CompoundCurve.from_wkt),
+        ('ewkb', lambda cc: cc.ewkb, CompoundCurve.from_ewkb),
+    ]
+    print('%6s %10s %12s %12s %12s %12s %12s' % (
+        'format', 'vertices', 'write (s)', 'write us/v', 'read (s)', 'read us/v', 'bytes/v'))
+    for size in sizes:
+        cc, vertices = synthetic_compound_curve(size)
+        for name, write, read in formats:
+            write_s, read_s, size_bytes = _time_round_trip(cc, write, read)
+            print('%6s %10d %12.3f %12.3f %12.3f %12.3f %12.1f' % (
+                name, vertices, write_s, write_s / vertices * 1e6, read_s, read_s / vertices * 1e6,
+                size_bytes / vertices))
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-s", "--sizes", dest="sizes", default="1000,10000,100000,1000000",
+                      help="comma separated vertex counts")
+    parser.add_option("--no-gc", dest="no_gc", action="store_true", default=False,
+                      help="disable the garbage collector for the whole run")
+    (options, args) = parser.parse_args()
+    if options.no_gc:
+        gc.disable()
+    run([int(s) for s in options.sizes.split(',')])
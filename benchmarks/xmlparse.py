@@ -0,0 +1,115 @@
+"""
+Route XML parsing, the previous dexml path against the streaming reader,
+on synthetic RouteModelType documents like the bundled B624.1 export.
+
+dexml: RouteModel.parse fails on the root element, then RouteModelType.parse
+builds the whole document again.
+stream: RouteModelReader, materialised into a route model.
+stream+journey: Journey.from_route_xml, waypoints fed straight into the
+route geometry. This includes building the legs, so it is not a parse only
+figure, the comparison is with dexml plus Journey.from_route_model.
+
+eg python -m benchmarks.xmlparse -n 1000,10000,100000
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+import random
+import time
+import tracemalloc
+from optparse import OptionParser
+
+import dexml
+
+from ocean_efficiency.legacy_model.Journey import Journey
+from ocean_efficiency.xmlparse.RouteModel import RouteModel, RouteModelType
+from ocean_efficiency.xmlparse.route_model_iterparse import RouteModelReader
+
+WAYPOINT_XML = """    <Waypoints>
+        <Name>WP{i}</Name>
+        <Latitude>{lat!r}</Latitude>
+        <Longitude>{lon!r}</Longitude>
+        <Notes />
+        <IsParameterPoint>false</IsParameterPoint>
+        <SailMode>{sail_mode}</SailMode>
+        <IsArrivalPoint>false</IsArrivalPoint>
+        <Radius>{radius}</Radius>
+        <TrackLimit>0</TrackLimit>
+        <CourseLimit>0</CourseLimit>
+        <Economy>0</Economy>
+        <MaximalSpeed>0</MaximalSpeed>
+        <ControllerType>SamNacos5</ControllerType>
+    </Waypoints>
+"""
+
+
+def synthetic_route_xml(n, seed=0):
+    rnd = random.Random(seed)
+    lat, lon = 50.0, -1.0
+    parts = [
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<RouteModelType xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xmlns:xsd="http://www.w3.org/2001/XMLSchema">\n'
+        '    <Name>synthetic</Name>\n'
+    ]
+    for i in range(n):
+        parts.append(WAYPOINT_XML.format(
+            i=i, lat=math.radians(lat), lon=math.radians(lon),
+            sail_mode=rnd.choice([0, 1]), radius=rnd.choice([0, 185.2, 370.4, 926])))
+        lat = max(-80, min(80, lat + rnd.uniform(-0.3, 0.3)))
+        lon = (lon + rnd.uniform(-0.3, 0.5) + 180) % 360 - 180
+    parts.append('</RouteModelType>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def dexml_parse(xml_str):
+    """
+    route_model_parse.parse before the streaming reader
+    """
+    for C in [RouteModel, RouteModelType]:
+        try:
+            return C.parse(xml_str)
+        except dexml.ParseError:
+            pass
+
+
+def _measure(func, arg):
+    tracemalloc.start()
+    start = time.time()
+    func(arg)
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # untraced timing, tracemalloc slows allocation heavy code down
+    start = time.time()
+    func(arg)
+    return min(elapsed, time.time() - start), peak
+
+
+def run(sizes):
+    paths = [
+        ('dexml', dexml_parse),
+        ('stream', lambda xml: RouteModelReader(xml).read()),
+        ('stream+journey', Journey.from_route_xml),
+    ]
+    print('%15s %10s %10s %12s %12s' % ('path', 'waypoints', 'time (s)', 'us/waypoint', 'peak MB'))
+    for n in sizes:
+        xml = synthetic_route_xml(n)
+        for name, func in paths:
+            if name == 'dexml':
+                elapsed, peak = _measure(func, xml.decode('utf-8'))
+            else:
+                elapsed, peak = _measure(func, xml)
+            print('%15s %10d %10.3f %12.1f %12.1f' % (name, n, elapsed, elapsed / n * 1e6, peak / 1e6))
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", "--sizes", dest="sizes", default="1000,10000,100000",
+                      help="comma separated waypoint counts")
+    (options, args) = parser.parse_args()
+    run([int(s) for s in options.sizes.split(',')])
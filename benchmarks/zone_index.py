@@ -0,0 +1,105 @@
+"""
+Point lookups against the EEZ / world border polygons, the in-process
+STR-tree index against the PostGIS ST_Within queries.
+
+Without --db the index is benchmarked alone on synthetic polygons. With --db
+both paths run on the real tables for the same random points and every
+result is checked to be identical.
+
+eg python -m benchmarks.zone_index -n 10000
+eg python -m benchmarks.zone_index -n 1000 --db
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+import random
+import time
+from optparse import OptionParser
+
+from ocean_efficiency.utils.zone_index import PolygonIndex, ZoneIndex
+
+
+def synthetic_polygons(n, seed=0):
+    """
+    Irregular star shaped polygons of a few degrees, scattered over the globe
+    """
+    from shapely import Polygon
+
+    rnd = random.Random(seed)
+    labels, polygons = [], []
+    for i in range(n):
+        lon, lat = rnd.uniform(-175, 175), rnd.uniform(-80, 80)
+        vertices = rnd.randint(20, 200)
+        ring = []
+        for k in range(vertices):
+            angle = 2 * math.pi * k / vertices
+            r = rnd.uniform(0.5, 3)
+            ring.append((lon + r * math.cos(angle), lat + r * math.sin(angle)))
+        labels.append('zone %05d' % i)
+        polygons.append(Polygon(ring))
+    return labels, polygons
+
+
+def random_points(n, seed=1):
+    rnd = random.Random(seed)
+    return [(rnd.uniform(-180, 180), rnd.uniform(-90, 90)) for _ in range(n)]
+
+
+def _time(func, points):
+    start = time.time()
+    results = [func(lon, lat) for lon, lat in points]
+    return time.time() - start, results
+
+
+def run_synthetic(n_points, n_polygons):
+    start = time.time()
+    index = PolygonIndex(*synthetic_polygons(n_polygons))
+    print('built index over %d polygons in %.2fs' % (n_polygons, time.time() - start))
+
+    points = random_points(n_points)
+    elapsed, _ = _time(index.lookup, points)
+    print('index lookup: %d points in %.3fs, %.1f us/point' % (n_points, elapsed, elapsed / n_points * 1e6))
+
+    lons, lats = zip(*points)
+    start = time.time()
+    index.lookup_many(lons, lats)
+    elapsed = time.time() - start
+    print('index lookup_many: %d points in %.3fs, %.1f us/point' % (n_points, elapsed, elapsed / n_points * 1e6))
+
+
+def run_db(n_points):
+    from oceanefficiency import lookup_zones_in_db
+
+    start = time.time()
+    index = ZoneIndex.load()
+    print('loaded index in %.2fs' % (time.time() - start))
+
+    points = random_points(n_points)
+    index_s, index_results = _time(index.lookup, points)
+    db_s, db_results = _time(lookup_zones_in_db, points)
+
+    mismatches = [p for p, a, b in zip(points, index_results, db_results) if a != b]
+    print('%10s %10s %12s' % ('path', 'time (s)', 'us/point'))
+    print('%10s %10.3f %12.1f' % ('index', index_s, index_s / n_points * 1e6))
+    print('%10s %10.3f %12.1f' % ('postgis', db_s, db_s / n_points * 1e6))
+    print('%d of %d points differ' % (len(mismatches), n_points))
+    for p in mismatches[:10]:
+        print('  differs at lon %r lat %r' % p)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", "--points", dest="points", type="int", default=10000,
+                      help="number of random points to look up")
+    parser.add_option("--polygons", dest="polygons", type="int", default=5000,
+                      help="number of synthetic polygons without --db")
+    parser.add_option("--db", dest="db", action="store_true", default=False,
+                      help="compare with PostGIS on the real tables")
+    (options, args) = parser.parse_args()
+    if options.db:
+        run_db(options.points)
+    else:
+        run_synthetic(options.points, options.polygons)
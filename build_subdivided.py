@@ -0,0 +1,20 @@
+from optparse import OptionParser
+
+from ocean_efficiency.utils.subdivide import build_companion_tables
+
+"""
+eg python build_subdivided.py
+eg python build_subdivided.py -t eez_12nm_v2 -m 128
+"""
+
+parser = OptionParser()
+parser.add_option("-t", "--table", dest="tables", action="append",
+                  help="layer table, repeat for several, default settings.SUBDIVIDED_ZONE_TABLES")
+parser.add_option("-m", "--max-vertices", dest="max_vertices", type="int",
+                  help="ST_Subdivide vertex limit")
+parser.add_option("--tolerance", dest="tolerance", type="float",
+                  help="simplification tolerance of the approximations, degrees")
+
+(options, args) = parser.parse_args()
+
+build_companion_tables(tables=options.tables, max_vertices=options.max_vertices, tolerance=options.tolerance)
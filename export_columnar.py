@@ -0,0 +1,73 @@
+from optparse import OptionParser
+
+from load_files import find_files
+from ocean_efficiency.utils.columnar_export import (
+    DEFAULT_CHUNK_SIZE, FORMATS, export_journeys, export_legs, route_job_xmls)
+from ocean_efficiency.utils.job_queue import drop_uploads
+
+"""
+Export the journey table and the legs of route XMLs to GeoParquet or Arrow IPC
+files for analytics
+
+eg python export_columnar.py -j journeys.parquet
+eg python export_columnar.py -l legs.parquet -d "/Users/ben.marengo/other_code/oceanefficiency/exports"
+eg python export_columnar.py -l legs.arrow -f arrow --jobs
+
+The uploads of the jobs are kept with settings.KEEP_JOB_UPLOADS, and deleted
+once exported: each --jobs export has the jobs done since the previous one,
+unless --keep-uploads
+"""
+
+parser = OptionParser()
+parser.add_option("-j", "--journeys", dest="journeys",
+                  help="write the journey table to FILE", metavar="FILE")
+parser.add_option("-l", "--legs", dest="legs",
+                  help="write the legs of the routes to FILE", metavar="FILE")
+parser.add_option("-d", "--dir", dest="directory",
+                  help="legs of every *.xml in DIR", metavar="DIR")
+parser.add_option("-g", "--glob", dest="pattern",
+                  help="legs of the files matching PATTERN, ** recurses", metavar="PATTERN")
+parser.add_option("--jobs", dest="jobs", action="store_true", default=False,
+                  help="legs of the routes uploaded and processed by the route workers")
+parser.add_option("--keep-uploads", dest="keep_uploads", action="store_true", default=False,
+                  help="keep the uploads of the jobs exported, to export them again")
+parser.add_option("-f", "--format", dest="file_format", default="parquet", choices=FORMATS,
+                  help="parquet or arrow, default parquet")
+parser.add_option("-c", "--chunk-size", dest="chunk_size", type="int", default=DEFAULT_CHUNK_SIZE,
+                  help="rows per record batch, and fetched from the db at a time")
+
+(options, args) = parser.parse_args()
+if not options.journeys and not options.legs:
+    parser.error('supply --journeys and / or --legs')
+if options.legs and not (options.directory or options.pattern or options.jobs):
+    parser.error('supply --dir, --glob or --jobs with --legs')
+
+failures = []
+if options.journeys:
+    print('{} journeys written to {}'.format(
+        export_journeys(options.journeys, file_format=options.file_format, chunk_size=options.chunk_size),
+        options.journeys))
+
+if options.legs:
+    job_ids = {}
+    written = []
+
+    def routes():
+        for path in find_files(options.directory, options.pattern):
+            yield path, path
+        if options.jobs:
+            for route in route_job_xmls(job_ids=job_ids):
+                yield route
+
+    legs, failures = export_legs(options.legs, routes(), options.file_format, options.chunk_size, written)
+    print('{} legs written to {}'.format(legs, options.legs))
+    if options.jobs and not job_ids:
+        print('No job uploads to export, are they kept (KEEP_JOB_UPLOADS)?')
+    # those that failed are kept
+    exported = [job_ids[source] for source in written if source in job_ids]
+    if exported and not options.keep_uploads:
+        print('{} job uploads exported and deleted'.format(drop_uploads(exported)))
+    for source, error in failures:
+        print('FAILED {}: {}'.format(source, error))
+
+raise SystemExit(1 if failures else 0)
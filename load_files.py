@@ -0,0 +1,162 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import glob
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from optparse import OptionParser
+
+"""
+Bulk version of load_file.py. Route XMLs are parsed and turned into journeys
+in a process pool, the parent writes the journey geometries to the db in
+batches. A file that fails is reported and skipped, the run carries on.
+
+eg python load_files.py -d "/Users/ben.marengo/other_code/oceanefficiency/exports"
+eg python load_files.py -g "/data/exports/**/*.xml" -p 8 --dry-run
+"""
+
+
+def build_journey(path):
+    """
+    Worker: parse one route XML and build its journey geometry. Only the
+    EWKB goes back to the parent, not the Journey object graph
+    :param path: route XML file
+    :return: dict with path, and name, waypoints, ewkb, distance or error
+    """
+    from ocean_efficiency.legacy_model.Journey import Journey
+
+    try:
+        j = Journey.from_route_xml(path)
+        return dict(path=path, name=j.name, waypoints=len(j.route_geometry.names), ewkb=j.wkt_obj.ewkb,
+                    distance=j.distance)
+    except Exception as ex:
+        return dict(path=path, error='{}: {}'.format(type(ex).__name__, ex), traceback=traceback.format_exc())
+
+
+def find_files(directory=None, pattern=None):
+    paths = []
+    if directory:
+        paths.extend(glob.glob(os.path.join(directory, '*.xml')))
+    if pattern:
+        paths.extend(glob.glob(pattern, recursive=True))
+    return sorted(set(paths))
+
+
+class BatchWriter(object):
+    """
+    Collect built journeys and insert them batch_size at a time, one commit
+    per batch. If a batch fails its journeys are retried one by one so that
+    only the offending files are reported.
+    """
+
+    def __init__(self, batch_size, on_failure):
+        self.batch_size = batch_size
+        self.on_failure = on_failure
+        self.pending = []
+
+    def add(self, result):
+        self.pending.append(result)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            self._write(batch)
+        except Exception:
+            for result in batch:
+                try:
+                    self._write([result])
+                except Exception as ex:
+                    error = str(ex).splitlines()[0]
+                    self.on_failure(result['path'], 'db: {}: {}'.format(type(ex).__name__, error))
+
+    @staticmethod
+    def _write(results):
+        from ocean_efficiency.legacy_model.Journey import Journey
+        from ocean_efficiency.utils.db import create_session
+        from ocean_efficiency.utils.tiles import invalidate_journeys_tiles
+
+        journeys = [Journey.orm_from_ewkb(r['name'], r['ewkb'], r['distance']) for r in results]
+        bboxes = [(j.min_lon, j.min_lat, j.max_lon, j.max_lat) for j in journeys]
+        with create_session() as session:
+            session.add_all(journeys)
+            # commit before create_session expunges the pending journeys
+            session.commit()
+        invalidate_journeys_tiles(bboxes)
+
+
+def run(paths, processes=None, batch_size=100, dry_run=False, verbose=False):
+    """
+    :return: (journeys loaded, list of (path, error))
+    """
+    failures = []
+
+    def on_failure(path, error):
+        failures.append((path, error))
+        logging.error('%s: %s', path, error)
+
+    writer = None if dry_run else BatchWriter(batch_size, on_failure)
+    loaded = waypoints = 0
+    start = time.time()
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunksize = max(1, min(50, len(paths) // ((processes or os.cpu_count() or 1) * 4)))
+        for result in pool.imap_unordered(build_journey, paths, chunksize=chunksize):
+            if 'error' in result:
+                on_failure(result['path'], result['error'])
+                if verbose:
+                    logging.error(result['traceback'])
+                continue
+            loaded += 1
+            waypoints += result['waypoints']
+            if writer:
+                writer.add(result)
+        if writer:
+            writer.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+    # db failures are reported after the journey was counted as built
+    loaded -= len([f for f in failures if f[1].startswith('db: ')])
+    elapsed = time.time() - start
+
+    print('{} files, {} loaded, {} failed in {:.1f}s'.format(len(paths), loaded, len(failures), elapsed))
+    if elapsed > 0:
+        print('{:.1f} files/s, {:.0f} waypoints/s'.format(len(paths) / elapsed, waypoints / elapsed))
+    for path, error in failures:
+        print('FAILED {}: {}'.format(path, error))
+    return loaded, failures
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-d", "--dir", dest="directory",
+                      help="load every *.xml in DIR", metavar="DIR")
+    parser.add_option("-g", "--glob", dest="pattern",
+                      help="load files matching PATTERN, ** recurses", metavar="PATTERN")
+    parser.add_option("-p", "--processes", dest="processes", type="int", default=None,
+                      help="worker processes, default one per cpu")
+    parser.add_option("-b", "--batch-size", dest="batch_size", type="int", default=100,
+                      help="journeys inserted per db transaction")
+    parser.add_option("--dry-run", dest="dry_run", action="store_true", default=False,
+                      help="parse and build journeys without writing to the db")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true", default=False,
+                      help="print tracebacks of failed files")
+
+    (options, args) = parser.parse_args()
+    if not options.directory and not options.pattern:
+        parser.error('supply --dir or --glob')
+
+    paths = find_files(options.directory, options.pattern)
+    _, failures = run(paths, options.processes, options.batch_size, options.dry_run, options.verbose)
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,43 @@
+import time
+from optparse import OptionParser
+
+from ocean_efficiency import settings
+from ocean_efficiency.utils.shapefile_loader import find_shapefiles, load_shapefiles
+from ocean_efficiency.utils.spatialite import uses_spatialite
+from ocean_efficiency.utils.subdivide import build_companion_tables
+
+"""
+Load every shape file (*.shp) under a directory into postgis, several at a
+time, or into the SpatiaLite file of settings.SQL_ALCHEMY_CONN, one at a time
+
+eg python load_shp_files.py -d /Users/ben.marengo/other_code/oceanefficiency_data/World_EEZ_v10_20180221 -p 6
+"""
+
+parser = OptionParser()
+parser.add_option("-d", "--dir", dest="directory",
+                  help="load the shape files under DIR", metavar="DIR")
+parser.add_option("-p", "--processes", dest="processes", type="int", default=4,
+                  help="layers loaded at once")
+parser.add_option("-s", "--srid", dest="srid", type="int", default=4326,
+                  help="srid of the shape files")
+
+(options, args) = parser.parse_args()
+if not options.directory:
+    parser.error('supply --dir')
+
+paths = find_shapefiles(options.directory)
+start = time.time()
+results = load_shapefiles(paths, options.processes, options.srid)
+elapsed = time.time() - start
+for r in results:
+    print(r)
+rows = sum(r.rows for r in results)
+print('{} layers, {} rows in {:.1f}s, {:.0f} rows/s overall'.format(len(results), rows, elapsed, rows / elapsed if elapsed else 0))
+
+loaded = set(r.table for r in results if not r.error)
+zone_tables = [t for t in settings.SUBDIVIDED_ZONE_TABLES if t in loaded]
+if zone_tables and not uses_spatialite():
+    # subdivided and simplified companions of the zone layers used by lookups
+    build_companion_tables(tables=zone_tables)
+
+raise SystemExit(1 if len(loaded) < len(results) else 0)
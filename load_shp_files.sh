@@ -13,11 +13,6 @@ then
     exit
 fi
 
-for f in $(find ${dir} -name '*.shp');
-do
-    filename=$(basename "$f")
-    extension="${filename##*.}"
-    filename="${filename%.*}"
-    psql -U postgres -d ocean_efficiency_geo -c "DROP TABLE IF EXISTS ${filename};"
-    shp2pgsql -I -s 4326 ${f} "${filename}" | psql -U postgres -d ocean_efficiency_geo
-done
+# layers are loaded in parallel with COPY, indexed and analysed afterwards,
+# see load_shp_files.py
+python "$(dirname "$0")/load_shp_files.py" -d "${dir}"
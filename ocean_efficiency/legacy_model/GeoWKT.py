@@ -1,8 +1,26 @@
-import regex
+import gc
+import math
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
 
-multi_wkt_pattern = regex.compile('([A-Z]*\((?>[^\(\)]+|(?R))*\))')
-single_wkt_pattern = regex.compile('(\w*)\((.*)\)')
-lon_lat_pattern = regex.compile('(\d+\.?\d*) (\d+\.?\d*)')
+from ocean_efficiency.utils.instrumentation import timed
+
+# EWKB geometry type codes and flags, as written by PostGIS ST_AsEWKB
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_CIRCULARSTRING = 8
+WKB_COMPOUNDCURVE = 9
+EWKB_Z_FLAG = 0x80000000
+EWKB_M_FLAG = 0x40000000
+EWKB_SRID_FLAG = 0x20000000
+
+# byte order marker of EWKB we write, 1 = little endian (NDR)
+NATIVE_BYTE_ORDER = 1 if sys.byteorder == 'little' else 0
+
+# chords per quarter circle when arcs are linearized, as PostGIS ST_CurveToLine
+SEGMENTS_PER_QUARTER = 32
 
 
 class BaseGeoWKT(object):
@@ -14,36 +32,36 @@ class BaseGeoWKT(object):
         self.srid = srid
 
     @classmethod
+    @timed('wkt_parse')
     def from_wkt(cls, wkt_str):
-        wkt_match = single_wkt_pattern.findall(wkt_str.upper())
-        if wkt_match:
-            obj = cls._from_wkt(wkt_match[0][0].strip(), wkt_match[0][1])
-        else:
-            raise NotImplementedError()
-
-        return cls(obj)
+        """
+        Parse (E)WKT text of a POINT, LINESTRING, CIRCULARSTRING or COMPOUNDCURVE,
+        eg SRID=4326;COMPOUNDCURVE(CIRCULARSTRING(0 0, 1 1, 1 0), (1 0, 0 1))
+        """
+        with gc_paused():
+            return WKTReader(wkt_str).read()
 
     @classmethod
-    def _from_wkt(cls, wkt_tag, wkt_str):
-        obj = []
-        wkt_elements = multi_wkt_pattern.findall(wkt_str)
-        if wkt_elements:
-            for wkt_element in wkt_elements:
-                wkt_element_match = single_wkt_pattern.findall(wkt_element)[0]
-                wkt_element_tag = wkt_element_match[0].strip()
-                wkt_element_data = wkt_element_match[1]
-                if wkt_element_tag in WKT_TAG_CLASS:
-                    obj.append(cls._from_wkt(wkt_element_tag, wkt_element_data))
-                elif wkt_element_tag == '' and wkt_tag == 'COMPOUNDCURVE':
-                    obj.append(cls._from_wkt('LINESTRING', wkt_element_data))
-                else:
-                    raise NotImplementedError()
-        else:
-            points = [Point(p) for p in lon_lat_pattern.findall(wkt_str)]
-            obj = WKT_TAG_CLASS[wkt_tag](points)
-        return obj
+    @timed('ewkb_parse')
+    def from_ewkb(cls, ewkb):
+        """
+        Parse (E)WKB of a POINT, LINESTRING, CIRCULARSTRING or COMPOUNDCURVE
+        :param ewkb: bytes, memoryview or geoalchemy2 WKBElement data, or hex
+            text as SpatiaLite AsEWKB returns it
+        """
+        with gc_paused():
+            return EWKBReader(ewkb).read()
+
+    @property
+    @timed('ewkb_format')
+    def ewkb(self):
+        """
+        :return: EWKB bytes in machine byte order, with the SRID if set
+        """
+        return EWKBWriter().write(self)
 
     @property
+    @timed('wkt_format')
     def wkt(self):
         if self.wkt_tag is None:
             raise NotImplementedError('Set wkt_tag in class')
@@ -63,6 +81,8 @@ class Point(BaseGeoWKT):
     p = Point([0, 0])
     p.wkt = (0 0)
     """
+    wkb_type = WKB_POINT
+
     def __init__(self, obj, wkt_tag=''):
         if type(obj) not in (list, tuple) and len(obj) != 2:
             raise ValueError('Only supply list or tuple')
@@ -70,6 +90,16 @@ class Point(BaseGeoWKT):
         self.x = obj[0]
         self.y = obj[1]
 
+    @classmethod
+    def from_values(cls, values):
+        """
+        Fast constructor for already validated coordinates, used by the readers
+        :param values: list of floats, x first
+        """
+        point = cls.__new__(cls)
+        point.__dict__.update(obj=values, wkt_tag='', srid=0, x=values[0], y=values[1])
+        return point
+
     @property
     def wkt(self):
         return str(self)
@@ -78,12 +108,23 @@ class Point(BaseGeoWKT):
         return ' '.join(str(v) for v in self.obj)
 
 
-class LineString(BaseGeoWKT):
+class _PointSequence(BaseGeoWKT):
+    """
+    Geometry made of a flat list of Points
+    """
+
+    def __str__(self):
+        # same text as joining each Point's wkt, without a call per point
+        return ', '.join([' '.join([str(v) for v in p.obj]) for p in self.obj])
+
+
+class LineString(_PointSequence):
     """
     ls = LineString.from_lon_lat_list([[0, 0], [1, 1], [1, 0]])
     ls = LineString([Point([0, 0]), Point([1, 1]), Point([1, 0])])
     ls.wkt = (0 0, 1 1, 1 0)
     """
+    wkb_type = WKB_LINESTRING
 
     def __init__(self, obj, wkt_tag=''):
         super(LineString, self).__init__(obj)
@@ -94,13 +135,18 @@ class LineString(BaseGeoWKT):
         data = [Point(l) for l in lon_lat_list]
         return cls(data, wkt_tag)
 
+    def linearized_points(self, segments_per_quarter=SEGMENTS_PER_QUARTER):
+        return list(self.obj)
+
 
-class CircularString(BaseGeoWKT):
+class CircularString(_PointSequence):
     """
     cs = CircularString.from_lon_lat_list([[0, 0], [1, 1], [1, 0]])
     cs = CircularString([Point([0, 0]), Point([1, 1]), Point([1, 0])])
     cs.wkt = CIRCULARSTRING(0 0, 1 1, 1 0)
     """
+    wkb_type = WKB_CIRCULARSTRING
+
     def __init__(self, obj, wkt_tag='CircularString'):
         super(CircularString, self).__init__(obj, wkt_tag)
 
@@ -109,12 +155,25 @@ class CircularString(BaseGeoWKT):
         data = [Point(l) for l in lon_lat_list]
         return cls(data, wkt_tag)
 
+    def linearized_points(self, segments_per_quarter=SEGMENTS_PER_QUARTER):
+        """
+        Chords along each arc, in the plane of the coordinates like
+        ST_CurveToLine. The ends of the arcs are kept exactly
+        :return: Point list
+        """
+        points = [self.obj[0]]
+        for i in range(0, len(self.obj) - 2, 2):
+            points.extend(_arc_points(self.obj[i], self.obj[i + 1], self.obj[i + 2], segments_per_quarter)[1:])
+        return points
+
 
 class CompoundCurve(BaseGeoWKT):
     """
     cc = CompoundCurve( [cs, ls] )
     cc.wkt = COMPOUNDCURVE( CIRCULARSTRING(0 0, 1 1, 1 0), (1 0, 0 1) )
     """
+    wkb_type = WKB_COMPOUNDCURVE
+
     def __init__(self, obj, wkt_tag='CompoundCurve', srid=0):
         if type(obj) not in (list, tuple):
             raise ValueError('Only supply list or tuple')
@@ -125,6 +184,312 @@ class CompoundCurve(BaseGeoWKT):
 
         super(CompoundCurve, self).__init__(obj, wkt_tag, srid=srid)
 
+    def linearized(self, segments_per_quarter=SEGMENTS_PER_QUARTER):
+        """
+        The curve as one LineString, its arcs replaced by chords, for stores
+        without curve types such as SpatiaLite
+        """
+        points = []
+        for member in self.obj:
+            for p in member.linearized_points(segments_per_quarter):
+                if not points or p.obj != points[-1].obj:
+                    points.append(p)
+        line = LineString(points, wkt_tag='LineString')
+        line.srid = self.srid
+        return line
+
+
+@contextmanager
+def gc_paused():
+    """
+    Hold off the cyclic garbage collector while a geometry is read. Parsing a
+    million vertices allocates millions of acyclic Point objects, and each
+    allocation threshold crossed makes the collector re-walk all of them, which
+    doubled the read cost per vertex between 1k and 1M vertices.
+    """
+    if not gc.isenabled():
+        yield
+        return
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.enable()
+
+
+def _arc_points(start, middle, end, segments_per_quarter):
+    """
+    :return: Point list from start to end along the circle through the three
+        points, or the straight line if they are collinear
+    """
+    (x1, y1), (x2, y2), (x3, y3) = start.obj[:2], middle.obj[:2], end.obj[:2]
+    d = 2 * (x1 * (y2 - y3) + x2 * (y3 - y1) + x3 * (y1 - y2))
+    if abs(d) < 1e-15:
+        return [start, end]
+
+    sq1, sq2, sq3 = x1 * x1 + y1 * y1, x2 * x2 + y2 * y2, x3 * x3 + y3 * y3
+    cx = (sq1 * (y2 - y3) + sq2 * (y3 - y1) + sq3 * (y1 - y2)) / d
+    cy = (sq1 * (x3 - x2) + sq2 * (x1 - x3) + sq3 * (x2 - x1)) / d
+    radius = math.hypot(x1 - cx, y1 - cy)
+
+    a1 = math.atan2(y1 - cy, x1 - cx)
+    a3 = math.atan2(y3 - cy, x3 - cx)
+    if d > 0:
+        # anticlockwise
+        sweep = (a3 - a1) % (2 * math.pi)
+    else:
+        sweep = -((a1 - a3) % (2 * math.pi))
+
+    n = max(1, int(math.ceil(abs(sweep) / (math.pi / 2) * segments_per_quarter)))
+    points = [start]
+    for k in range(1, n):
+        a = a1 + sweep * k / n
+        points.append(Point([cx + radius * math.cos(a), cy + radius * math.sin(a)]))
+    points.append(end)
+    return points
+
+
+class WKTReader(object):
+    """
+    Single pass (E)WKT reader. The text is scanned left to right once: tags and
+    parentheses are located with str.find and every coordinate list is split and
+    converted with float(), so the cost is linear in the number of vertices.
+    Coordinates may carry a sign and an exponent, eg -1.5e-07.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def read(self):
+        srid = 0
+        self._skip_space()
+        if self.text.startswith(('SRID=', 'srid='), self.pos):
+            end = self.text.find(';', self.pos)
+            if end < 0:
+                raise ValueError('SRID without ; at {}'.format(self.pos))
+            srid = int(self.text[self.pos + 5:end])
+            self.pos = end + 1
+
+        geometry = self._read_tagged()
+        self._skip_space()
+        if self.pos != len(self.text):
+            raise ValueError('Unexpected {!r} at {}'.format(self.text[self.pos:self.pos + 10], self.pos))
+        geometry.srid = srid
+        return geometry
+
+    def _skip_space(self):
+        text, pos = self.text, self.pos
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        self.pos = pos
+
+    def _read_tag(self):
+        self._skip_space()
+        start = pos = self.pos
+        text = self.text
+        while pos < len(text) and text[pos].isalpha():
+            pos += 1
+        self.pos = pos
+        return text[start:pos].upper()
+
+    def _expect(self, char):
+        self._skip_space()
+        if not self.text.startswith(char, self.pos):
+            raise ValueError('Expected {!r} at {}'.format(char, self.pos))
+        self.pos += 1
+
+    def _read_tagged(self, in_compound=False):
+        tag = self._read_tag()
+        if tag not in WKT_TAG_CLASS:
+            raise NotImplementedError('WKT type {!r} not supported'.format(tag))
+
+        if tag == 'COMPOUNDCURVE':
+            return CompoundCurve(self._read_compound_members())
+
+        points = self._read_points()
+        if tag == 'POINT':
+            if len(points) != 1:
+                raise ValueError('POINT must have exactly one coordinate')
+            return points[0]
+        if tag == 'CIRCULARSTRING':
+            return CircularString(points)
+        # linestrings inside a compound curve are written untagged
+        return LineString(points, wkt_tag='' if in_compound else 'LineString')
+
+    def _read_compound_members(self):
+        members = []
+        if self._read_empty():
+            return members
+
+        self._expect('(')
+        while True:
+            self._skip_space()
+            if self.text.startswith('(', self.pos):
+                members.append(LineString(self._read_points()))
+            else:
+                members.append(self._read_tagged(in_compound=True))
+            self._skip_space()
+            if self.text.startswith(',', self.pos):
+                self.pos += 1
+            else:
+                break
+        self._expect(')')
+        return members
+
+    def _read_empty(self):
+        self._skip_space()
+        if self.text[self.pos:self.pos + 5].upper() == 'EMPTY':
+            self.pos += 5
+            return True
+        return False
+
+    def _read_points(self):
+        """
+        Read a parenthesised coordinate list, eg (0 0, -1.5 2e-3)
+        """
+        if self._read_empty():
+            return []
+
+        self._expect('(')
+        end = self.text.find(')', self.pos)
+        if end < 0:
+            raise ValueError('Unclosed ( at {}'.format(self.pos - 1))
+        body = self.text[self.pos:end]
+        self.pos = end + 1
+
+        coords = body.split(',')
+        dimension = len(coords[0].split())
+        try:
+            values = [float(v) for v in body.replace(',', ' ').split()]
+        except ValueError:
+            raise ValueError('Invalid coordinates in {!r}'.format(body[:50]))
+        if dimension < 2 or len(values) != dimension * len(coords):
+            raise ValueError('Invalid coordinates in {!r}'.format(body[:50]))
+
+        new_point = Point.from_values
+        return [new_point(values[i:i + dimension]) for i in range(0, len(values), dimension)]
+
+
+class EWKBWriter(object):
+    """
+    Serialise geometries to EWKB. Coordinates of a point sequence are packed
+    into one array of doubles and copied out in a single call.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, geometry):
+        self._write(geometry, geometry.srid)
+        return b''.join(self.parts)
+
+    def _header(self, wkb_type, srid, dimension):
+        if dimension == 3:
+            wkb_type |= EWKB_Z_FLAG
+        if srid:
+            self.parts.append(struct.pack('=BII', NATIVE_BYTE_ORDER, wkb_type | EWKB_SRID_FLAG, srid))
+        else:
+            self.parts.append(struct.pack('=BI', NATIVE_BYTE_ORDER, wkb_type))
+
+    def _write(self, geometry, srid=0):
+        if isinstance(geometry, CompoundCurve):
+            self._header(WKB_COMPOUNDCURVE, srid, 2)
+            self.parts.append(struct.pack('=I', len(geometry.obj)))
+            for member in geometry.obj:
+                self._write(member)
+            return
+
+        if isinstance(geometry, Point):
+            points = [geometry]
+        else:
+            points = geometry.obj
+        dimension = len(points[0].obj) if points else 2
+        if dimension not in (2, 3):
+            raise ValueError('Only 2 or 3 dimensional points are supported')
+
+        self._header(geometry.wkb_type, srid, dimension)
+        if geometry.wkb_type != WKB_POINT:
+            self.parts.append(struct.pack('=I', len(points)))
+        coordinates = array('d', [v for p in points for v in p.obj])
+        if len(coordinates) != dimension * len(points):
+            raise ValueError('Points have mixed dimensions')
+        self.parts.append(coordinates.tobytes())
+
+
+class EWKBReader(object):
+    """
+    Parse (E)WKB in either byte order. Coordinate blocks are read into an
+    array of doubles in one copy and swapped if the byte order is foreign.
+    """
+
+    def __init__(self, data):
+        if isinstance(data, str):
+            data = bytes.fromhex(data)
+        self.data = bytes(data)
+        self.pos = 0
+
+    def read(self):
+        geometry = self._read()
+        if self.pos != len(self.data):
+            raise ValueError('{} trailing bytes after geometry'.format(len(self.data) - self.pos))
+        return geometry
+
+    def _unpack(self, fmt, size):
+        if self.pos + size > len(self.data):
+            raise ValueError('EWKB truncated at byte {}'.format(self.pos))
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += size
+        return values
+
+    def _read(self, in_compound=False):
+        byte_order, = self._unpack('B', 1)
+        if byte_order not in (0, 1):
+            raise ValueError('Invalid byte order {} at byte {}'.format(byte_order, self.pos - 1))
+        endian = '<' if byte_order else '>'
+        wkb_type, = self._unpack(endian + 'I', 4)
+
+        srid = 0
+        if wkb_type & EWKB_SRID_FLAG:
+            srid, = self._unpack(endian + 'I', 4)
+        if wkb_type & EWKB_M_FLAG:
+            raise NotImplementedError('Measured (M) geometries are not supported')
+        dimension = 3 if wkb_type & EWKB_Z_FLAG else 2
+        wkb_type &= 0x0fffffff
+
+        if wkb_type == WKB_COMPOUNDCURVE:
+            count, = self._unpack(endian + 'I', 4)
+            geometry = CompoundCurve([self._read(in_compound=True) for _ in range(count)])
+        elif wkb_type == WKB_POINT:
+            geometry = self._read_points(1, dimension, byte_order)[0]
+        elif wkb_type in (WKB_LINESTRING, WKB_CIRCULARSTRING):
+            count, = self._unpack(endian + 'I', 4)
+            points = self._read_points(count, dimension, byte_order)
+            if wkb_type == WKB_CIRCULARSTRING:
+                geometry = CircularString(points)
+            else:
+                # linestrings inside a compound curve are written untagged
+                geometry = LineString(points, wkt_tag='' if in_compound else 'LineString')
+        else:
+            raise NotImplementedError('WKB type {} not supported'.format(wkb_type))
+
+        geometry.srid = srid
+        return geometry
+
+    def _read_points(self, count, dimension, byte_order):
+        size = 8 * dimension * count
+        if self.pos + size > len(self.data):
+            raise ValueError('EWKB truncated at byte {}'.format(self.pos))
+        values = array('d')
+        values.frombytes(self.data[self.pos:self.pos + size])
+        self.pos += size
+        if byte_order != NATIVE_BYTE_ORDER:
+            values.byteswap()
+
+        values = values.tolist()
+        new_point = Point.from_values
+        return [new_point(values[i:i + dimension]) for i in range(0, len(values), dimension)]
+
 
 WKT_TAG_CLASS = {
     'POINT': Point,
@@ -141,11 +506,3 @@ if __name__ == '__main__':
     print(cs.wkt)
     print(cc.wkt)
     cc = CompoundCurve.from_wkt(cc.wkt)
-
-
-
-
-
-
-
-
@@ -3,12 +3,19 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from datetime import datetime
+
 from ocean_efficiency.legacy_model.GeoWKT import CompoundCurve
-from ocean_efficiency.legacy_model.Leg import Leg
+from ocean_efficiency.legacy_model.Leg import Leg, LegStraight, describe_leg
+from ocean_efficiency.legacy_model.RouteGeometry import RouteGeometry
 from ocean_efficiency.legacy_model.SailVector import SailVector
+from ocean_efficiency.xmlparse.route_model_iterparse import RouteModelReader
 from itertools import tee, islice, chain
-from ocean_efficiency.model import Journey as ORMJourney
 from ocean_efficiency.utils.db import provide_session
+from ocean_efficiency.utils.instrumentation import timed
+
+# sqlalchemy and the ORM model are imported where the db is used, so the
+# geometry can be used without loading them
 
 
 class Journey(object):
@@ -19,15 +26,45 @@ class Journey(object):
     # updated_on = Column(DateTime(), default=datetime.now, onupdate=datetime.now)
     # geom = Column(Geometry('CompoundCurve', srid=4326))  # , index=True)
 
-    def __init__(self, name, legs, journey_id=None, created_on=None, updated_on=False):
+    def __init__(self, name, legs=None, journey_id=None, created_on=None, updated_on=False, route_geometry=None):
+        """
+        :param legs: Leg list, or None to build them from route_geometry when
+            first needed. The distance and bearing summaries of a journey with
+            a route geometry are read from its arrays without building the legs
+        """
         self.journey_id = journey_id
         self.created_on = created_on
         self.updated_on = updated_on
         self.name = name
-        self.legs = legs
+        self._legs = legs
+        self.route_geometry = route_geometry
+        # segmented leg straights, kept once built so an edit resegments only its legs
+        self._straights = None
 
     @classmethod
+    @timed('journey')
     def from_route_model(cls, route_model):
+        route_geometry = RouteGeometry.from_waypoints(route_model.waypoints)
+        return cls(route_model.name, route_geometry=route_geometry)
+
+    @classmethod
+    @timed('journey')
+    def from_route_xml(cls, source):
+        """
+        Stream the waypoints of a route XML straight into the route geometry,
+        without building the route model
+        :param source: file name, file object or document, see RouteModelReader
+        """
+        reader = RouteModelReader(source)
+        route_geometry = RouteGeometry.from_waypoints(reader)
+        return cls(reader.name, route_geometry=route_geometry)
+
+    @classmethod
+    def from_route_model_per_leg(cls, route_model):
+        """
+        Build the journey one SailVector and Leg at a time with pygeodesy,
+        the reference for the numbers produced by RouteGeometry
+        """
         sail_vectors = [SailVector.from_waypoints(wp1, wp2) for wp1, wp2 in zip(route_model.waypoints, route_model.waypoints[1:])]
 
         legs = []
@@ -36,29 +73,241 @@ class Journey(object):
 
         return cls(route_model.name, legs)
 
+    @property
+    def legs(self):
+        if self._legs is None:
+            self._legs = self.route_geometry.legs()
+        return self._legs
+
     @property
     def leg_parts(self):
         lps = []
         [lps.append(lp) for l in self.legs for lp in (l.incoming_arc, l.leg_straight)]
         return lps
 
+    @property
+    def leg_distances(self):
+        """
+        :return: distance of each leg, turn included (NM)
+        """
+        if self.route_geometry is not None:
+            return self.route_geometry.leg_distance.tolist()
+        return [l.leg_distance for l in self.legs]
+
+    @property
+    def leg_bearings(self):
+        """
+        :return: (initial, final) bearing of each leg's sail vector (degrees)
+        """
+        if self.route_geometry is not None:
+            return list(zip(self.route_geometry.initial_bearing.tolist(), self.route_geometry.final_bearing.tolist()))
+        return [(l.initial_bearing, l.final_bearing) for l in self.legs]
+
+    @property
+    def distance(self):
+        """
+        :return: distance sailed along the journey, turns included (NM)
+        """
+        return sum(self.leg_distances)
+
     @property
     def wkt_obj(self):
-        wkt_lps = [lp.wkt_obj for lp in self.leg_parts]
+        if self._straights is None:
+            # segment every leg straight in one go rather than one leg at a time
+            self._straights = LegStraight.to_segmented_linestrings([l.leg_straight for l in self.legs])
+        straights = self._straights
+        wkt_lps = []
+        [wkt_lps.extend((l.incoming_arc.wkt_obj, s)) for l, s in zip(self.legs, straights)]
         return CompoundCurve(wkt_lps, srid=4326)
 
     @property
     def orm(self):
-        return ORMJourney(name=self.name, geom=self.wkt_obj.wkt)
-        # return ORMJourney(name=self.name, geom=self.wkt_obj.wkt, journey_id=None, created_on=None, updated_on=False)
+        from ocean_efficiency.model import Journey as ORMJourney
+
+        return ORMJourney(name=self.name, **self.geom_columns(self.wkt_obj, self.distance))
+
+    @staticmethod
+    def orm_from_ewkb(name, ewkb, length_nm=None):
+        from ocean_efficiency.model import Journey as ORMJourney
+
+        return ORMJourney(name=name, **Journey.geom_columns(CompoundCurve.from_ewkb(ewkb), length_nm))
+
+    @staticmethod
+    def geom_columns(compound_curve, length_nm=None):
+        """
+        Values of the geometry columns of the journey table: geom, its
+        linearized line, the bounding box of the line and the distance sailed.
+        Geometries are sent as binary EWKB parameters, PostGIS need not parse
+        text. SpatiaLite has no curves, its geom is the line too, as hex EWKB
+        :param length_nm: distance sailed, default the length of the line
+        :return: dict of column name to value
+        """
+        import numpy as np
+        from pygeodesy.utils import m2NM
+        from sqlalchemy import func
+        from ocean_efficiency.utils.geodesy import spherical_distance
+        from ocean_efficiency.utils.spatialite import uses_spatialite
+
+        line = compound_curve.linearized()
+        lons = np.array([p.x for p in line.obj])
+        lats = np.array([p.y for p in line.obj])
+        if length_nm is None:
+            length_nm = float(m2NM(spherical_distance(lats[:-1], lons[:-1], lats[1:], lons[1:]).sum()))
+
+        if uses_spatialite():
+            geom = line_value = func.ST_GeomFromEWKB(line.ewkb.hex())
+        else:
+            geom, line_value = func.ST_GeomFromEWKB(compound_curve.ewkb), func.ST_GeomFromEWKB(line.ewkb)
+        return dict(
+            geom=geom,
+            line=line_value,
+            min_lon=float(lons.min()),
+            min_lat=float(lats.min()),
+            max_lon=float(lons.max()),
+            max_lat=float(lats.max()),
+            length_nm=length_nm,
+        )
 
     @provide_session
     def write_to_db(self, session):
-        session.add(self.orm)
+        from ocean_efficiency.utils.tiles import invalidate_journey_tiles
+
+        orm = self.orm
+        bbox = orm.min_lon, orm.min_lat, orm.max_lon, orm.max_lat
+        session.add(orm)
         session.commit()
+        self.journey_id = orm.journey_id
+        invalidate_journey_tiles(*bbox)
+
+    @provide_session
+    def update_db(self, session):
+        """
+        Write the geometry of an edited journey over the stored one. Its zone
+        crossings are dropped, to be analysed again when next asked for
+        """
+        from ocean_efficiency.model import Journey as ORMJourney, JourneyZoneCrossing
+        from ocean_efficiency.utils.tiles import invalidate_journey_tiles
+
+        if self.journey_id is None:
+            raise ValueError('Write the journey to the db first')
+        # the tiles it was drawn on before the edit
+        old_bbox = session\
+            .query(ORMJourney.min_lon, ORMJourney.min_lat, ORMJourney.max_lon, ORMJourney.max_lat)\
+            .filter(ORMJourney.journey_id == self.journey_id)\
+            .first()
+        session.query(JourneyZoneCrossing)\
+            .filter(JourneyZoneCrossing.journey_id == self.journey_id)\
+            .delete(synchronize_session=False)
+        columns = self.geom_columns(self.wkt_obj, self.distance)
+        values = {getattr(ORMJourney, k): v for k, v in columns.items()}
+        values.update({
+            ORMJourney.zones_analysed_on: None,
+            ORMJourney.updated_on: datetime.now(),
+        })
+        session.query(ORMJourney)\
+            .filter(ORMJourney.journey_id == self.journey_id)\
+            .update(values, synchronize_session=False)
+        session.commit()
+        if old_bbox is not None:
+            invalidate_journey_tiles(*old_bbox)
+        invalidate_journey_tiles(columns['min_lon'], columns['min_lat'], columns['max_lon'], columns['max_lat'])
+
+    def move_waypoint(self, index, latitude, longitude):
+        """
+        :param latitude: degrees
+        :param longitude: degrees
+        """
+        self._replace_legs(self._editable_geometry().move_waypoint(index, latitude, longitude))
+
+    def insert_waypoint(self, index, name, latitude, longitude, radius=0, sail_mode=0):
+        """
+        Insert a waypoint before the one at index, or append it when index is
+        the number of waypoints
+        :param latitude: degrees
+        :param longitude: degrees
+        :param radius: turn radius (NM)
+        :param sail_mode: 1 rhumb, 0 great circle, of the vector arriving at the waypoint
+        """
+        self._replace_legs(
+            self._editable_geometry().insert_waypoint(index, name, latitude, longitude, radius, sail_mode),
+            added=1,
+        )
+
+    def delete_waypoint(self, index):
+        self._replace_legs(self._editable_geometry().delete_waypoint(index), added=-1)
+
+    def set_waypoint_radius(self, index, radius):
+        """
+        :param radius: turn radius (NM)
+        """
+        self._replace_legs(self._editable_geometry().set_radius(index, radius))
+
+    def set_waypoint_sail_mode(self, index, sail_mode):
+        """
+        :param sail_mode: 1 rhumb, 0 great circle, of the vector arriving at the waypoint
+        """
+        self._replace_legs(self._editable_geometry().set_sail_mode(index, sail_mode))
+
+    def _editable_geometry(self):
+        if self.route_geometry is None:
+            raise ValueError('Only a journey built from a RouteGeometry can be edited')
+        return self.route_geometry
+
+    def _replace_legs(self, changed, added=0):
+        """
+        Rebuild the legs an edit of the route geometry changed, and their
+        segmented straights if they have been built
+        :param changed: (start, stop) range of the changed legs, in the edited route
+        :param added: number of legs the edit added (1) or removed (-1)
+        """
+        start, stop = changed
+        if self._legs is None:
+            return
+        legs = Leg.list_from_route_geometry(self.route_geometry, start, stop)
+        self._legs[start:stop - added] = legs
+        if self._straights is not None:
+            self._straights[start:stop - added] = LegStraight.to_segmented_linestrings(
+                [l.leg_straight for l in legs])
+
+    @provide_session
+    def zone_crossings(self, session, refresh=False):
+        """
+        EEZs and countries the stored journey passes through, see ZoneCrossing
+        """
+        from ocean_efficiency.legacy_model.ZoneCrossing import journey_zone_crossings
+        if self.journey_id is None:
+            raise ValueError('Write the journey to the db first')
+        return journey_zone_crossings(self.journey_id, session=session, refresh=refresh)
+
+    @staticmethod
+    @provide_session
+    def read_wkt_obj(journey_id, session):
+        """
+        Read a stored journey geometry back, as EWKB rather than text
+        :param journey_id: journey table primary key
+        :return: CompoundCurve, a LineString on SpatiaLite, or None if there
+            is no such journey
+        """
+        from ocean_efficiency.model import Journey as ORMJourney
+
+        element = session\
+            .query(ORMJourney.geom)\
+            .filter(ORMJourney.journey_id == journey_id)\
+            .scalar()
+        if element is None:
+            return None
+        return CompoundCurve.from_ewkb(element.data)
 
     def __str__(self):
-        msgs = [str(l) for l in self.legs]
+        if self._legs is None and self.route_geometry is not None:
+            route = self.route_geometry
+            msgs = [
+                describe_leg(origin_name, destination_name, rhumb_mode, leg_distance)
+                for origin_name, destination_name, rhumb_mode, leg_distance
+                in zip(route.names, route.names[1:], route.rhumb_mode.tolist(), route.leg_distance.tolist())
+            ]
+        else:
+            msgs = [str(l) for l in self.legs]
         return "\n".join(msgs)
 
 
@@ -7,46 +7,72 @@ import math
 
 from math import pi, cos, sin, radians, sqrt
 
-from sqlalchemy import text
-
 from ocean_efficiency.legacy_model.GeoWKT import Point, CircularString, LineString
 from pygeodesy.ellipsoidalVincenty import LatLon as GCLatLon
 from pygeodesy.sphericalTrigonometry import LatLon as RhumbLatLon
 
 from ocean_efficiency.legacy_model.SailVector import SailVector
-from ocean_efficiency.utils.db import provide_session
+from ocean_efficiency.utils import geodesy
+from ocean_efficiency.utils.immutable import Immutable, memoized
+from ocean_efficiency.utils.instrumentation import count, timed
 
 
-class LegTurnArc(object):
+class LegTurnArc(Immutable):
     """
     Represents the portion of a leg where the ship is turning
     """
-
-    def __init__(self, turn_radius, incoming_bearing, outgoing_bearing, incoming_point=None, outgoing_point=None):
+    __slots__ = (
+        'turn_radius', 'incoming_bearing', 'outgoing_bearing',
+        'incoming_point', 'outgoing_point',
+        'distance', 'turn_angle', 'vector_reduction',
+        '_mid_arc_point',
+    )
+
+    def __init__(self, turn_radius, incoming_bearing, outgoing_bearing, incoming_point=None, outgoing_point=None,
+                 mid_arc_point=None):
         """
         :param turn_radius: (NM)
         :param incoming_bearing: final bearing of ending sail vector (degrees)
         :param outgoing_bearing: initial bearing of following sail vector (degrees)
         :param incoming_point: point at which the ship starts to turn (pygeodesy LatLon)
         :param outgoing_point: point at which the ship finishes the turn (pygeodesy LatLon)
+        :param mid_arc_point: middle of the turning arc, if already known (pygeodesy LatLon)
         """
-        self.turn_radius = turn_radius
-        self.incoming_bearing = incoming_bearing
-        self.outgoing_bearing = outgoing_bearing
-        self.incoming_point = incoming_point
-        self.outgoing_point = outgoing_point
+        self._set(
+            turn_radius=turn_radius,
+            incoming_bearing=incoming_bearing,
+            outgoing_bearing=outgoing_bearing,
+            incoming_point=incoming_point,
+            outgoing_point=outgoing_point,
+            distance=self.calc_distance(turn_radius, incoming_bearing, outgoing_bearing),
+            turn_angle=((((outgoing_bearing - incoming_bearing) % 360) + 540) % 360) - 180,
+            vector_reduction=self.calc_vector_reduction(turn_radius, incoming_bearing, outgoing_bearing),
+        )
+        if mid_arc_point is not None:
+            self._set(_mid_arc_point=mid_arc_point)
 
-    @property
-    def distance(self):
+    @staticmethod
+    def calc_distance(turn_radius, incoming_bearing, outgoing_bearing):
         """
         calc the 2d arc length between 2 sail vectors
         :return: arc_length (NM)
         """
-        full_turn_circumference = 2 * pi * self.turn_radius
-        circumference_arc_ratio = abs(self.outgoing_bearing - self.incoming_bearing) / 360
+        full_turn_circumference = 2 * pi * turn_radius
+        circumference_arc_ratio = abs(outgoing_bearing - incoming_bearing) / 360
 
         return full_turn_circumference * circumference_arc_ratio
 
+    @staticmethod
+    def calc_vector_reduction(turn_radius, incoming_bearing, outgoing_bearing):
+        """
+        The distance to reduce the leg's straight distance by, due to the turning arc
+        :return: vector_reduction (NM)
+        """
+        if outgoing_bearing is None or incoming_bearing is None:
+            return 0
+
+        return turn_radius * math.tan(math.radians(abs(outgoing_bearing - incoming_bearing) / 2))
+
     @property
     def incoming_wkt_point(self):
         if not isinstance(self.incoming_point, (RhumbLatLon, GCLatLon)):
@@ -63,7 +89,7 @@ class LegTurnArc(object):
     def mid_arc_wkt_point(self):
         return Point([self.mid_arc_point.lon, self.mid_arc_point.lat])
 
-    @property
+    @memoized
     def mid_arc_point(self):
         # calculate by pretending to sail from incoming point to turn origin,
         # then turn origin to the middle of the turning arc
@@ -78,166 +104,291 @@ class LegTurnArc(object):
         turn_origin = self.incoming_point.destination(turn_radius_m, bearing_incoming_to_turn_origin)
         return turn_origin.destination(turn_radius_m, bearing_origin_to_mid_arc)
 
-    @property
-    def turn_angle(self):
-        return ((((self.outgoing_bearing - self.incoming_bearing) % 360) + 540) % 360) - 180
-
     @property
     def wkt_obj(self):
         point_list = [self.incoming_wkt_point, self.mid_arc_wkt_point, self.outgoing_wkt_point]
         cs = CircularString(point_list)
         return cs
 
-    @property
-    def vector_reduction(self):
-        """
-        The distance to reduce the leg's straight distance by, due to the turning arc
-        :return: vector_reduction (NM)
-        """
-        if self.outgoing_bearing is None or self.incoming_bearing is None:
-            return 0
-
-        return self.turn_radius * math.tan(math.radians(abs(self.outgoing_bearing - self.incoming_bearing) / 2))
-
 
-class LegStraight(object):
+class LegStraight(Immutable):
     """
     represents straight portion of leg including modifications due to
     incoming and outgoing arcs
     """
+    __slots__ = (
+        'sail_vector', 'incoming_arc', 'outgoing_arc', 'rhumb_mode',
+        'incoming_point', 'outgoing_point', 'distance',
+    )
 
-    def __init__(self, sail_vector, incoming_arc, outgoing_arc):
-        self.sail_vector = sail_vector
-        self.incoming_arc = incoming_arc
-        self.outgoing_arc = outgoing_arc
-        self.rhumb_mode = sail_vector.rhumb_mode
-
-    @property
-    def incoming_point(self):
-        origin_latlon = self.sail_vector.origin_latlon
-        destination_latlon = self.sail_vector.destination_latlon
-        fractional_vector_reduction = self.incoming_arc.vector_reduction / self.sail_vector.distance
+    # longest piece a great circle straight is split into (m), the
+    # max_segment_length of PostGIS ST_Segmentize on geography
+    max_segment_length = 0.1 * 1852
 
-        return origin_latlon.intermediateTo(destination_latlon, fractional_vector_reduction)
+    def __init__(self, sail_vector, incoming_arc, outgoing_arc, incoming_point=None, outgoing_point=None):
+        """
+        incoming_point and outgoing_point may be supplied when they are
+        already known (see RouteGeometry), otherwise they are computed from the arcs
+        """
+        if incoming_point is None:
+            incoming_point = self.intermediate_point(
+                sail_vector, incoming_arc.vector_reduction / sail_vector.distance)
+        if outgoing_point is None:
+            outgoing_point = self.intermediate_point(
+                sail_vector, 1 - (outgoing_arc.vector_reduction / sail_vector.distance))
+
+        self._set(
+            sail_vector=sail_vector,
+            incoming_arc=incoming_arc,
+            outgoing_arc=outgoing_arc,
+            rhumb_mode=sail_vector.rhumb_mode,
+            incoming_point=incoming_point,
+            outgoing_point=outgoing_point,
+            # distance of leg straight including modifications due to incoming and outgoing arcs (NM)
+            distance=sail_vector.distance - incoming_arc.vector_reduction - outgoing_arc.vector_reduction,
+        )
 
-    @property
-    def outgoing_point(self):
-        origin_latlon = self.sail_vector.origin_latlon
-        destination_latlon = self.sail_vector.destination_latlon
-        fractional_vector_reduction = 1 - (self.outgoing_arc.vector_reduction / self.sail_vector.distance)
+    @staticmethod
+    def intermediate_point(sail_vector, fraction):
+        """
+        :return: point at fraction along the sail vector (pygeodesy LatLon)
+        """
+        origin_latlon = sail_vector.origin_latlon
+        destination_latlon = sail_vector.destination_latlon
+        if sail_vector.rhumb_mode:
+            return origin_latlon.intermediateTo(destination_latlon, fraction)
 
-        return origin_latlon.intermediateTo(destination_latlon, fractional_vector_reduction)
+        # ellipsoidal LatLon has no intermediateTo, walk the geodesic instead
+        distance = origin_latlon.distanceTo(destination_latlon, wrap=True)
+        return origin_latlon.destination(distance * fraction, sail_vector.initial_bearing)
 
     @property
     def wkt_obj(self):
         return self.to_segmented_linestring()
 
+    @timed('segmentation')
     def to_segmented_linestring(self):
         """
         :return: segmented linestring
         """
+        if not self.rhumb_mode:
+            return self.to_segmented_linestrings([self])[0]
+
         incoming_point = self.incoming_point
         outgoing_point = self.outgoing_point
         num_segments = int(self.distance % 0.1)
         segment_length = num_segments / incoming_point.distanceTo(outgoing_point)
-        if self.rhumb_mode:
-            points = [Point([incoming_point.lon, incoming_point.lat])]
-            for i in range(1, num_segments):
-                next_point = incoming_point.destination(segment_length*i, self.sail_vector.initial_bearing)
-                points.append(Point([next_point.lon, next_point.lat]))
-            points.append(Point([outgoing_point.lon, outgoing_point.lat]))
-            return LineString(points)
-        else:
-            # use the db
-            lon_lat_list = [
-                [incoming_point.lon, incoming_point.lat],
-                [outgoing_point.lon, outgoing_point.lat]
-            ]
-            linestring = LineString.from_lon_lat_list(lon_lat_list, wkt_tag='LineString')
-            return self._segment_great_circle(linestring, segment_length)
-
-    @provide_session
-    def _segment_great_circle(self, linestring, max_segment_length, session=None):
-        """
-        Executes postgis ST_Segmentize() function to split linestring to points on great circle
-        :return: LineString(BaseGeoWKT)
-        """
-        sql = text("SELECT ST_AsText(ST_Segmentize(ST_GeogFromText( :linestring , :max_segment_length )))")
-        params = {
-            'linestring': linestring,
-            'max_segment_length': max_segment_length,
-        }
-        result = session.execute(sql, params)
-        return LineString.from_wkt(result[0])
-
-    @property
-    def distance(self):
+        points = [Point([incoming_point.lon, incoming_point.lat])]
+        for i in range(1, num_segments):
+            next_point = incoming_point.destination(segment_length*i, self.sail_vector.initial_bearing)
+            points.append(Point([next_point.lon, next_point.lat]))
+        points.append(Point([outgoing_point.lon, outgoing_point.lat]))
+        return LineString(points)
+
+    @classmethod
+    @timed('segmentation')
+    def to_segmented_linestrings(cls, leg_straights):
         """
-        :return: distance of leg straight including modifications due to
-            incoming and outgoing arcs (NM)
+        Segment many leg straights at once. The great circle ones are split in
+        a single batched call of geodesy.segmentize_great_circles, in place of
+        a PostGIS ST_Segmentize round trip per leg, which places the vertices
+        differently, see there
+        :return: list of segmented linestrings, in the order given
         """
-        return self.sail_vector.distance - self.incoming_arc.vector_reduction - self.outgoing_arc.vector_reduction
+        linestrings = [None] * len(leg_straights)
+        great_circles = []
+        for i, ls in enumerate(leg_straights):
+            if ls.rhumb_mode:
+                linestrings[i] = ls.to_segmented_linestring()
+            else:
+                great_circles.append(i)
+
+        if great_circles:
+            incoming = [leg_straights[i].incoming_point for i in great_circles]
+            outgoing = [leg_straights[i].outgoing_point for i in great_circles]
+            segmented = geodesy.segmentize_great_circles(
+                [p.lat for p in incoming], [p.lon for p in incoming],
+                [p.lat for p in outgoing], [p.lon for p in outgoing],
+                cls.max_segment_length,
+            )
+            for i, (lat, lon) in zip(great_circles, segmented):
+                linestrings[i] = LineString.from_lon_lat_list(zip(lon.tolist(), lat.tolist()))
 
+        return linestrings
 
-class Leg(object):
-    def __init__(self, previous_sail_vector, sail_vector, following_sail_vector):
-        self.rhumb_mode = sail_vector.rhumb_mode
-        self.origin_name = sail_vector.origin_name
-        self.destination_name = sail_vector.destination_name
-        self.vector_distance = sail_vector.distance
-        self.initial_bearing = sail_vector.initial_bearing
-        self.final_bearing = sail_vector.final_bearing
-        self.incoming_turn_radius = sail_vector.incoming_turn_radius
-        self.outgoing_turn_radius = sail_vector.outgoing_turn_radius
 
+class Leg(Immutable):
+    __slots__ = (
+        'rhumb_mode', 'origin_name', 'destination_name',
+        'vector_distance', 'initial_bearing', 'final_bearing',
+        'incoming_turn_radius', 'outgoing_turn_radius',
+        'incoming_arc', 'leg_straight', 'outgoing_arc',
+        'leg_distance',
+    )
+
+    def __init__(self, previous_sail_vector, sail_vector, following_sail_vector):
         # first leg has no previous sv
         if previous_sail_vector:
-            self.incoming_arc = LegTurnArc(
-                turn_radius=self.incoming_turn_radius,
-                incoming_bearing=previous_sail_vector.final_bearing,
-                outgoing_bearing=self.initial_bearing
-            )
-            previous_leg_straight = LegStraight(
-                sail_vector=previous_sail_vector,
-                incoming_arc=LegTurnArc(0, 0, 0),
-                outgoing_arc=self.incoming_arc
-            )
+            incoming_turn = (sail_vector.incoming_turn_radius, previous_sail_vector.final_bearing, sail_vector.initial_bearing)
         else:
-            self.incoming_arc = LegTurnArc(0, 0, 0)
-            previous_leg_straight = None
+            incoming_turn = (0, 0, 0)
 
         # last leg has no following sv
         if following_sail_vector:
-            self.outgoing_arc = LegTurnArc(
-                self.outgoing_turn_radius,
-                self.final_bearing,
-                following_sail_vector.initial_bearing
-            )
+            outgoing_turn = (sail_vector.outgoing_turn_radius, sail_vector.final_bearing, following_sail_vector.initial_bearing)
+        else:
+            outgoing_turn = (0, 0, 0)
+
+        # the turn points are known before the (immutable) arcs are built
+        incoming_reduction = LegTurnArc.calc_vector_reduction(*incoming_turn)
+        outgoing_reduction = LegTurnArc.calc_vector_reduction(*outgoing_turn)
+        straight_incoming_point = LegStraight.intermediate_point(
+            sail_vector, incoming_reduction / sail_vector.distance)
+        straight_outgoing_point = LegStraight.intermediate_point(
+            sail_vector, 1 - (outgoing_reduction / sail_vector.distance))
+
+        if previous_sail_vector:
+            # where the previous leg straight ends
+            arc_incoming_point = LegStraight.intermediate_point(
+                previous_sail_vector, 1 - (incoming_reduction / previous_sail_vector.distance))
         else:
-            self.outgoing_arc = LegTurnArc(0, 0, 0)
+            arc_incoming_point = sail_vector.origin_latlon
 
-        self.leg_straight = LegStraight(
+        incoming_arc = LegTurnArc(
+            *incoming_turn,
+            incoming_point=arc_incoming_point,
+            outgoing_point=straight_incoming_point
+        )
+        # outgoing_arc.outgoing_point is not necessary
+        outgoing_arc = LegTurnArc(*outgoing_turn, incoming_point=straight_outgoing_point)
+        leg_straight = LegStraight(
             sail_vector,
-            self.incoming_arc,
-            self.outgoing_arc
+            incoming_arc,
+            outgoing_arc,
+            incoming_point=straight_incoming_point,
+            outgoing_point=straight_outgoing_point,
         )
+        self._set_parts(sail_vector, incoming_arc, leg_straight, outgoing_arc)
 
-        self.incoming_arc.incoming_point = previous_leg_straight.outgoing_point if previous_leg_straight else sail_vector.origin_latlon
-        self.incoming_arc.outgoing_point = self.leg_straight.incoming_point
+    @classmethod
+    def from_route_geometry(cls, route, index):
+        """
+        Build the leg from the precomputed arrays of a RouteGeometry,
+        without any further geodesic computation
+        :param route: RouteGeometry
+        :param index: index of the leg's sail vector in the route
+        """
+        route.compute_points()
+        straight_points = _route_straight_points(route, index)
+        incoming_arc = _route_turn_arc(route, index, outgoing_point=straight_points[0])
+        outgoing_arc = _route_turn_arc(route, index + 1, incoming_point=straight_points[1])
+        return cls._from_route_geometry(route, index, incoming_arc, straight_points, outgoing_arc)
+
+    @classmethod
+    @timed('legs')
+    def list_from_route_geometry(cls, route, start=0, stop=None):
+        """
+        Build the legs of a RouteGeometry. A leg's outgoing arc is the following
+        leg's incoming arc, so each turn and its points are built only once
+        :param route: RouteGeometry
+        :param start: index of the first leg
+        :param stop: index after the last leg, default the end of the route
+        :return: list of Leg
+        """
+        route.compute_points()
+        n = len(route)
+        stop = n if stop is None else stop
+        # one more for the outgoing point of the last arc, unless it ends the route
+        straight_points = [_route_straight_points(route, i) for i in range(start, min(stop + 1, n))]
+        arcs = [
+            _route_turn_arc(
+                route, k,
+                incoming_point=straight_points[k - start - 1][1] if k > start else None,
+                outgoing_point=straight_points[k - start][0] if k < n else None,
+            )
+            for k in range(start, stop + 1)
+        ]
+        count('legs', stop - start)
+        return [
+            cls._from_route_geometry(route, i, arcs[i - start], straight_points[i - start], arcs[i - start + 1])
+            for i in range(start, stop)
+        ]
+
+    @classmethod
+    def _from_route_geometry(cls, route, index, incoming_arc, straight_points, outgoing_arc):
+        sail_vector = SailVector.from_route_geometry(route, index)
+        leg_straight = LegStraight(
+            sail_vector,
+            incoming_arc,
+            outgoing_arc,
+            incoming_point=straight_points[0],
+            outgoing_point=straight_points[1],
+        )
+        leg = cls.__new__(cls)
+        # the route's own figure, so the legs add up to the route's summaries
+        leg._set_parts(sail_vector, incoming_arc, leg_straight, outgoing_arc, float(route.leg_distance[index]))
+        return leg
+
+    def _set_parts(self, sail_vector, incoming_arc, leg_straight, outgoing_arc, leg_distance=None):
+        if leg_distance is None:
+            leg_distance = incoming_arc.distance + leg_straight.distance
+        self._set(
+            rhumb_mode=sail_vector.rhumb_mode,
+            origin_name=sail_vector.origin_name,
+            destination_name=sail_vector.destination_name,
+            vector_distance=sail_vector.distance,
+            initial_bearing=sail_vector.initial_bearing,
+            final_bearing=sail_vector.final_bearing,
+            incoming_turn_radius=sail_vector.incoming_turn_radius,
+            outgoing_turn_radius=sail_vector.outgoing_turn_radius,
+            incoming_arc=incoming_arc,
+            leg_straight=leg_straight,
+            outgoing_arc=outgoing_arc,
+            leg_distance=leg_distance,
+        )
 
-        self.outgoing_arc.incoming_point = self.leg_straight.outgoing_point
-        # self.outgoing_arc.outgoing_point = not necessary
+    def __str__(self):
+        return describe_leg(self.origin_name, self.destination_name, self.rhumb_mode, self.leg_distance)
 
-    @property
-    def leg_distance(self):
-        return self.incoming_arc.distance + self.leg_straight.distance
 
-    def __str__(self):
-        msg = """From %(origin_name)s to %(destination_name)s\n"""
-        msg += """along a """ + "rhumb line" if self.rhumb_mode else "great circle" + "\n"
-        msg += """is a distance of %(leg_distance)sNM\n"""
-        class_dict = self.__dict__
-        class_dict['leg_distance'] = self.leg_distance
-        return msg % class_dict
+def describe_leg(origin_name, destination_name, rhumb_mode, leg_distance):
+    """
+    :return: the text of Leg.__str__, from the leg's summary figures alone
+    """
+    msg = """From %(origin_name)s to %(destination_name)s\n"""
+    msg += """along a """ + "rhumb line" if rhumb_mode else "great circle" + "\n"
+    msg += """is a distance of %(leg_distance)sNM\n"""
+    params = {
+        'origin_name': origin_name,
+        'destination_name': destination_name,
+        'leg_distance': leg_distance,
+    }
+    return msg % params
+
+
+def _route_straight_points(route, index):
+    """
+    :return: (incoming point, outgoing point) of the leg straight of a RouteGeometry
+    """
+    rhumb_mode = bool(route.rhumb_mode[index])
+    return (
+        route.latlon(float(route.straight_incoming_lat[index]), float(route.straight_incoming_lon[index]), rhumb_mode),
+        route.latlon(float(route.straight_outgoing_lat[index]), float(route.straight_outgoing_lon[index]), rhumb_mode),
+    )
 
 
+def _route_turn_arc(route, k, incoming_point=None, outgoing_point=None):
+    """
+    :return: LegTurnArc of the turn at waypoint k of a RouteGeometry
+    """
+    rhumb_mode = bool(route.turn_incoming_rhumb_mode[k])
+    if incoming_point is None:
+        incoming_point = route.latlon(float(route.turn_incoming_lat[k]), float(route.turn_incoming_lon[k]), rhumb_mode)
+    return LegTurnArc(
+        turn_radius=float(route.turn_radius[k]),
+        incoming_bearing=float(route.turn_incoming_bearing[k]),
+        outgoing_bearing=float(route.turn_outgoing_bearing[k]),
+        incoming_point=incoming_point,
+        outgoing_point=outgoing_point,
+        mid_arc_point=route.latlon(float(route.mid_arc_lat[k]), float(route.mid_arc_lon[k]), rhumb_mode),
+    )
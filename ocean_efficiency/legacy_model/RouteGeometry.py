@@ -0,0 +1,351 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+
+from pygeodesy.ellipsoidalVincenty import LatLon as GCLatLon
+from pygeodesy.sphericalTrigonometry import LatLon as RhumbLatLon
+from pygeodesy.utils import m2NM
+
+from ocean_efficiency.utils import geodesy
+from ocean_efficiency.utils.instrumentation import count, timed, timer
+
+
+class RouteGeometry(object):
+    """
+    Struct-of-arrays representation of a route.
+
+    Waypoint arrays have one row per waypoint (n), sail vector arrays one row
+    per pair of consecutive waypoints (n - 1). Turn arrays are indexed by
+    waypoint too: the turn at waypoint k joins sail vector k - 1 to sail
+    vector k, the first and last waypoints have no turn.
+
+    Every distance, bearing and turn-arc reduction of the route is computed in
+    batched array operations on construction, using the same formulae as
+    SailVector and Leg do per object. The tangent and mid-arc points are only
+    needed for the legs and the geometry, they are computed on first use, see
+    compute_points.
+
+    The route can then be edited in place, see move_waypoint etc, which
+    recompute only the part of the arrays an edit reaches.
+    """
+
+    # arrays derived from the waypoints, one row per waypoint and one row per
+    # sail vector, see _recompute
+    turn_arrays = (
+        'turn_radius', 'turn_incoming_bearing', 'turn_outgoing_bearing',
+        'arc_distance', 'vector_reduction', 'turn_angle',
+    )
+    turn_point_arrays = (
+        'turn_incoming_lat', 'turn_incoming_lon', 'turn_incoming_rhumb_mode',
+        'mid_arc_lat', 'mid_arc_lon',
+    )
+    sail_vector_arrays = ('vector_distance_m', 'initial_bearing', 'final_bearing', 'vector_distance')
+    straight_arrays = ('straight_distance', 'leg_distance')
+    straight_point_arrays = (
+        'straight_incoming_lat', 'straight_incoming_lon',
+        'straight_outgoing_lat', 'straight_outgoing_lon',
+    )
+
+    def __init__(self, names, latitudes, longitudes, radii, sail_modes):
+        """
+        :param names: waypoint names
+        :param latitudes: waypoint latitudes (degrees)
+        :param longitudes: waypoint longitudes (degrees)
+        :param radii: waypoint turn radii (NM)
+        :param sail_modes: waypoint sail modes, 1 rhumb, 0 great circle.
+            the sail mode of a waypoint applies to the vector arriving at it
+        """
+        if len(names) < 2:
+            raise ValueError('A route needs at least 2 waypoints')
+
+        self.names = list(names)
+        self.lat = np.asarray(latitudes, dtype=float)
+        self.lon = np.asarray(longitudes, dtype=float)
+        self.radius = np.asarray(radii, dtype=float)
+        self.sail_mode = np.asarray(sail_modes, dtype=bool)
+        self.rhumb_mode = self.sail_mode[1:]
+
+        self.has_points = False
+        self._compute_sail_vectors()
+        self._compute_turns()
+
+    @classmethod
+    def from_waypoints(cls, waypoints):
+        """
+        :param waypoints: xmlparse Waypoint iterable (radians, meters), read once
+            so it can be a streaming reader
+        """
+        names, latitudes, longitudes, radii, sail_modes = [], [], [], [], []
+        # the XML is parsed here too when waypoints is a streaming reader
+        with timer('waypoint_read'):
+            for wp in waypoints:
+                names.append(wp.name)
+                latitudes.append(wp.latitude)
+                longitudes.append(wp.longitude)
+                radii.append(wp.radius)
+                sail_modes.append(wp.sail_mode)
+        count('waypoints', len(names))
+
+        return cls(
+            names,
+            np.degrees(latitudes),
+            np.degrees(longitudes),
+            m2NM(np.array(radii, dtype=float)),
+            sail_modes,
+        )
+
+    def __len__(self):
+        """
+        :return: number of sail vectors (and so legs) in the route
+        """
+        return len(self.rhumb_mode)
+
+    @timed('turn_points')
+    def compute_points(self):
+        """
+        Compute the tangent and mid-arc points, once
+        """
+        if not self.has_points:
+            self._compute_tangent_points()
+            self._compute_mid_arc_points()
+            self.has_points = True
+
+    def move_waypoint(self, index, latitude, longitude):
+        """
+        :param latitude: degrees
+        :param longitude: degrees
+        :return: (start, stop) range of the legs that changed
+        """
+        self.lat[index] = latitude
+        self.lon[index] = longitude
+        return self._recompute(index, index)
+
+    def set_radius(self, index, radius):
+        """
+        :param radius: turn radius (NM)
+        :return: (start, stop) range of the legs that changed
+        """
+        self.radius[index] = radius
+        return self._recompute(index, index)
+
+    def set_sail_mode(self, index, sail_mode):
+        """
+        :param sail_mode: 1 rhumb, 0 great circle, of the vector arriving at the waypoint
+        :return: (start, stop) range of the legs that changed
+        """
+        self.sail_mode[index] = sail_mode
+        return self._recompute(index, index)
+
+    def insert_waypoint(self, index, name, latitude, longitude, radius, sail_mode):
+        """
+        Insert a waypoint before the one at index, or append it when index is
+        the number of waypoints
+        :return: (start, stop) range of the legs that changed, in the new route
+        """
+        if not 0 <= index <= len(self.names):
+            raise IndexError('No waypoint position {}'.format(index))
+
+        self.names.insert(index, name)
+        for array, value in (('lat', latitude), ('lon', longitude), ('radius', radius), ('sail_mode', sail_mode)):
+            setattr(self, array, np.insert(getattr(self, array), index, value))
+        # the rows of the new turn and sail vector are filled in by _recompute
+        self._resize(lambda a, i: np.insert(a, i, 0), index)
+        return self._recompute(index, index)
+
+    def delete_waypoint(self, index):
+        """
+        :return: (start, stop) range of the legs that changed, in the new route
+        """
+        if len(self.names) <= 2:
+            raise ValueError('A route needs at least 2 waypoints')
+        if not 0 <= index < len(self.names):
+            raise IndexError('No waypoint {}'.format(index))
+
+        del self.names[index]
+        for array in ('lat', 'lon', 'radius', 'sail_mode'):
+            setattr(self, array, np.delete(getattr(self, array), index))
+        self._resize(np.delete, index)
+        # the sail vectors either side of the waypoint are now one
+        return self._recompute(index - 1, index)
+
+    def _resize(self, insert_or_delete, index):
+        """
+        Insert or delete a row of every derived array for the waypoint at index,
+        the sail vector row at the vector arriving at it
+        :param insert_or_delete: function of (array, index) returning the new array
+        """
+        for name in self._turn_arrays():
+            setattr(self, name, insert_or_delete(getattr(self, name), index))
+        for name in self.sail_vector_arrays + self._straight_arrays():
+            setattr(self, name, insert_or_delete(getattr(self, name), max(index - 1, 0)))
+
+    def _recompute(self, first, last):
+        """
+        Recompute the derived arrays after waypoints first to last changed.
+        A turn depends on the sail vectors either side of it and a leg straight
+        on the turns at both its ends, so a change reaches no further than 3
+        waypoints either way. That window is computed as a route of its own,
+        which gives the same numbers as the whole route would away from the
+        window's ends, and spliced in
+        :return: (start, stop) range of the legs that changed
+        """
+        self.rhumb_mode = self.sail_mode[1:]
+        n = len(self.names)
+        first, last = max(first, 0), min(last, n - 1)
+        lo, hi = max(first - 3, 0), min(last + 3, n - 1)
+        window = RouteGeometry(
+            self.names[lo:hi + 1],
+            self.lat[lo:hi + 1],
+            self.lon[lo:hi + 1],
+            self.radius[lo:hi + 1],
+            self.sail_mode[lo:hi + 1],
+        )
+        if self.has_points:
+            window.compute_points()
+
+        # the window has no turn at its ends, unless they are the route's ends
+        t0 = lo if lo == 0 else lo + 1
+        t1 = hi if hi == n - 1 else hi - 1
+        for name in self._turn_arrays():
+            getattr(self, name)[t0:t1 + 1] = getattr(window, name)[t0 - lo:t1 - lo + 1]
+        for name in self.sail_vector_arrays:
+            getattr(self, name)[lo:hi] = getattr(window, name)
+        for name in self._straight_arrays():
+            getattr(self, name)[t0:t1] = getattr(window, name)[t0 - lo:t1 - lo]
+
+        return max(first - 2, 0), min(last + 2, n - 1)
+
+    def _turn_arrays(self):
+        return self.turn_arrays + (self.turn_point_arrays if self.has_points else ())
+
+    def _straight_arrays(self):
+        return self.straight_arrays + (self.straight_point_arrays if self.has_points else ())
+
+    @timed('sail_vectors')
+    def _compute_sail_vectors(self):
+        lat1, lon1 = self.lat[:-1], self.lon[:-1]
+        lat2, lon2 = self.lat[1:], self.lon[1:]
+        rhumb = self.rhumb_mode
+        gc = ~rhumb
+
+        self.vector_distance_m = np.zeros(len(self))
+        self.initial_bearing = np.zeros(len(self))
+        self.final_bearing = np.zeros(len(self))
+
+        if rhumb.any():
+            self.vector_distance_m[rhumb] = geodesy.spherical_distance(
+                lat1[rhumb], lon1[rhumb], lat2[rhumb], lon2[rhumb])
+            bearing = geodesy.spherical_initial_bearing(
+                lat1[rhumb], lon1[rhumb], lat2[rhumb], lon2[rhumb])
+            self.initial_bearing[rhumb] = bearing
+            self.final_bearing[rhumb] = bearing
+
+        if gc.any():
+            d, initial, final = geodesy.vincenty_inverse(
+                lat1[gc], lon1[gc], lat2[gc], lon2[gc])
+            self.vector_distance_m[gc] = d
+            self.initial_bearing[gc] = initial
+            self.final_bearing[gc] = final
+
+        self.vector_distance = m2NM(self.vector_distance_m)
+
+    @timed('turns')
+    def _compute_turns(self):
+        n = len(self.names)
+        self.turn_radius = np.zeros(n)
+        self.turn_incoming_bearing = np.zeros(n)
+        self.turn_outgoing_bearing = np.zeros(n)
+
+        self.turn_radius[1:-1] = self.radius[1:-1]
+        self.turn_incoming_bearing[1:-1] = self.final_bearing[:-1]
+        self.turn_outgoing_bearing[1:-1] = self.initial_bearing[1:]
+
+        bearing_change = np.abs(self.turn_outgoing_bearing - self.turn_incoming_bearing)
+        self.arc_distance = (2 * np.pi * self.turn_radius) * (bearing_change / 360)
+        self.vector_reduction = self.turn_radius * np.tan(np.radians(bearing_change / 2))
+        self.turn_angle = ((((self.turn_outgoing_bearing - self.turn_incoming_bearing) % 360) + 540) % 360) - 180
+
+        self.straight_distance = self.vector_distance - self.vector_reduction[:-1] - self.vector_reduction[1:]
+        self.leg_distance = self.arc_distance[:-1] + self.straight_distance
+
+    def _intermediate(self, fraction):
+        """
+        :return: lat, lon of the points at fraction along each sail vector
+        """
+        lat1, lon1 = self.lat[:-1], self.lon[:-1]
+        lat2, lon2 = self.lat[1:], self.lon[1:]
+        rhumb = self.rhumb_mode
+        gc = ~rhumb
+
+        lat = np.zeros(len(self))
+        lon = np.zeros(len(self))
+        if rhumb.any():
+            lat[rhumb], lon[rhumb] = geodesy.spherical_intermediate(
+                lat1[rhumb], lon1[rhumb], lat2[rhumb], lon2[rhumb], fraction[rhumb])
+        if gc.any():
+            lat[gc], lon[gc] = geodesy.vincenty_direct(
+                lat1[gc], lon1[gc], self.vector_distance_m[gc] * fraction[gc], self.initial_bearing[gc])
+        return lat, lon
+
+    def _compute_tangent_points(self):
+        """
+        Points where each leg straight starts and ends, i.e. where the ship
+        finishes the previous turn and starts the next one
+        """
+        self.straight_incoming_lat, self.straight_incoming_lon = self._intermediate(
+            self.vector_reduction[:-1] / self.vector_distance)
+        self.straight_outgoing_lat, self.straight_outgoing_lon = self._intermediate(
+            1 - (self.vector_reduction[1:] / self.vector_distance))
+
+        # a turn starts where the previous straight ends, the first one at the
+        # route origin. the point type follows the sail vector arriving at it
+        self.turn_incoming_lat = np.concatenate([self.lat[:1], self.straight_outgoing_lat])
+        self.turn_incoming_lon = np.concatenate([self.lon[:1], self.straight_outgoing_lon])
+        self.turn_incoming_rhumb_mode = np.concatenate([self.rhumb_mode[:1], self.rhumb_mode])
+
+    def _compute_mid_arc_points(self):
+        """
+        Sail from the turn's incoming point to the turn origin, then from
+        the turn origin to the middle of the turning arc
+        """
+        bearing_to_origin = np.where(
+            self.turn_angle > 0,
+            (self.turn_incoming_bearing + 90) % 360,
+            (self.turn_incoming_bearing + 270) % 360,
+        )
+        bearing_to_mid_arc = (bearing_to_origin + 180 + (self.turn_angle / 2)) % 360
+        turn_radius_m = self.turn_radius * 1852
+
+        lat, lon = self.turn_incoming_lat, self.turn_incoming_lon
+        rhumb = self.turn_incoming_rhumb_mode
+        gc = ~rhumb
+
+        self.mid_arc_lat = np.zeros(len(lat))
+        self.mid_arc_lon = np.zeros(len(lat))
+        if rhumb.any():
+            olat, olon = geodesy.spherical_destination(
+                lat[rhumb], lon[rhumb], turn_radius_m[rhumb], bearing_to_origin[rhumb])
+            self.mid_arc_lat[rhumb], self.mid_arc_lon[rhumb] = geodesy.spherical_destination(
+                olat, olon, turn_radius_m[rhumb], bearing_to_mid_arc[rhumb])
+        if gc.any():
+            olat, olon = geodesy.vincenty_direct(
+                lat[gc], lon[gc], turn_radius_m[gc], bearing_to_origin[gc])
+            self.mid_arc_lat[gc], self.mid_arc_lon[gc] = geodesy.vincenty_direct(
+                olat, olon, turn_radius_m[gc], bearing_to_mid_arc[gc])
+
+    @staticmethod
+    def latlon(lat, lon, rhumb_mode):
+        """
+        :return: pygeodesy LatLon of the type SailVector uses for the sail mode
+        """
+        return RhumbLatLon(lat, lon) if rhumb_mode else GCLatLon(lat, lon)
+
+    def legs(self):
+        """
+        :return: list of Leg, one per sail vector, built from the arrays
+        """
+        from ocean_efficiency.legacy_model.Leg import Leg
+        return Leg.list_from_route_geometry(self)
@@ -8,19 +8,59 @@ from pygeodesy.ellipsoidalVincenty import LatLon as GCLatLon
 from pygeodesy.sphericalTrigonometry import LatLon as RhumbLatLon
 from pygeodesy.utils import m2NM
 
+from ocean_efficiency.utils.immutable import Immutable
+
+
+class SailVector(Immutable):
+    __slots__ = (
+        'rhumb_mode',
+        'origin_name', 'destination_name',
+        'incoming_turn_radius', 'outgoing_turn_radius',
+        'origin_latlon', 'destination_latlon',
+        'distance', 'initial_bearing', 'final_bearing',
+    )
 
-class SailVector(object):
     def __init__(self, rhumb_mode,
                  origin_name, destination_name,
                  incoming_turn_radius, outgoing_turn_radius,
-                 origin_latlon, destination_latlon):
-        self.rhumb_mode = rhumb_mode
-        self.origin_name = origin_name
-        self.destination_name = destination_name
-        self.incoming_turn_radius = incoming_turn_radius
-        self.outgoing_turn_radius = outgoing_turn_radius
-        self.origin_latlon = origin_latlon
-        self.destination_latlon = destination_latlon
+                 origin_latlon, destination_latlon,
+                 distance=None, initial_bearing=None, final_bearing=None):
+        """
+        distance, initial_bearing and final_bearing may be supplied when they
+        are already known (see RouteGeometry), otherwise pygeodesy computes
+        them once, here
+        :param distance: distance between origin and destination (NM)
+        :param initial_bearing: initial bearing (degrees)
+        :param final_bearing: final bearing (degrees)
+        """
+        if distance is None or initial_bearing is None or final_bearing is None:
+            distance, initial_bearing, final_bearing = self._solve(rhumb_mode, origin_latlon, destination_latlon)
+
+        self._set(
+            rhumb_mode=rhumb_mode,
+            origin_name=origin_name,
+            destination_name=destination_name,
+            incoming_turn_radius=incoming_turn_radius,
+            outgoing_turn_radius=outgoing_turn_radius,
+            origin_latlon=origin_latlon,
+            destination_latlon=destination_latlon,
+            distance=distance,
+            initial_bearing=initial_bearing,
+            final_bearing=final_bearing,
+        )
+
+    @staticmethod
+    def _solve(rhumb_mode, origin_latlon, destination_latlon):
+        """
+        :return: distance (NM), initial bearing and final bearing (degrees)
+        """
+        if rhumb_mode:
+            distance = origin_latlon.distanceTo(destination_latlon, wrap=True)
+            initial_bearing = final_bearing = origin_latlon.initialBearingTo(destination_latlon, wrap=True)
+        else:
+            # a single Vincenty inverse solve gives all three
+            distance, initial_bearing, final_bearing = origin_latlon.distanceTo3(destination_latlon, wrap=True)
+        return m2NM(distance), initial_bearing, final_bearing
 
     @classmethod
     def from_nothing(cls):
@@ -53,27 +93,18 @@ class SailVector(object):
                    incoming_turn_radius, outgoing_turn_radius,
                    origin_latlon, destination_latlon)
 
-    @property
-    def distance(self):
-        """
-        :return: distance between origin and destination in nautical miles
-        """
-        return m2NM(self.origin_latlon.distanceTo(self.destination_latlon, wrap=True))
-
-    @property
-    def initial_bearing(self):
-        """
-        :return: initial bearing in degrees
-        """
-        return self.origin_latlon.initialBearingTo(self.destination_latlon, wrap=True)
-
-    @property
-    def final_bearing(self):
+    @classmethod
+    def from_route_geometry(cls, route, index):
         """
-        :return: final bearing in degrees
+        :param route: RouteGeometry
+        :param index: index of the sail vector in the route
         """
-        if self.rhumb_mode:
-            return self.initial_bearing
-        else:
-            return self.origin_latlon.finalBearingTo(self.destination_latlon, wrap=True)
-
+        rhumb_mode = bool(route.rhumb_mode[index])
+        return cls(rhumb_mode,
+                   route.names[index], route.names[index + 1],
+                   float(route.radius[index]), float(route.radius[index + 1]),
+                   route.latlon(float(route.lat[index]), float(route.lon[index]), rhumb_mode),
+                   route.latlon(float(route.lat[index + 1]), float(route.lon[index + 1]), rhumb_mode),
+                   distance=float(route.vector_distance[index]),
+                   initial_bearing=float(route.initial_bearing[index]),
+                   final_bearing=float(route.final_bearing[index]))
@@ -0,0 +1,221 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import text
+
+from ocean_efficiency.legacy_model.GeoWKT import Point
+from ocean_efficiency.model import Journey as ORMJourney, JourneyZoneCrossing
+from ocean_efficiency.utils.db import provide_session
+
+LAYERS = ('eez', 'country')
+
+# positions along the journey closer than this are the same point, where two
+# pieces of one stay in a zone meet at a vertex of the journey
+JOIN_TOLERANCE = 1e-9
+
+# Overlay of the linearized journey with both polygon layers. The line stored
+# with the journey is used, or made from geom for journeys written before it
+# was. It is cut into its segments, each overlaid on its own: a piece of a
+# segment inside a zone is located within that segment, so a journey passing
+# the same place twice, eg a round trip from its home port, has each pass
+# where it is along the journey. The && bbox test lets the planner use the
+# gist indexes of the zone tables before the exact ST_Intersects. The pieces
+# are turned to run the same way as the journey, merge_pieces joins those of
+# one stay in a zone.
+PIECES_SQL = text("""
+WITH journey_line AS (
+    SELECT coalesce(line, ST_CurveToLine(geom)) AS line
+    FROM journey
+    WHERE journey_id = :journey_id
+),
+segments AS (
+    SELECT ST_MakeLine(ST_PointN(j.line, n), ST_PointN(j.line, n + 1)) AS segment, n
+    FROM journey_line j, generate_series(1, ST_NPoints(j.line) - 1) AS n
+),
+measured AS (
+    SELECT segment,
+           sum(ST_Length(segment)) OVER (ORDER BY n) - ST_Length(segment) AS start_length,
+           ST_Length(segment) AS length,
+           sum(ST_Length(segment)) OVER () AS total_length
+    FROM segments
+),
+overlay AS (
+    SELECT 'eez' AS layer, z.geoname AS name, s.segment, s.start_length, s.length, s.total_length,
+           (ST_Dump(ST_Intersection(s.segment, z.geom))).geom AS piece
+    FROM measured s
+    JOIN eez_12nm_v2 z ON z.geom && s.segment AND ST_Intersects(z.geom, s.segment)
+    UNION ALL
+    SELECT 'country' AS layer, w.name AS name, s.segment, s.start_length, s.length, s.total_length,
+           (ST_Dump(ST_Intersection(s.segment, w.geom))).geom AS piece
+    FROM measured s
+    JOIN tm_world_borders_v03 w ON w.geom && s.segment AND ST_Intersects(w.geom, s.segment)
+),
+located AS (
+    SELECT layer, name, piece,
+           (start_length + length * ST_LineLocatePoint(segment, ST_StartPoint(piece))) / total_length
+               AS start_fraction,
+           (start_length + length * ST_LineLocatePoint(segment, ST_EndPoint(piece))) / total_length
+               AS end_fraction
+    FROM overlay
+    WHERE ST_GeometryType(piece) = 'ST_LineString' AND total_length > 0
+),
+oriented AS (
+    SELECT layer, name,
+           CASE WHEN start_fraction <= end_fraction THEN piece ELSE ST_Reverse(piece) END AS piece,
+           least(start_fraction, end_fraction) AS entry_fraction,
+           greatest(start_fraction, end_fraction) AS exit_fraction
+    FROM located
+)
+SELECT layer, name, entry_fraction, exit_fraction,
+       ST_StartPoint(piece) AS entry_point, ST_EndPoint(piece) AS exit_point,
+       ST_Length(piece::geography) / 1852 AS distance_nm
+FROM oriented
+""")
+
+INSERT_SQL = text("""
+INSERT INTO journey_zone_crossing
+    (journey_id, layer, seq, name, entry_fraction, exit_fraction, entry_point, exit_point, distance_nm)
+VALUES (:journey_id, :layer, :seq, :name, :entry_fraction, :exit_fraction,
+        CAST(:entry_point AS geometry), CAST(:exit_point AS geometry), :distance_nm)
+""")
+
+
+class ZoneCrossing(object):
+    """
+    One stay of a journey inside an EEZ or country, from where it enters the
+    zone to where it leaves it
+    """
+
+    def __init__(self, layer, seq, name, entry_fraction, exit_fraction, entry_point, exit_point, distance_nm):
+        """
+        :param layer: 'eez' or 'country'
+        :param seq: order along the journey within the layer, from 1
+        :param entry_fraction: position of the entry along the linearized journey, 0 to 1
+        :param entry_point: GeoWKT Point, lon lat
+        :param distance_nm: distance sailed inside the zone
+        """
+        self.layer = layer
+        self.seq = seq
+        self.name = name
+        self.entry_fraction = entry_fraction
+        self.exit_fraction = exit_fraction
+        self.entry_point = entry_point
+        self.exit_point = exit_point
+        self.distance_nm = distance_nm
+
+    @classmethod
+    def from_orm(cls, row):
+        return cls(
+            row.layer, row.seq, row.name, row.entry_fraction, row.exit_fraction,
+            Point.from_ewkb(row.entry_point.data), Point.from_ewkb(row.exit_point.data), row.distance_nm,
+        )
+
+    def __str__(self):
+        params = dict(
+            layer=self.layer,
+            name=self.name,
+            entry=self.entry_point.wkt,
+            exit=self.exit_point.wkt,
+            distance_nm=self.distance_nm,
+        )
+        return "{layer} {name}: enters at ({entry}), leaves at ({exit}), {distance_nm:.2f}NM".format(**params)
+
+
+def merge_pieces(pieces):
+    """
+    Join the pieces of the journey inside a zone that meet, cut apart by the
+    vertices of the journey, into one stay each, and number the stays along
+    the journey within each layer
+    :param pieces: ZoneCrossing list, seq None
+    :return: ZoneCrossing list, ordered by layer then along the journey
+    """
+    stays = []
+    last = {}
+    for p in sorted(pieces, key=lambda p: (p.layer, p.name, p.entry_fraction, p.exit_fraction)):
+        stay = last.get((p.layer, p.name))
+        if stay is not None and p.entry_fraction - stay.exit_fraction <= JOIN_TOLERANCE:
+            stay.exit_fraction = max(stay.exit_fraction, p.exit_fraction)
+            stay.exit_point = p.exit_point
+            stay.distance_nm += p.distance_nm
+            continue
+        stay = ZoneCrossing(p.layer, None, p.name, p.entry_fraction, p.exit_fraction,
+                            p.entry_point, p.exit_point, p.distance_nm)
+        last[(p.layer, p.name)] = stay
+        stays.append(stay)
+
+    stays.sort(key=lambda c: (LAYERS.index(c.layer), c.entry_fraction, c.exit_fraction, c.name))
+    seq = dict.fromkeys(LAYERS, 0)
+    for stay in stays:
+        seq[stay.layer] += 1
+        stay.seq = seq[stay.layer]
+    return stays
+
+
+def distance_by_zone(crossings):
+    """
+    :param crossings: ZoneCrossing list
+    :return: OrderedDict of (layer, name) to total NM inside the zone, in the
+        order the zones are first entered
+    """
+    totals = OrderedDict()
+    for c in sorted(crossings, key=lambda c: (LAYERS.index(c.layer), c.entry_fraction)):
+        key = (c.layer, c.name)
+        totals[key] = totals.get(key, 0) + c.distance_nm
+    return totals
+
+
+@provide_session
+def analyse_journey(journey_id, session):
+    """
+    Overlay a stored journey with the zone layers and persist the crossings,
+    replacing any from an earlier analysis
+    """
+    from ocean_efficiency.utils.spatialite import uses_spatialite
+    if uses_spatialite():
+        raise NotImplementedError('The zone crossing overlay needs PostGIS')
+    session.query(JourneyZoneCrossing)\
+        .filter(JourneyZoneCrossing.journey_id == journey_id)\
+        .delete(synchronize_session=False)
+    pieces = [ZoneCrossing(r.layer, None, r.name, r.entry_fraction, r.exit_fraction,
+                           r.entry_point, r.exit_point, r.distance_nm)
+              for r in session.execute(PIECES_SQL, dict(journey_id=journey_id))]
+    stays = merge_pieces(pieces)
+    if stays:
+        session.execute(INSERT_SQL, [
+            dict(journey_id=journey_id, layer=c.layer, seq=c.seq, name=c.name,
+                 entry_fraction=c.entry_fraction, exit_fraction=c.exit_fraction,
+                 entry_point=c.entry_point, exit_point=c.exit_point, distance_nm=c.distance_nm)
+            for c in stays
+        ])
+    session.query(ORMJourney)\
+        .filter(ORMJourney.journey_id == journey_id)\
+        .update({ORMJourney.zones_analysed_on: datetime.now()}, synchronize_session=False)
+    session.commit()
+
+
+@provide_session
+def journey_zone_crossings(journey_id, session, refresh=False):
+    """
+    Zone crossings of a stored journey, computed on first request and read
+    back from journey_zone_crossing after that
+    :param refresh: redo the overlay, eg after the zone tables changed
+    :return: ZoneCrossing list, ordered by layer then along the journey
+    """
+    analysed_on = session\
+        .query(ORMJourney.zones_analysed_on)\
+        .filter(ORMJourney.journey_id == journey_id)\
+        .scalar()
+    if analysed_on is None or refresh:
+        analyse_journey(journey_id, session=session)
+
+    rows = session\
+        .query(JourneyZoneCrossing)\
+        .filter(JourneyZoneCrossing.journey_id == journey_id)\
+        .all()
+    crossings = [ZoneCrossing.from_orm(r) for r in rows]
+    return sorted(crossings, key=lambda c: (LAYERS.index(c.layer), c.seq))
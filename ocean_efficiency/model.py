@@ -5,13 +5,84 @@ from __future__ import unicode_literals
 
 from datetime import datetime
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, BigInteger, Float, SmallInteger, Sequence, DateTime
+from sqlalchemy import Column, Integer, String, BigInteger, Float, SmallInteger, Sequence, DateTime, ForeignKey
+from sqlalchemy import LargeBinary, Text
+from sqlalchemy import and_, case, exists, false, func, select, true
+from sqlalchemy.orm import aliased
 from geoalchemy2 import Geometry
 
 Base = declarative_base()
 
-
-class EEZ12(Base):
+# The companion tables of the zone layers are built by utils.subdivide, not
+# created empty by initdb: an empty <table>_approx would make every lookup
+# miss. Their models are kept out of Base.metadata
+CompanionBase = declarative_base()
+
+
+class SubdividedLayer(object):
+    """
+    Mixin for the polygon layers that have companion tables built by
+    ocean_efficiency.utils.subdivide: <table>_subdivided holds each polygon cut
+    by ST_Subdivide into pieces of a few hundred vertices, <table>_approx a
+    simplified inner approximation (all inside the polygon) and outer one (the
+    polygon all inside it).
+
+    Set subdivided and approx to the companion models after declaring both.
+    """
+    subdivided = None
+    approx = None
+
+    @classmethod
+    def point_within(cls, point):
+        """
+        Filter expression equivalent to ST_Within(point, cls.geom), answered
+        from the companion tables when settings.USE_SUBDIVIDED_ZONES is on,
+        which needs them built:
+
+        - not in the outer approximation: not within
+        - in the inner approximation: within
+        - otherwise within if within one of the pieces. A point only on the
+          edges of pieces is on a cut or on the polygon boundary, only then
+          is the full polygon tested
+
+        On SpatiaLite, which has no companion tables, the candidates come from
+        the R*Tree of the layer and are tested with ST_Within
+        """
+        from ocean_efficiency import settings
+        from ocean_efficiency.utils.spatialite import spatial_index_search, uses_spatialite
+        if uses_spatialite():
+            return and_(
+                cls.gid.in_(spatial_index_search(cls.__tablename__, 'geom', point)),
+                func.ST_Within(point, cls.geom),
+            )
+        if not settings.USE_SUBDIVIDED_ZONES:
+            return func.ST_Within(point, cls.geom)
+
+        sub, approx, full = cls.subdivided, cls.approx, aliased(cls)
+        in_piece = exists().where(and_(
+            sub.gid == approx.gid,
+            func.ST_Within(point, sub.geom),
+        ))
+        on_piece_edge = exists().where(and_(
+            sub.gid == approx.gid,
+            sub.geom.ST_Intersects(point),
+        ))
+        in_full_polygon = exists().where(and_(
+            full.gid == approx.gid,
+            func.ST_Within(point, full.geom),
+        ))
+        matches = select([approx.gid]).where(and_(
+            approx.outer_geom.ST_Intersects(point),
+            case([
+                (func.ST_Within(point, approx.inner_geom), true()),
+                (in_piece, true()),
+                (on_piece_edge, in_full_polygon),
+            ], else_=false()),
+        ))
+        return cls.gid.in_(matches)
+
+
+class EEZ12(SubdividedLayer, Base):
     __tablename__ = 'eez_12nm_v2'
     gid = Column(Integer, primary_key=True)
     mrgid = Column(BigInteger)
@@ -29,7 +100,7 @@ class EEZ12(Base):
     geom = Column(Geometry('MultiPolygon', srid=4326))
 
 
-class WorldBorders(Base):
+class WorldBorders(SubdividedLayer, Base):
     __tablename__ = 'tm_world_borders_v03'
     gid = Column(Integer, primary_key=True)
     fips = Column(String(2))
@@ -46,27 +117,154 @@ class WorldBorders(Base):
     geom = Column(Geometry('MultiPolygon', srid=4326))
 
 
+class EEZ12Subdivided(CompanionBase):
+    __tablename__ = 'eez_12nm_v2_subdivided'
+    id = Column(Integer, primary_key=True)
+    gid = Column(Integer, index=True)
+    geom = Column(Geometry('Polygon', srid=4326))
+
+
+class EEZ12Approx(CompanionBase):
+    __tablename__ = 'eez_12nm_v2_approx'
+    gid = Column(Integer, primary_key=True)
+    inner_geom = Column(Geometry('Geometry', srid=4326))
+    outer_geom = Column(Geometry('Geometry', srid=4326))
+
+
+class WorldBordersSubdivided(CompanionBase):
+    __tablename__ = 'tm_world_borders_v03_subdivided'
+    id = Column(Integer, primary_key=True)
+    gid = Column(Integer, index=True)
+    geom = Column(Geometry('Polygon', srid=4326))
+
+
+class WorldBordersApprox(CompanionBase):
+    __tablename__ = 'tm_world_borders_v03_approx'
+    gid = Column(Integer, primary_key=True)
+    inner_geom = Column(Geometry('Geometry', srid=4326))
+    outer_geom = Column(Geometry('Geometry', srid=4326))
+
+
+EEZ12.subdivided, EEZ12.approx = EEZ12Subdivided, EEZ12Approx
+WorldBorders.subdivided, WorldBorders.approx = WorldBordersSubdivided, WorldBordersApprox
+
+
 class Journey(Base):
     __tablename__ = 'journey'
     journey_id = Column(Integer, Sequence('journey_id_seq'), primary_key=True)
     name = Column(String(100))
     created_on = Column(DateTime(), default=datetime.now)
     updated_on = Column(DateTime(), default=datetime.now, onupdate=datetime.now)
+    # a LineString on SpatiaLite, see legacy_model.Journey.geom_columns
     geom = Column(Geometry('CompoundCurve', srid=4326))  # , index=True)
-
+    # geom with its arcs linearized, written with it, so spatial queries use
+    # the index of line and need not linearize every journey they test
+    line = Column(Geometry('LineString', srid=4326))
+    # bounding box of line, degrees, and the distance sailed
+    min_lon = Column(Float)
+    min_lat = Column(Float)
+    max_lon = Column(Float)
+    max_lat = Column(Float)
+    length_nm = Column(Float)
+    # set when the rows of journey_zone_crossing have been computed
+    zones_analysed_on = Column(DateTime())
+
+
+class JourneyZoneCrossing(Base):
+    __tablename__ = 'journey_zone_crossing'
+    journey_id = Column(Integer, ForeignKey('journey.journey_id', ondelete='CASCADE'), primary_key=True)
+    layer = Column(String(20), primary_key=True)  # eez or country
+    seq = Column(Integer, primary_key=True)  # order along the journey within the layer
+    name = Column(String(254))
+    entry_fraction = Column(Float)  # of the linearized journey length
+    exit_fraction = Column(Float)
+    entry_point = Column(Geometry('Point', srid=4326))
+    exit_point = Column(Geometry('Point', srid=4326))
+    distance_nm = Column(Float)
+
+
+class RouteJob(Base):
+    __tablename__ = 'route_job'
+    job_id = Column(Integer, Sequence('route_job_id_seq'), primary_key=True)
+    filename = Column(String(255))
+    xml = Column(LargeBinary)
+    status = Column(String(10), default='queued', index=True)  # queued, running, done, failed
+    attempts = Column(Integer, default=0)
+    worker = Column(String(100))  # host:pid of the worker running it
+    result = Column(Text)
+    error = Column(Text)
+    created_on = Column(DateTime(), default=datetime.now)
+    started_on = Column(DateTime())
+    finished_on = Column(DateTime())
 
 
 """
 create table journey
 (
 	journey_id serial not null primary key ,
-	geom geometry(COMPOUNDCURVE, 4326)
+	geom geometry(COMPOUNDCURVE, 4326),
+	line geometry(LINESTRING, 4326),
+	min_lon double precision,
+	min_lat double precision,
+	max_lon double precision,
+	max_lat double precision,
+	length_nm double precision,
+	zones_analysed_on timestamp
 )
 ;
 
 create index journey_geom_idx
 	on journey (geom)
 ;
+
+create index journey_line_idx
+	on journey using gist (line)
+;
+
+-- an existing journey table, filled by backfill_journey_lines.py before
+-- journey_line_idx is created
+alter table journey add column line geometry(LINESTRING, 4326);
+alter table journey add column min_lon double precision;
+alter table journey add column min_lat double precision;
+alter table journey add column max_lon double precision;
+alter table journey add column max_lat double precision;
+alter table journey add column length_nm double precision;
+alter table journey add column zones_analysed_on timestamp;
+
+create table journey_zone_crossing
+(
+	journey_id integer not null references journey on delete cascade,
+	layer varchar(20) not null,
+	seq integer not null,
+	name varchar(254),
+	entry_fraction double precision,
+	exit_fraction double precision,
+	entry_point geometry(Point, 4326),
+	exit_point geometry(Point, 4326),
+	distance_nm double precision,
+	primary key (journey_id, layer, seq)
+)
+;
+
+create table route_job
+(
+	job_id serial not null primary key,
+	filename varchar(255),
+	xml bytea,
+	status varchar(10),
+	attempts integer,
+	worker varchar(100),
+	result text,
+	error text,
+	created_on timestamp,
+	started_on timestamp,
+	finished_on timestamp
+)
+;
+
+create index ix_route_job_status
+	on route_job (status)
+;
 """
 
 
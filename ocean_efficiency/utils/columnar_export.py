@@ -0,0 +1,292 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+from collections import OrderedDict
+
+from sqlalchemy import LargeBinary, func
+
+from ocean_efficiency.utils.db import create_session, provide_session
+from ocean_efficiency.utils.log.logging_mixin import LoggingMixin
+
+log = LoggingMixin().log
+
+"""
+Bulk export of the journeys and of the legs of routes to columnar files,
+GeoParquet or Arrow IPC, for analytics.
+
+Rows are read through a server side cursor and written chunk_size at a time
+as Arrow record batches, so memory use does not grow with the table. Journey
+geometries are the linearized journey.line as WKB, described by the GeoParquet
+"geo" metadata, other values are typed columns.
+
+The legs are not stored in the db: they are computed from route XMLs, files or
+the uploads of route_job, with the batched RouteGeometry, one route at a time.
+With settings.KEEP_JOB_UPLOADS a done job keeps its upload until its legs
+have been exported.
+
+Requires pyarrow
+"""
+
+FORMATS = ('parquet', 'arrow')
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# GeoParquet 1.0.0 column metadata of the journey geometry. Without a crs the
+# coordinates are OGC:CRS84, lon lat on WGS 84, which is srid 4326 as stored
+JOURNEY_GEO_METADATA = OrderedDict([
+    ('version', '1.0.0'),
+    ('primary_column', 'geometry'),
+    ('columns', OrderedDict([
+        ('geometry', OrderedDict([
+            ('encoding', 'WKB'),
+            ('geometry_types', ['LineString']),
+        ])),
+    ])),
+])
+
+
+def journey_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('journey_id', pa.int32()),
+        ('name', pa.string()),
+        ('created_on', pa.timestamp('us')),
+        ('updated_on', pa.timestamp('us')),
+        ('length_nm', pa.float64()),
+        ('min_lon', pa.float64()),
+        ('min_lat', pa.float64()),
+        ('max_lon', pa.float64()),
+        ('max_lat', pa.float64()),
+        ('geometry', pa.binary()),
+    ], metadata={b'geo': json.dumps(JOURNEY_GEO_METADATA).encode()})
+
+
+def leg_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('route', pa.string()),
+        ('source', pa.string()),
+        ('leg', pa.int32()),
+        ('origin_name', pa.string()),
+        ('destination_name', pa.string()),
+        ('origin_lon', pa.float64()),
+        ('origin_lat', pa.float64()),
+        ('destination_lon', pa.float64()),
+        ('destination_lat', pa.float64()),
+        ('rhumb_mode', pa.bool_()),
+        ('vector_distance_nm', pa.float64()),
+        ('straight_distance_nm', pa.float64()),
+        ('leg_distance_nm', pa.float64()),
+        ('initial_bearing', pa.float64()),
+        ('final_bearing', pa.float64()),
+        ('incoming_turn_radius_nm', pa.float64()),
+        ('outgoing_turn_radius_nm', pa.float64()),
+    ])
+
+
+class BatchFileWriter(object):
+    """
+    Write dict rows to a Parquet or Arrow IPC file, a record batch per
+    chunk_size rows
+    """
+
+    def __init__(self, path, schema, file_format='parquet', chunk_size=DEFAULT_CHUNK_SIZE):
+        if file_format not in FORMATS:
+            raise ValueError('Unknown format {}, one of {}'.format(file_format, ', '.join(FORMATS)))
+        self.schema = schema
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self._columns = {name: [] for name in schema.names}
+        self._pending = 0
+        self._open(path, file_format)
+
+    def _open(self, path, file_format):
+        import pyarrow as pa
+
+        self._sink = None
+        if file_format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+        else:
+            self._sink = pa.OSFile(path, 'wb')
+            self._writer = pa.ipc.new_file(self._sink, self.schema)
+
+    def write(self, row):
+        for name, values in self._columns.items():
+            values.append(row[name])
+        self._pending += 1
+        if self._pending >= self.chunk_size:
+            self.flush()
+
+    def write_columns(self, columns, length):
+        """
+        Write length rows given as a dict of column sequences, eg numpy arrays.
+        They are batched with the other rows, not written as a batch of their
+        own: a Parquet row group per route would be too small to read fast
+        """
+        for name, values in self._columns.items():
+            column = columns[name]
+            values.extend(column.tolist() if hasattr(column, 'tolist') else column)
+        self._pending += length
+        if self._pending >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        columns, self._columns = self._columns, {name: [] for name in self.schema.names}
+        self._write_batch(columns)
+        self.rows += self._pending
+        self._pending = 0
+
+    def _write_batch(self, columns):
+        import pyarrow as pa
+
+        batch = pa.record_batch([columns[name] for name in self.schema.names], schema=self.schema)
+        self._writer.write_batch(batch)
+
+    def _close(self):
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def journey_line_wkb():
+    """
+    SQL expression of the WKB of the journey line. On PostGIS a journey
+    written before journey.line existed is linearized here
+    """
+    from ocean_efficiency.model import Journey
+    from ocean_efficiency.utils.spatialite import uses_spatialite
+
+    line = Journey.line
+    if not uses_spatialite():
+        line = func.coalesce(Journey.line, func.ST_CurveToLine(Journey.geom))
+    return func.ST_AsBinary(line, type_=LargeBinary)
+
+
+@provide_session
+def export_journeys(path, session, file_format='parquet', chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write every journey to path
+    :return: number of journeys written
+    """
+    from ocean_efficiency.model import Journey
+
+    query = session\
+        .query(Journey.journey_id, Journey.name, Journey.created_on, Journey.updated_on, Journey.length_nm,
+               Journey.min_lon, Journey.min_lat, Journey.max_lon, Journey.max_lat,
+               journey_line_wkb().label('geometry'))\
+        .order_by(Journey.journey_id)\
+        .execution_options(stream_results=True)\
+        .yield_per(chunk_size)
+
+    with BatchFileWriter(path, journey_schema(), file_format, chunk_size) as writer:
+        for r in query:
+            row = r._asdict()
+            if row['geometry'] is not None:
+                # psycopg2 returns a memoryview
+                row['geometry'] = bytes(row['geometry'])
+            writer.write(row)
+    log.info("Exported %s journeys to %s", writer.rows, path)
+    return writer.rows
+
+
+def leg_columns(route_geometry, route, source):
+    """
+    The legs of one route as columns, from the arrays of the RouteGeometry,
+    with the values of the Leg attributes of the same names: the leg of sail
+    vector k has the turn radius of waypoint k in and of waypoint k + 1 out
+    :return: dict of column name to sequence, number of legs
+    """
+    rg = route_geometry
+    n = len(rg)
+    columns = dict(
+        route=[route] * n,
+        source=[source] * n,
+        leg=list(range(n)),
+        origin_name=rg.names[:-1],
+        destination_name=rg.names[1:],
+        origin_lon=rg.lon[:-1],
+        origin_lat=rg.lat[:-1],
+        destination_lon=rg.lon[1:],
+        destination_lat=rg.lat[1:],
+        rhumb_mode=rg.rhumb_mode,
+        vector_distance_nm=rg.vector_distance,
+        straight_distance_nm=rg.straight_distance,
+        leg_distance_nm=rg.leg_distance,
+        initial_bearing=rg.initial_bearing,
+        final_bearing=rg.final_bearing,
+        incoming_turn_radius_nm=rg.radius[:-1],
+        outgoing_turn_radius_nm=rg.radius[1:],
+    )
+    return columns, n
+
+
+def export_legs(path, routes, file_format='parquet', chunk_size=DEFAULT_CHUNK_SIZE, written=None):
+    """
+    Write the legs of each route to path, a route that cannot be read is
+    logged and skipped
+    :param routes: iterable of (source, route XML file name or bytes)
+    :param written: list the sources of the routes written are appended to
+    :return: (legs written, list of (source, error))
+    """
+    from ocean_efficiency.legacy_model.RouteGeometry import RouteGeometry
+    from ocean_efficiency.xmlparse.route_model_iterparse import RouteModelReader
+
+    failures = []
+    with BatchFileWriter(path, leg_schema(), file_format, chunk_size) as writer:
+        for source, xml in routes:
+            try:
+                reader = RouteModelReader(io.BytesIO(xml) if isinstance(xml, bytes) else xml)
+                route_geometry = RouteGeometry.from_waypoints(reader)
+            except Exception as ex:
+                log.warning("Skipped %s: %s: %s", source, type(ex).__name__, ex)
+                failures.append((source, '{}: {}'.format(type(ex).__name__, ex)))
+                continue
+            writer.write_columns(*leg_columns(route_geometry, reader.name, source))
+            if written is not None:
+                written.append(source)
+    log.info("Exported %s legs to %s", writer.rows, path)
+    return writer.rows, failures
+
+
+def route_job_xmls(chunk_size=100, job_ids=None):
+    """
+    Generator of (source, xml) of the uploads processed by the route workers,
+    those of the jobs done since they were last exported, see drop_uploads
+    :param job_ids: dict the sources yielded are mapped to their job id in
+    """
+    from ocean_efficiency.model import RouteJob
+    from ocean_efficiency.utils.job_queue import DONE
+
+    # the session lasts as long as the generator, not provide_session's call
+    with create_session() as session:
+        query = session\
+            .query(RouteJob.job_id, RouteJob.filename, RouteJob.xml)\
+            .filter(RouteJob.status == DONE)\
+            .filter(RouteJob.xml.isnot(None))\
+            .order_by(RouteJob.job_id)\
+            .execution_options(stream_results=True)\
+            .yield_per(chunk_size)
+        for r in query:
+            source = 'route_job/{}/{}'.format(r.job_id, r.filename)
+            if job_ids is not None:
+                job_ids[source] = r.job_id
+            yield source, bytes(r.xml)
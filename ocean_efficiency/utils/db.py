@@ -5,8 +5,10 @@ from __future__ import unicode_literals
 from functools import wraps
 
 import contextlib
+from time import perf_counter
 
 from ocean_efficiency import settings
+from ocean_efficiency.utils import instrumentation
 from ocean_efficiency.utils.log.logging_mixin import LoggingMixin
 
 log = LoggingMixin().log
@@ -17,7 +19,7 @@ def create_session():
     """
     Contextmanager that will create and teardown a session.
     """
-    session = settings.Session()
+    session = settings.get_session()
     try:
         yield session
         session.expunge_all()
@@ -36,8 +38,19 @@ def provide_session(func):
     database transaction, you pass it to the function, if not this wrapper
     will create one and close it for you.
     """
+    name = getattr(func, '__qualname__', func.__name__)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
+        if not instrumentation.is_enabled():
+            return _call_with_session(*args, **kwargs)
+        start = perf_counter()
+        try:
+            return _call_with_session(*args, **kwargs)
+        finally:
+            instrumentation.observe(instrumentation.DB_CALL_SECONDS, perf_counter() - start, function=name)
+
+    def _call_with_session(*args, **kwargs):
         arg_session = 'session'
 
         func_params = func.__code__.co_varnames
@@ -57,22 +70,31 @@ def provide_session(func):
 
 def initdb():
     from ocean_efficiency.model import Base
+    from ocean_efficiency.utils import spatialite
 
-    Base.metadata.create_all(settings.engine)
+    if spatialite.uses_spatialite():
+        spatialite.initdb(settings.get_engine(), Base.metadata.sorted_tables)
+        return
+    Base.metadata.create_all(settings.get_engine())
 
 
 def resetdb():
     from ocean_efficiency.model import Base
+    from ocean_efficiency.utils import spatialite
 
+    engine = settings.get_engine()
     metadata = Base.metadata
-    metadata.reflect(bind=settings.engine)
+    # dependent tables first, created again in reverse
+    tables = ['journey_zone_crossing', 'journey', 'route_job']
 
-    def drop_create_table(name, metadata):
-        metadata.tables[name].drop(settings.engine, checkfirst=True)
-        metadata.tables[name].create(settings.engine)
+    if spatialite.uses_spatialite():
+        spatialite.resetdb(engine, [metadata.tables[t] for t in tables])
+        return
 
-    tables = ['journey']
+    metadata.reflect(bind=engine)
     for t in tables:
-        drop_create_table(t, metadata)
+        metadata.tables[t].drop(engine, checkfirst=True)
+    for t in reversed(tables):
+        metadata.tables[t].create(engine)
 
 
@@ -0,0 +1,316 @@
+"""
+Array counterparts of the pygeodesy formulae used by the legacy model.
+
+The spherical functions mirror pygeodesy.sphericalTrigonometry.LatLon and the
+vincenty functions mirror pygeodesy.ellipsoidalVincenty.LatLon (WGS84), so that
+a whole route can be computed in a handful of numpy operations while producing
+the same numbers as the per point pygeodesy objects.
+
+Angles are in degrees and distances in meters unless stated otherwise.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+
+from pygeodesy.datum import Datums
+from pygeodesy.ellipsoidalVincenty import VincentyError
+from pygeodesy.utils import R_M, EPS
+
+WGS84 = Datums.WGS84.ellipsoid
+
+# same convergence settings as pygeodesy.ellipsoidalVincenty.LatLon
+VINCENTY_EPSILON = 1.0e-12
+VINCENTY_ITERATIONS = 50
+
+
+def wrap(angle, wrap_to, limit):
+    """
+    Vectorised pygeodesy.utils._wrap: wrap angle into (wrap_to - limit, wrap_to]
+    """
+    angle = np.asarray(angle, dtype=float)
+    out = np.array(angle, copy=True)
+    outside = ~((wrap_to >= angle) & (angle > (wrap_to - limit)))
+    wrapped = out[outside] % limit
+    wrapped = np.where(wrapped > wrap_to, wrapped - limit, wrapped)
+    out[outside] = wrapped
+    return out
+
+
+def degrees90(rad):
+    return wrap(np.degrees(rad), 90, 360)
+
+
+def degrees180(rad):
+    return wrap(np.degrees(rad), 180, 360)
+
+
+def degrees360(rad):
+    return wrap(np.degrees(rad), 360, 360)
+
+
+def unroll_pi(rad1, rad2, wrap_lon=True):
+    """
+    Vectorised pygeodesy.utils.unrollPI
+    :return: (longitudinal delta, unrolled rad2) (radians)
+    """
+    r = rad2 - rad1
+    if not wrap_lon:
+        return r, rad2
+    u = np.where(np.abs(r) > np.pi, wrap(r, np.pi, 2 * np.pi), r)
+    return u, np.where(u != r, rad1 + u, rad2)
+
+
+def haversine(a1, b1, a2, b2, wrap_lon=False):
+    """
+    Angular distance between points (radians in, radians out)
+    """
+    db, _ = unroll_pi(b1, b2, wrap_lon=wrap_lon)
+    h = np.sin((a2 - a1) * 0.5) ** 2 + np.cos(a1) * np.cos(a2) * np.sin(db * 0.5) ** 2
+    with np.errstate(invalid='ignore'):
+        r = np.arctan2(np.sqrt(h), np.sqrt(1 - h)) * 2
+    return np.where(np.isnan(r), np.where(h < 0.5, 0.0, np.pi), r)
+
+
+def spherical_distance(lat1, lon1, lat2, lon2, radius=R_M, wrap_lon=True):
+    """
+    :return: distance along the great circle of a sphere (same units as radius)
+    """
+    a1, b1, a2, b2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    return haversine(a1, b1, a2, b2, wrap_lon=wrap_lon) * radius
+
+
+def spherical_initial_bearing(lat1, lon1, lat2, lon2, wrap_lon=True):
+    """
+    :return: initial great circle bearing (compass degrees)
+    """
+    a1, b1, a2, b2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    db, _ = unroll_pi(b1, b2, wrap_lon=wrap_lon)
+
+    x = np.cos(a1) * np.sin(a2) - np.sin(a1) * np.cos(a2) * np.cos(db)
+    y = np.sin(db) * np.cos(a2)
+    return degrees360(np.arctan2(y, x))
+
+
+def spherical_intermediate(lat1, lon1, lat2, lon2, fraction):
+    """
+    Point at fraction along the great circle of a sphere between two points
+    :return: (lat, lon) arrays (degrees)
+    """
+    a1, b1, a2, b2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    fraction = np.asarray(fraction, dtype=float)
+
+    r = haversine(a1, b1, a2, b2)
+    far = r > EPS
+    sr = np.where(far, np.sin(r), 1.0)
+
+    A = np.sin((1 - fraction) * r) / sr
+    B = np.sin(fraction * r) / sr
+
+    x = A * np.cos(a1) * np.cos(b1) + B * np.cos(a2) * np.cos(b2)
+    y = A * np.cos(a1) * np.sin(b1) + B * np.cos(a2) * np.sin(b2)
+    z = A * np.sin(a1) + B * np.sin(a2)
+
+    # points too close, interpolate linearly
+    a = np.where(far, np.arctan2(z, np.hypot(x, y)), a1 + fraction * (a2 - a1))
+    b = np.where(far, np.arctan2(y, x), b1 + fraction * (b2 - b1))
+    return np.degrees(a), np.degrees(b)
+
+
+def spherical_destination(lat, lon, distance, bearing, radius=R_M):
+    """
+    Point reached after travelling distance on an initial bearing around a sphere
+    :return: (lat, lon) arrays (degrees)
+    """
+    a, b = np.radians(lat), np.radians(lon)
+    r = np.asarray(distance, dtype=float) / float(radius)
+    t = np.radians(bearing)
+
+    ca, cr, ct = np.cos(a), np.cos(r), np.cos(t)
+    sa, sr, st = np.sin(a), np.sin(r), np.sin(t)
+
+    a2 = np.arcsin(ct * sr * ca + cr * sa)
+    d = np.arctan2(st * sr * ca, cr - sa * np.sin(a2))
+    return degrees90(a2), degrees180(b + d)
+
+
+def _reduced(lat, f):
+    t = (1 - f) * np.tan(np.radians(lat))
+    c = 1 / np.hypot(1, t)
+    return c, t * c, t
+
+
+def _p2(u2):
+    A = (16384 + u2 * (4096 + u2 * (-768 + u2 * (320 + u2 * -175)))) / 16384
+    B = (u2 * (256 + u2 * (-128 + u2 * (74 + u2 * -47)))) / 1024
+    return A, B
+
+
+def _dl(f, c2a, sa, s, cs, ss, c2sm):
+    C = f / 16.0 * c2a * (4 + f * (4 - 3 * c2a))
+    return (1 - C) * f * sa * (s + C * ss * (c2sm + C * cs * (2 * c2sm ** 2 - 1)))
+
+
+def _ds(B, cs, ss, c2sm):
+    c2sm2 = 2 * c2sm ** 2 - 1
+    ss2 = (4 * ss ** 2 - 3) * (2 * c2sm2 - 1)
+    return B * ss * (c2sm + B / 4.0 * (c2sm2 * cs - B / 6.0 * c2sm * ss2))
+
+
+def vincenty_inverse(lat1, lon1, lat2, lon2, wrap_lon=True, ellipsoid=WGS84):
+    """
+    Vincenty's inverse method on arrays of point pairs. Every pair iterates
+    until it converges on its own, like a single pygeodesy call would.
+    :return: (distance (m), initial bearing, final bearing)
+    :raise VincentyError: coincident points or no convergence
+    """
+    E = ellipsoid
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (lat1, lon1, lat2, lon2)])
+
+    c1, s1, _ = _reduced(lat1, E.f)
+    c2, s2, _ = _reduced(lat2, E.f)
+    c1c2, s1c2 = c1 * c2, s1 * c2
+    c1s2, s1s2 = c1 * s2, s1 * s2
+
+    dl = lon2 - lon1
+    if wrap_lon:
+        dl = np.where(np.abs(dl) > 180, wrap(dl, 180, 360), dl)
+    ll = dl = np.radians(dl)
+
+    shape = dl.shape
+    s = np.zeros(shape)
+    cs = np.zeros(shape)
+    ss = np.zeros(shape)
+    c2a = np.zeros(shape)
+    c2sm = np.zeros(shape)
+    active = np.ones(shape, dtype=bool)
+
+    for _ in range(VINCENTY_ITERATIONS):
+        cll, sll = np.cos(ll), np.sin(ll)
+        ss_ = np.hypot(c2 * sll, c1s2 - s1c2 * cll)
+        if np.any(active & (ss_ < EPS)):
+            raise VincentyError('coincident points')
+        ss_ = np.where(ss_ < EPS, 1.0, ss_)
+        cs_ = s1s2 + c1c2 * cll
+        s_ = np.arctan2(ss_, cs_)
+
+        sa = c1c2 * sll / ss_
+        c2a_ = 1 - sa ** 2
+        equatorial = np.abs(c2a_) < EPS
+        c2a_ = np.where(equatorial, 0.0, c2a_)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c2sm_ = np.where(equatorial, 0.0, cs_ - 2 * s1s2 / np.where(equatorial, 1.0, c2a_))
+        ll_ = np.where(equatorial,
+                       dl + E.f * sa * s_,
+                       dl + _dl(E.f, c2a_, sa, s_, cs_, ss_, c2sm_))
+
+        # freeze converged pairs exactly as the scalar loop would leave them
+        s = np.where(active, s_, s)
+        cs = np.where(active, cs_, cs)
+        ss = np.where(active, ss_, ss)
+        c2a = np.where(active, c2a_, c2a)
+        c2sm = np.where(active, c2sm_, c2sm)
+        converged = np.abs(ll_ - ll) < VINCENTY_EPSILON
+        ll = np.where(active, ll_, ll)
+        active &= ~converged
+        if not active.any():
+            break
+    else:
+        raise VincentyError('no convergence')
+
+    A, B = _p2(c2a * E.e22)
+    s = np.where(c2a != 0, A * (s - _ds(B, cs, ss, c2sm)), s)
+    d = E.b * s
+
+    cll, sll = np.cos(ll), np.sin(ll)
+    initial = degrees360(np.arctan2(c2 * sll, c1s2 - s1c2 * cll))
+    final = degrees360(np.arctan2(c1 * sll, -s1c2 + c1s2 * cll))
+    return d, initial, final
+
+
+def vincenty_direct(lat, lon, distance, bearing, ellipsoid=WGS84):
+    """
+    Vincenty's direct method on arrays of start points, distances and bearings
+    :return: (lat, lon) arrays (degrees)
+    :raise VincentyError: no convergence
+    """
+    E = ellipsoid
+    lat, lon, distance, bearing = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (lat, lon, distance, bearing)])
+
+    c1, s1, t1 = _reduced(lat, E.f)
+
+    i = np.radians(bearing)
+    ci, si = np.cos(i), np.sin(i)
+    s12 = np.arctan2(t1, ci) * 2
+
+    sa = c1 * si
+    c2a = 1 - sa ** 2
+    degenerate = c2a < EPS
+    c2a = np.where(degenerate, 0.0, c2a)
+    A, B = _p2(c2a * E.e22)
+    A = np.where(degenerate, 1.0, A)
+    B = np.where(degenerate, 0.0, B)
+
+    s = d = distance / (E.b * A)
+    cs, ss, c2sm = np.cos(s), np.sin(s), np.cos(s12 + s)
+    active = np.ones(s.shape, dtype=bool)
+    for _ in range(VINCENTY_ITERATIONS):
+        cs_, ss_, c2sm_ = np.cos(s), np.sin(s), np.cos(s12 + s)
+        s_ = d + _ds(B, cs_, ss_, c2sm_)
+
+        cs = np.where(active, cs_, cs)
+        ss = np.where(active, ss_, ss)
+        c2sm = np.where(active, c2sm_, c2sm)
+        converged = np.abs(s_ - s) < VINCENTY_EPSILON
+        s = np.where(active, s_, s)
+        active &= ~converged
+        if not active.any():
+            break
+    else:
+        raise VincentyError('no convergence')
+
+    t = s1 * ss - c1 * cs * ci
+    lat2 = degrees90(np.arctan2(s1 * cs + c1 * ss * ci, (1 - E.f) * np.hypot(sa, t)))
+    lon2 = degrees180(np.arctan2(ss * si, c1 * cs - s1 * ss * ci) -
+                      _dl(E.f, c2a, sa, s, cs, ss, c2sm) +
+                      np.radians(lon))
+    return lat2, lon2
+
+
+def segmentize_great_circles(lat1, lon1, lat2, lon2, max_segment_length, radius=R_M):
+    """
+    Segment many great circle edges at once, in process, with no piece longer
+    than max_segment_length. Each edge is split into
+    ceil(length / max_segment_length) pieces of equal length along the great
+    circle of a sphere with the WGS84 mean radius, the edge endpoints are kept
+    exactly.
+
+    The vertices are not those of PostGIS ST_Segmentize(geography): it bisects
+    each edge until the pieces are short enough, 2^k pieces, so only where
+    that is the count here are they the same points.
+
+    :param max_segment_length: (m)
+    :return: list with one (lat, lon) pair of arrays per edge, endpoints included
+    """
+    lat1, lon1, lat2, lon2 = [np.atleast_1d(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2)]
+    if max_segment_length <= 0:
+        raise ValueError('max_segment_length must be positive')
+
+    length = spherical_distance(lat1, lon1, lat2, lon2, radius=radius, wrap_lon=False)
+    segments = np.maximum(np.ceil(length / max_segment_length), 1).astype(int)
+
+    # vertex fractions of every edge in one flat array, 0 .. 1 inclusive
+    counts = segments + 1
+    edge = np.repeat(np.arange(len(segments)), counts)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    step = np.arange(counts.sum()) - offsets[edge]
+    fraction = step / segments[edge]
+
+    lat, lon = spherical_intermediate(lat1[edge], lon1[edge], lat2[edge], lon2[edge], fraction)
+
+    first, last = offsets[:-1], offsets[1:] - 1
+    lat[first], lon[first] = lat1, lon1
+    lat[last], lon[last] = lat2, lon2
+    return list(zip(np.split(lat, offsets[1:-1]), np.split(lon, offsets[1:-1])))
@@ -0,0 +1,58 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from functools import wraps
+
+
+class Immutable(object):
+    """
+    Base class for value objects that are frozen once constructed.
+
+    Subclasses declare __slots__ and assign them with _set() in __init__.
+    Any later assignment raises AttributeError.
+    """
+    __slots__ = ()
+
+    def _set(self, **values):
+        setattr_ = object.__setattr__
+        for name, value in values.items():
+            setattr_(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("can't set '{}', {} is immutable".format(name, type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError("can't delete '{}', {} is immutable".format(name, type(self).__name__))
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in _slots(type(self)) if hasattr(self, name)}
+
+    def __setstate__(self, state):
+        self._set(**state)
+
+
+def memoized(func):
+    """
+    Property decorator for Immutable subclasses. The value is computed on first
+    access and kept in the slot named after the function with a leading
+    underscore, which the subclass must declare in __slots__.
+    """
+    slot = '_' + func.__name__
+
+    @wraps(func)
+    def wrapper(self):
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            value = func(self)
+            object.__setattr__(self, slot, value)
+            return value
+
+    return property(wrapper)
+
+
+def _slots(cls):
+    for klass in cls.__mro__:
+        for name in getattr(klass, '__slots__', ()):
+            yield name
@@ -0,0 +1,241 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+
+from ocean_efficiency import settings
+
+"""
+Timers and counters of the hot paths of route processing and of the web
+handlers, exported in the Prometheus text format by /metrics.
+
+A stage is timed with the timed decorator or the timer context manager. Only
+the outermost call of a stage in a thread is timed, so recursive or nested
+calls of the same stage (a CompoundCurve formatting its parts) are counted
+once. Switched on by settings.INSTRUMENTATION_ENABLED or enable(). When off,
+a timed call costs one global lookup more than the plain call.
+"""
+
+# histogram bucket upper bounds, seconds
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+STAGE_SECONDS = 'ocean_efficiency_stage_seconds'
+DB_CALL_SECONDS = 'ocean_efficiency_db_call_seconds'
+HTTP_REQUEST_SECONDS = 'ocean_efficiency_http_request_seconds'
+ITEMS_TOTAL = 'ocean_efficiency_items_total'
+
+HELP = {
+    STAGE_SECONDS: 'Time spent in each stage of route processing',
+    DB_CALL_SECONDS: 'Time spent in each db function, session included',
+    HTTP_REQUEST_SECONDS: 'Time to handle each web request',
+    ITEMS_TOTAL: 'Items processed, eg waypoints read and legs built',
+}
+
+# lookup cache figures that go up and down, the others only go up
+LOOKUP_CACHE_GAUGES = ('entries', 'bytes')
+
+# connection pool figures that go up and down, the others only go up
+POOL_GAUGES = (
+    'pool_size', 'checked_out', 'checked_in', 'overflow', 'overflow_max', 'checkout_wait_max_seconds',
+)
+
+_enabled = settings.INSTRUMENTATION_ENABLED
+_active = threading.local()
+
+
+def enable(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+class Registry(object):
+    """
+    Histograms and counters, keyed by metric name and label values
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # (name, labels) to [bucket counts..., count, sum]
+            self.histograms = {}
+            # (name, labels) to value
+            self.counters = {}
+
+    def observe(self, name, seconds, labels=()):
+        """
+        :param labels: tuple of (label, value) pairs
+        """
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            values = self.histograms.get((name, labels))
+            if values is None:
+                values = self.histograms[(name, labels)] = [0] * (len(self.buckets) + 1) + [0.0]
+            if i < len(self.buckets):
+                values[i] += 1
+            values[-2] += 1
+            values[-1] += seconds
+
+    def count(self, name, value=1, labels=()):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def prometheus_text(self):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            histograms = {k: list(v) for k, v in self.histograms.items()}
+            counters = dict(self.counters)
+
+        lines = []
+        for name in sorted({n for n, _ in histograms}):
+            _header(lines, name, 'histogram')
+            for (n, labels), values in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, in_bucket in zip(self.buckets, values):
+                    cumulative += in_bucket
+                    lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', repr(bound)),)), cumulative))
+                lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', '+Inf'),)), values[-2]))
+                lines.append('{}_sum{} {!r}'.format(name, _labels(labels), values[-1]))
+                lines.append('{}_count{} {}'.format(name, _labels(labels), values[-2]))
+        for name in sorted({n for n, _ in counters}):
+            _header(lines, name, 'counter')
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append('{}{} {}'.format(name, _labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _header(lines, name, metric_type):
+    if name in HELP:
+        lines.append('# HELP {} {}'.format(name, HELP[name]))
+    lines.append('# TYPE {} {}'.format(name, metric_type))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in escaped) + '}'
+
+
+registry = Registry()
+
+
+def observe(name, seconds, **labels):
+    registry.observe(name, seconds, tuple(sorted(labels.items())))
+
+
+def count(item, value=1):
+    """
+    Count items processed, when enabled
+    """
+    if _enabled:
+        registry.count(ITEMS_TOTAL, value, (('item', item),))
+
+
+@contextmanager
+def timer(stage):
+    """
+    Time the block as a stage, when enabled
+    """
+    if not _enabled:
+        yield
+        return
+
+    active = getattr(_active, 'stages', None)
+    if active is None:
+        active = _active.stages = set()
+    if stage in active:
+        # nested call of the same stage, the outer one is timed
+        yield
+        return
+
+    active.add(stage)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        active.discard(stage)
+        observe(STAGE_SECONDS, perf_counter() - start, stage=stage)
+
+
+def timed(stage):
+    """
+    Decorator timing each call of the function as a stage, when enabled
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def prometheus_text():
+    """
+    :return: the registry's metrics, with the lookup caches' and the
+        connection pool's if the engine has been created
+    """
+    text = registry.prometheus_text()
+    text += lookup_cache_text()
+    if settings.engine is not None:
+        from ocean_efficiency.utils.sqlalchemy import pool_metrics
+
+        lines = []
+        for key, value in sorted(pool_metrics.snapshot(settings.engine.pool).items()):
+            if key in POOL_GAUGES:
+                name = 'ocean_efficiency_pool_' + key
+                _header(lines, name, 'gauge')
+            else:
+                name = 'ocean_efficiency_pool_{}_total'.format(key)
+                _header(lines, name, 'counter')
+            lines.append('{} {!r}'.format(name, value))
+        text += '\n'.join(lines) + '\n'
+    return text
+
+
+def lookup_cache_text():
+    """
+    :return: the lookup cache counters, labelled by cache number, see
+        lookup_cache.cached_lookup
+    """
+    from ocean_efficiency.utils.lookup_cache import lookup_cache_stats
+
+    all_stats = lookup_cache_stats()
+    if not all_stats:
+        return ''
+    lines = []
+    for key in sorted(all_stats[0]):
+        if key in LOOKUP_CACHE_GAUGES:
+            name = 'ocean_efficiency_lookup_cache_' + key
+            _header(lines, name, 'gauge')
+        else:
+            name = 'ocean_efficiency_lookup_cache_{}_total'.format(key)
+            _header(lines, name, 'counter')
+        for i, stats in enumerate(all_stats):
+            lines.append('{}{} {!r}'.format(name, _labels((('cache', i),)), stats[key]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,311 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import exc, func
+
+from ocean_efficiency import settings
+from ocean_efficiency.model import RouteJob
+from ocean_efficiency.utils.db import provide_session
+from ocean_efficiency.utils.log.logging_mixin import LoggingMixin
+from ocean_efficiency.utils.spatialite import uses_spatialite
+
+log = LoggingMixin().log
+
+"""
+Route processing queue kept in the route_job table.
+
+The web app enqueues uploaded XML and returns straight away, route_worker.py
+processes run the jobs. A worker picks the oldest queued job with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers on any number of
+hosts can poll the same table without waiting on each other's locks, and
+claims it with an UPDATE conditional on it still being queued: SQLite has no
+row locks, two workers may pick the same job there, one claims it.
+
+Times are the database's clock, not the hosts' of the workers, which may
+disagree.
+"""
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# julianday of 1970-01-01 00:00
+UNIX_EPOCH_JULIAN_DAY = 2440587.5
+
+
+def worker_name():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def db_now(session):
+    """
+    :return: the database's time, local on PostgreSQL, UTC on SQLite
+    """
+    if uses_spatialite():
+        # CURRENT_TIMESTAMP has whole seconds, julianday milliseconds
+        days = session.query(func.julianday('now')).scalar()
+        return datetime(1970, 1, 1) + timedelta(days=days - UNIX_EPOCH_JULIAN_DAY)
+    return session.query(func.localtimestamp()).scalar()
+
+
+@provide_session
+def enqueue(xml, filename, session):
+    """
+    :param xml: route XML document, bytes
+    :return: job id
+    """
+    job = RouteJob(filename=filename, xml=xml, status=QUEUED, attempts=0, created_on=db_now(session))
+    session.add(job)
+    session.commit()
+    return job.job_id
+
+
+def _oldest_queued(session):
+    """
+    :return: id of the oldest queued job no other worker has locked, or None
+    """
+    return session\
+        .query(RouteJob.job_id)\
+        .filter(RouteJob.status == QUEUED)\
+        .order_by(RouteJob.job_id)\
+        .with_for_update(skip_locked=True)\
+        .limit(1)\
+        .scalar()
+
+
+@provide_session
+def claim(session, worker=None):
+    """
+    Mark the oldest queued job as running by this worker
+    :return: (job id, xml, filename), or None if the queue is empty
+    """
+    worker = worker or worker_name()
+    while True:
+        job_id = _oldest_queued(session)
+        if job_id is None:
+            session.rollback()
+            return None
+
+        claimed = session.query(RouteJob)\
+            .filter(RouteJob.job_id == job_id)\
+            .filter(RouteJob.status == QUEUED)\
+            .update({
+                RouteJob.status: RUNNING,
+                RouteJob.worker: worker,
+                RouteJob.attempts: func.coalesce(RouteJob.attempts, 0) + 1,
+                RouteJob.started_on: db_now(session),
+            }, synchronize_session=False)
+        if not claimed:
+            # claimed by another worker since it was read
+            session.rollback()
+            continue
+
+        xml, filename = session.query(RouteJob.xml, RouteJob.filename).filter(RouteJob.job_id == job_id).one()
+        session.commit()
+        return job_id, xml, filename
+
+
+@provide_session
+def finish(job_id, worker, session, result=None, error=None):
+    """
+    Record the outcome of a job running on worker, done with result or failed
+    with error. A job requeued as stale and claimed again since is left to
+    the worker running it now
+    :return: True if the outcome was recorded
+    """
+    values = {
+        RouteJob.status: FAILED if error is not None else DONE,
+        RouteJob.result: result,
+        RouteJob.error: error,
+        RouteJob.finished_on: db_now(session),
+    }
+    if error is not None or not settings.KEEP_JOB_UPLOADS:
+        # a done job's upload may be kept for the legs export, see
+        # drop_uploads, a failed one's is not needed any more
+        values[RouteJob.xml] = None
+    updated = session.query(RouteJob)\
+        .filter(RouteJob.job_id == job_id)\
+        .filter(RouteJob.worker == worker)\
+        .filter(RouteJob.status == RUNNING)\
+        .update(values, synchronize_session=False)
+    session.commit()
+    if not updated:
+        log.warning("Job %s is not running on %s any more, its outcome is dropped", job_id, worker)
+    return bool(updated)
+
+
+@provide_session
+def drop_uploads(job_ids, session):
+    """
+    Delete the uploaded XML of done jobs, once their legs are exported
+    :return: number of jobs updated
+    """
+    dropped = 0
+    job_ids = list(job_ids)
+    # in chunks, the ids are bound parameters
+    for i in range(0, len(job_ids), 500):
+        dropped += session.query(RouteJob)\
+            .filter(RouteJob.job_id.in_(job_ids[i:i + 500]))\
+            .filter(RouteJob.status == DONE)\
+            .update({RouteJob.xml: None}, synchronize_session=False)
+    session.commit()
+    return dropped
+
+
+@provide_session
+def requeue_stale(timeout, session, max_attempts=3):
+    """
+    Put back jobs left running longer than timeout seconds, eg by a worker
+    that died, or fail them once they have had max_attempts
+    :return: number of jobs requeued or failed
+    """
+    now = db_now(session)
+    stale = session\
+        .query(RouteJob)\
+        .filter(RouteJob.status == RUNNING)\
+        .filter(RouteJob.started_on < now - timedelta(seconds=timeout))\
+        .with_for_update(skip_locked=True)\
+        .all()
+    for job in stale:
+        log.warning("Job %s on %s is stale", job.job_id, job.worker)
+        if job.attempts >= max_attempts:
+            job.status = FAILED
+            job.error = 'gave up after {} attempts'.format(job.attempts)
+            job.finished_on = now
+        else:
+            job.status = QUEUED
+    session.commit()
+    return len(stale)
+
+
+@provide_session
+def job_status(job_id, session):
+    """
+    :return: dict of the job's status, and its result or error when finished,
+        or None for an unknown job
+    """
+    job = session\
+        .query(RouteJob.job_id, RouteJob.filename, RouteJob.status, RouteJob.result, RouteJob.error,
+               RouteJob.created_on, RouteJob.started_on, RouteJob.finished_on)\
+        .filter(RouteJob.job_id == job_id)\
+        .first()
+    if job is None:
+        return None
+    status = dict(
+        job_id=job.job_id,
+        filename=job.filename,
+        status=job.status,
+        created_on=job.created_on.isoformat() if job.created_on else None,
+        started_on=job.started_on.isoformat() if job.started_on else None,
+        finished_on=job.finished_on.isoformat() if job.finished_on else None,
+    )
+    if job.status == DONE:
+        status['result'] = job.result
+    elif job.status == FAILED:
+        status['error'] = job.error
+    return status
+
+
+def _seconds_between(start, end):
+    """
+    SQL expression of the seconds from start to end, timestamps
+    """
+    if uses_spatialite():
+        # SQLite stores them as text, julianday parses it to fractional days
+        return (func.julianday(end) - func.julianday(start)) * 86400
+    return func.extract('epoch', end - start)
+
+
+@provide_session
+def queue_stats(session, window=3600):
+    """
+    :param window: seconds of finished jobs the latency figures cover
+    :return: dict with queue depth per status, age of the oldest queued job and
+        mean wait (queued to started) and run time (started to finished)
+    """
+    now = db_now(session)
+    counts = dict(session
+                  .query(RouteJob.status, func.count(RouteJob.job_id))
+                  .filter(RouteJob.status.in_([QUEUED, RUNNING]))
+                  .group_by(RouteJob.status)
+                  .all())
+    oldest = session\
+        .query(func.min(RouteJob.created_on))\
+        .filter(RouteJob.status == QUEUED)\
+        .scalar()
+    wait_s, run_s, finished = session\
+        .query(func.avg(_seconds_between(RouteJob.created_on, RouteJob.started_on)),
+               func.avg(_seconds_between(RouteJob.started_on, RouteJob.finished_on)),
+               func.count(RouteJob.job_id))\
+        .filter(RouteJob.finished_on >= now - timedelta(seconds=window))\
+        .one()
+
+    return dict(
+        queued=counts.get(QUEUED, 0),
+        running=counts.get(RUNNING, 0),
+        oldest_queued_s=(now - oldest).total_seconds() if oldest else 0,
+        finished_last_window=finished,
+        mean_wait_s=float(wait_s or 0),
+        mean_run_s=float(run_s or 0),
+    )
+
+
+def process(xml):
+    """
+    The work of a job, what upload_file used to do in the request
+    :return: the text of the journey
+    """
+    import io
+    from ocean_efficiency.legacy_model.Journey import Journey
+
+    j = Journey.from_route_xml(io.BytesIO(xml))
+    return str(j)
+
+
+def run_worker(poll_interval=1.0, stale_timeout=600, max_jobs=None, max_backoff=60):
+    """
+    Claim and process jobs until max_jobs have run (forever when None),
+    sleeping poll_interval seconds while the queue is empty. A db error is
+    logged and retried after a backoff, doubling up to max_backoff seconds
+    """
+    worker = worker_name()
+    done = 0
+    last_stale_check = 0
+    backoff = 0
+    log.info("Route worker %s started", worker)
+    while max_jobs is None or done < max_jobs:
+        try:
+            if time.time() - last_stale_check > stale_timeout / 10:
+                requeue_stale(stale_timeout)
+                last_stale_check = time.time()
+
+            claimed = claim(worker=worker)
+            if claimed is None:
+                time.sleep(poll_interval)
+                continue
+
+            job_id, xml, filename = claimed
+            done += 1
+            start = time.time()
+            try:
+                result = process(bytes(xml))
+            except Exception as ex:
+                log.exception("Job %s (%s) failed", job_id, filename)
+                finish(job_id, worker, error='{}: {}'.format(type(ex).__name__, ex))
+            else:
+                if finish(job_id, worker, result=result):
+                    log.info("Job %s (%s) done in %.2fs", job_id, filename, time.time() - start)
+            backoff = 0
+        except exc.DBAPIError as ex:
+            # a job claimed and not finished is requeued once stale
+            backoff = min(max(backoff * 2, poll_interval), max_backoff)
+            log.error("Route worker %s: db error, retrying in %.1fs: %s", worker, backoff, ex)
+            time.sleep(backoff)
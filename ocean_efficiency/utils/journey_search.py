@@ -0,0 +1,219 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+
+from geoalchemy2 import Geography
+from pygeodesy.utils import R_M
+from sqlalchemy import and_, cast, func, or_, select, text
+from sqlalchemy.orm import aliased
+
+from ocean_efficiency import settings
+from ocean_efficiency.model import EEZ12, Journey
+from ocean_efficiency.utils.db import provide_session
+from ocean_efficiency.utils.spatialite import spatial_index_search, uses_spatialite
+
+"""
+Spatial searches over the stored journeys: those crossing a lon lat box, an
+EEZ, or passing within a distance of a point.
+
+Every search takes its candidates from the index of journey.line, the
+linearized journey written with it (see legacy_model.Journey.geom_columns),
+before any exact test, so its cost follows the number of journeys near the
+area rather than the number stored. A journey whose bounding box lies inside
+a searched box is a match without the exact test.
+
+Results are ordered by journey_id, pages continue after the last id returned.
+"""
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+METERS_PER_NM = 1852
+
+# the distance test is on the spheroid, the boxes of the index search on a
+# sphere: widened by this factor they cover the spheroid circle too
+SPHERE_MARGIN = 1.01
+
+# fill journey.line and the columns computed from it for journeys written
+# before they existed, batch_size journeys per statement
+BACKFILL_SQL = text("""
+UPDATE journey
+SET line = l.line,
+    min_lon = ST_XMin(l.line),
+    min_lat = ST_YMin(l.line),
+    max_lon = ST_XMax(l.line),
+    max_lat = ST_YMax(l.line),
+    length_nm = coalesce(journey.length_nm, ST_Length(l.line::geography) / 1852)
+FROM (
+    SELECT journey_id, ST_CurveToLine(geom) AS line
+    FROM journey
+    WHERE line IS NULL AND geom IS NOT NULL
+    ORDER BY journey_id
+    LIMIT :batch_size
+) l
+WHERE journey.journey_id = l.journey_id
+""")
+
+
+def envelope(box):
+    """
+    :param box: (min_lon, min_lat, max_lon, max_lat)
+    """
+    if uses_spatialite():
+        return func.BuildMbr(box[0], box[1], box[2], box[3], 4326)
+    return func.ST_MakeEnvelope(box[0], box[1], box[2], box[3], 4326)
+
+
+def split_antimeridian(box):
+    """
+    :param box: (min_lon, min_lat, max_lon, max_lat), min_lon > max_lon for
+        a box across the antimeridian
+    :return: list of one or two boxes within -180..180
+    """
+    min_lon, min_lat, max_lon, max_lat = box
+    if min_lon <= max_lon:
+        return [box]
+    return [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+
+
+def circle_boxes(lon, lat, radius_nm):
+    """
+    Boxes covering the circle of radius_nm about the point, the exact bounds of
+    a circle on the sphere, widened by SPHERE_MARGIN
+    :return: list of one or two (min_lon, min_lat, max_lon, max_lat)
+    """
+    radius = radius_nm * METERS_PER_NM * SPHERE_MARGIN / R_M
+    dlat = math.degrees(radius)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90 or math.sin(radius) >= math.cos(math.radians(lat)):
+        # a pole is within the circle, all longitudes are
+        return [(-180.0, max(min_lat, -90.0), 180.0, min(max_lat, 90.0))]
+
+    dlon = math.degrees(math.asin(math.sin(radius) / math.cos(math.radians(lat))))
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180:
+        min_lon += 360
+    elif max_lon > 180:
+        max_lon -= 360
+    return split_antimeridian((min_lon, min_lat, max_lon, max_lat))
+
+
+def in_line_index(box, journey=Journey):
+    """
+    Filter expression of the journeys whose line's bounding box intersects
+    the box, answered by the spatial index
+    """
+    if uses_spatialite():
+        return journey.journey_id.in_(spatial_index_search('journey', 'line', envelope(box)))
+    return journey.line.intersects(envelope(box))
+
+
+def _search(session, condition, limit, after):
+    query = session\
+        .query(Journey.journey_id, Journey.name, Journey.length_nm,
+               Journey.min_lon, Journey.min_lat, Journey.max_lon, Journey.max_lat)\
+        .filter(condition)
+    if after is not None:
+        query = query.filter(Journey.journey_id > after)
+    rows = query\
+        .order_by(Journey.journey_id)\
+        .limit(min(limit, MAX_LIMIT))\
+        .all()
+    return [
+        dict(
+            journey_id=r.journey_id,
+            name=r.name,
+            length_nm=r.length_nm,
+            bbox=[r.min_lon, r.min_lat, r.max_lon, r.max_lat],
+        )
+        for r in rows
+    ]
+
+
+@provide_session
+def journeys_in_bbox(min_lon, min_lat, max_lon, max_lat, session, limit=DEFAULT_LIMIT, after=None):
+    """
+    Journeys crossing the box, which crosses the antimeridian if min_lon > max_lon
+    :param after: journey_id the previous page ended with
+    :return: list of dicts of journey_id, name, length_nm and bbox
+    """
+    conditions = []
+    for box in split_antimeridian((min_lon, min_lat, max_lon, max_lat)):
+        contained = and_(
+            Journey.min_lon >= box[0],
+            Journey.min_lat >= box[1],
+            Journey.max_lon <= box[2],
+            Journey.max_lat <= box[3],
+        )
+        conditions.append(and_(
+            in_line_index(box),
+            or_(contained, func.ST_Intersects(Journey.line, envelope(box))),
+        ))
+    return _search(session, or_(*conditions), limit, after)
+
+
+@provide_session
+def journeys_in_zone(gid, session, limit=DEFAULT_LIMIT, after=None):
+    """
+    Journeys crossing the EEZ12 zone, tested against its subdivided pieces
+    when settings.USE_SUBDIVIDED_ZONES is on
+    :param gid: eez_12nm_v2 primary key
+    :return: list as journeys_in_bbox, or None if there is no such zone
+    """
+    if session.query(EEZ12.gid).filter(EEZ12.gid == gid).scalar() is None:
+        return None
+
+    if uses_spatialite():
+        zone_geom = select([EEZ12.geom]).where(EEZ12.gid == gid).as_scalar()
+        condition = and_(
+            Journey.journey_id.in_(spatial_index_search('journey', 'line', zone_geom)),
+            func.ST_Intersects(Journey.line, zone_geom),
+        )
+        return _search(session, condition, limit, after)
+
+    # the journeys are found from the zone side, through their line index,
+    # and joined back by id
+    zone = EEZ12.subdivided if settings.USE_SUBDIVIDED_ZONES else EEZ12
+    journey = aliased(Journey)
+    crossing = select([journey.journey_id]).where(and_(
+        zone.gid == gid,
+        journey.line.intersects(zone.geom),
+        func.ST_Intersects(journey.line, zone.geom),
+    ))
+    return _search(session, Journey.journey_id.in_(crossing), limit, after)
+
+
+@provide_session
+def journeys_near(lon, lat, radius_nm, session, limit=DEFAULT_LIMIT, after=None):
+    """
+    Journeys passing within radius_nm of the point, on the spheroid
+    :return: list as journeys_in_bbox
+    """
+    meters = radius_nm * METERS_PER_NM
+    if uses_spatialite():
+        point = func.MakePoint(lon, lat, 4326)
+        within = func.ST_Distance(Journey.line, point, 1) <= meters
+    else:
+        point = func.ST_SetSRID(func.ST_MakePoint(lon, lat), 4326)
+        within = func.ST_DWithin(cast(Journey.line, Geography), cast(point, Geography), meters)
+
+    candidates = or_(*[in_line_index(box) for box in circle_boxes(lon, lat, radius_nm)])
+    return _search(session, and_(candidates, within), limit, after)
+
+
+def backfill_lines(batch_size=1000, engine=None):
+    """
+    Linearize the journeys written before journey.line existed, PostGIS only
+    :return: number of journeys updated
+    """
+    engine = engine or settings.get_engine()
+    total = 0
+    while True:
+        with engine.begin() as connection:
+            updated = connection.execute(BACKFILL_SQL, batch_size=batch_size).rowcount
+        total += updated
+        if updated < batch_size:
+            return total
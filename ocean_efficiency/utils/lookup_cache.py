@@ -0,0 +1,248 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from ocean_efficiency import settings
+
+"""
+Result cache for zone / country lookups of a point.
+
+Points are quantized to settings.LOOKUP_CACHE_PRECISION decimal places of a
+degree (6 is about 0.1 m) and the lookup runs on the quantized point, so a
+cached value is exactly what the lookup returns for its key. Entries are
+evicted least recently used first, after LOOKUP_CACHE_TTL seconds, and when
+the entry count or the estimated size exceed their caps.
+
+The zone tables are reloaded by another process, the loader: it touches the
+settings.ZONE_RELOAD_STAMP file, see mark_zone_tables_reloaded. Every process
+compares the stamp's mtime with the one its caches were filled under, at most
+every ZONE_RELOAD_CHECK_SECONDS, and empties them when it has moved.
+"""
+
+MISSING = object()
+
+
+def quantize(lon, lat, precision):
+    """
+    :return: (lon, lat) rounded to precision decimal places of a degree
+    """
+    return round(float(lon), precision), round(float(lat), precision)
+
+
+def estimate_size(value):
+    """
+    Rough size in bytes of a cache key or value made of tuples, lists,
+    strings and numbers
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(estimate_size(v) for v in value)
+    return size
+
+
+class LRUTTLCache(object):
+    """
+    Thread safe LRU cache with a time to live and a memory cap
+    """
+
+    def __init__(self, max_entries, ttl, max_bytes, clock=time.monotonic):
+        """
+        :param max_entries: entry count cap
+        :param ttl: seconds an entry stays valid, None for no expiry
+        :param max_bytes: cap on the estimated size of keys and values
+        :param clock: monotonic time source, seconds
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.lock = threading.Lock()
+        # key -> (expires, size, value), least recently used first
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        :return: the cached value or MISSING
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > self.clock()):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return MISSING
+
+    def set(self, key, value):
+        size = estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return
+        expires = None if self.ttl is None else self.clock() + self.ttl
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (expires, size, value)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        expires, size, value = self.entries.pop(key)
+        self.bytes -= size
+
+    def invalidate(self):
+        """
+        Drop every entry, eg when the data behind the values has changed
+        """
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                entries=len(self.entries),
+                bytes=self.bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                invalidations=self.invalidations,
+            )
+
+
+class QuantizedLookupCache(object):
+    """
+    Memoise lookup(lon, lat) on the quantized point
+    """
+
+    def __init__(self, lookup, precision, cache, generation=None):
+        """
+        :param generation: function returning the generation of the data
+            behind lookup, the cache is emptied when it changes
+        """
+        self.lookup = lookup
+        self.precision = precision
+        self.cache = cache
+        self.generation = generation
+        self.seen_generation = generation() if generation is not None else None
+
+    def __call__(self, lon, lat):
+        if self.generation is not None:
+            current = self.generation()
+            if current != self.seen_generation:
+                self.cache.invalidate()
+                self.seen_generation = current
+        key = quantize(lon, lat, self.precision)
+        value = self.cache.get(key)
+        if value is MISSING:
+            value = self.lookup(*key)
+            self.cache.set(key, value)
+        return value
+
+
+_caches = []
+_caches_lock = threading.Lock()
+
+_generation = None
+_generation_checked_at = None
+_generation_lock = threading.Lock()
+
+
+def mark_zone_tables_reloaded():
+    """
+    Call after reloading the zone tables: the lookup caches and zone indexes
+    of every process on this host are dropped on their next lookup
+    """
+    path = settings.ZONE_RELOAD_STAMP
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a'):
+        pass
+    os.utime(path, None)
+    invalidate_lookup_caches()
+
+
+def zone_tables_generation(clock=time.monotonic):
+    """
+    :return: mtime of settings.ZONE_RELOAD_STAMP, 0 if it does not exist, read
+        again at most every settings.ZONE_RELOAD_CHECK_SECONDS
+    """
+    global _generation, _generation_checked_at
+    now = clock()
+    with _generation_lock:
+        if _generation_checked_at is None or now - _generation_checked_at >= settings.ZONE_RELOAD_CHECK_SECONDS:
+            try:
+                _generation = os.path.getmtime(settings.ZONE_RELOAD_STAMP)
+            except OSError:
+                _generation = 0
+            _generation_checked_at = now
+        return _generation
+
+
+def reset_zone_tables_generation():
+    """
+    Read the stamp on the next zone_tables_generation call
+    """
+    global _generation_checked_at
+    with _generation_lock:
+        _generation_checked_at = None
+
+
+def cached_lookup(lookup):
+    """
+    Wrap a point lookup in a QuantizedLookupCache configured from settings,
+    or return it unchanged when settings.LOOKUP_CACHE_ENABLED is off. The
+    caches made here are emptied by invalidate_lookup_caches(), and when the
+    zone tables have been reloaded by any process
+    """
+    if not settings.LOOKUP_CACHE_ENABLED:
+        return lookup
+
+    cache = LRUTTLCache(
+        max_entries=settings.LOOKUP_CACHE_MAX_ENTRIES,
+        ttl=settings.LOOKUP_CACHE_TTL,
+        max_bytes=settings.LOOKUP_CACHE_MAX_BYTES,
+    )
+    with _caches_lock:
+        _caches.append(cache)
+    return QuantizedLookupCache(lookup, settings.LOOKUP_CACHE_PRECISION, cache, zone_tables_generation)
+
+
+def invalidate_lookup_caches():
+    """
+    Empty the lookup caches of this process
+    """
+    with _caches_lock:
+        caches = list(_caches)
+    for cache in caches:
+        cache.invalidate()
+
+
+def lookup_cache_stats():
+    """
+    :return: list of stats dicts, one per cache
+    """
+    with _caches_lock:
+        return [cache.stats() for cache in _caches]
@@ -0,0 +1,192 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import copy
+import os
+import subprocess
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+from sqlalchemy import func, select, text
+
+from ocean_efficiency import settings
+from ocean_efficiency.utils.log.logging_mixin import LoggingMixin
+from ocean_efficiency.utils.spatialite import uses_spatialite
+
+log = LoggingMixin().log
+
+"""
+Load shape files into PostGIS, several layers at once.
+
+Each layer is converted by shp2pgsql in dump format (-D), so psql loads its
+rows with COPY, without -I: the gist index is built once the table is full,
+then the table is analysed. Every layer runs in its own shp2pgsql | psql pipe
+in a thread, the work happens in those processes and in the db.
+
+Into a SpatiaLite file the layers are imported by spatialite_tool, one at a
+time as SQLite has one writer, then given their R*Tree index and analysed.
+"""
+
+# encoding of the attributes (.dbf) of the shape files, spatialite_tool needs it
+SPATIALITE_CHARSET = 'UTF-8'
+
+
+class LayerLoad(object):
+    """
+    Outcome of loading one shape file
+    """
+
+    def __init__(self, path, table):
+        self.path = path
+        self.table = table
+        self.rows = 0
+        self.load_s = 0
+        self.index_s = 0
+        self.analyze_s = 0
+        self.error = None
+
+    @property
+    def rows_per_s(self):
+        return self.rows / self.load_s if self.load_s else 0
+
+    def __str__(self):
+        if self.error:
+            return '{:30} FAILED {}'.format(self.table, self.error.splitlines()[0])
+        params = dict(
+            table=self.table,
+            rows=self.rows,
+            load_s=self.load_s,
+            rows_per_s=self.rows_per_s,
+            index_s=self.index_s,
+            analyze_s=self.analyze_s,
+        )
+        return '{table:30} {rows:>8} rows  load {load_s:7.1f}s ({rows_per_s:8.0f} rows/s)  ' \
+               'index {index_s:6.1f}s  analyze {analyze_s:5.1f}s'.format(**params)
+
+
+def find_shapefiles(directory):
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith('.shp'))
+    return sorted(paths)
+
+
+def table_name(path):
+    return os.path.splitext(os.path.basename(path))[0].lower()
+
+
+def psql_args(url):
+    """
+    :param url: sqlalchemy URL of the db
+    :return: (libpq connection URL, environment of psql), the password is
+        passed in PGPASSWORD, not on the command line
+    """
+    libpq_url = copy.copy(url)
+    # eg postgresql+psycopg2, which libpq does not know
+    libpq_url.drivername = 'postgresql'
+    libpq_url.password = None
+    env = dict(os.environ)
+    if url.password is not None:
+        env['PGPASSWORD'] = str(url.password)
+    return str(libpq_url), env
+
+
+def _copy_layer(path, table, srid, url):
+    """
+    Create the table and COPY the rows in, in one psql transaction
+    """
+    conn, env = psql_args(url)
+    # shp2pgsql may write a warning per record, to a file: a pipe would fill
+    # up and block it, read only once psql is done
+    with tempfile.TemporaryFile() as shp2pgsql_stderr:
+        shp2pgsql = subprocess.Popen(
+            ['shp2pgsql', '-c', '-D', '-s', str(srid), path, table],
+            stdout=subprocess.PIPE, stderr=shp2pgsql_stderr)
+        psql = subprocess.Popen(
+            ['psql', '--quiet', '--no-psqlrc', '-v', 'ON_ERROR_STOP=1', '--single-transaction', conn],
+            stdin=shp2pgsql.stdout, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env)
+        # let shp2pgsql see a broken pipe if psql fails
+        shp2pgsql.stdout.close()
+
+        psql_err = psql.communicate()[1]
+        shp2pgsql.wait()
+        shp2pgsql_stderr.seek(0)
+        shp2pgsql_err = shp2pgsql_stderr.read()
+    if shp2pgsql.returncode:
+        raise RuntimeError('shp2pgsql: {}'.format(shp2pgsql_err.decode('utf-8', 'replace').strip()))
+    if psql.returncode:
+        raise RuntimeError('psql: {}'.format(psql_err.decode('utf-8', 'replace').strip()))
+
+
+def _import_layer_spatialite(path, table, srid, db_path):
+    """
+    Create the table, with gid as its primary key, and import the rows
+    """
+    spatialite_tool = subprocess.Popen(
+        ['spatialite_tool', '-i', '-shp', os.path.splitext(path)[0], '-d', db_path, '-t', table,
+         '-c', SPATIALITE_CHARSET, '-s', str(srid), '-g', 'geom', '-k', 'gid'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    err = spatialite_tool.communicate()[1]
+    if spatialite_tool.returncode:
+        raise RuntimeError('spatialite_tool: {}'.format(err.decode('utf-8', 'replace').strip()))
+
+
+def load_layer(path, srid=4326, engine=None, conn=None):
+    """
+    :return: LayerLoad, with error set if it failed
+    """
+    engine = engine or settings.get_engine()
+    conn = conn or settings.SQL_ALCHEMY_CONN
+    spatialite = uses_spatialite(conn)
+    result = LayerLoad(path, table_name(path))
+    table = result.table
+    try:
+        with engine.begin() as connection:
+            if spatialite:
+                # its geometry column metadata and spatial index too
+                connection.execute(select([func.DropGeoTable(table)]))
+            connection.execute(text('DROP TABLE IF EXISTS "{}"'.format(table)))
+
+        start = time.time()
+        if spatialite:
+            _import_layer_spatialite(path, table, srid, engine.url.database)
+        else:
+            _copy_layer(path, table, srid, engine.url)
+        result.load_s = time.time() - start
+
+        with engine.begin() as connection:
+            result.rows = connection.execute(text('SELECT count(*) FROM "{}"'.format(table))).scalar()
+
+            start = time.time()
+            if spatialite:
+                connection.execute(select([func.CreateSpatialIndex(table, 'geom')]))
+            else:
+                connection.execute(text('CREATE INDEX "{0}_geom_idx" ON "{0}" USING gist (geom)'.format(table)))
+            result.index_s = time.time() - start
+
+        start = time.time()
+        with engine.begin() as connection:
+            connection.execute(text('ANALYZE "{}"'.format(table)))
+        result.analyze_s = time.time() - start
+    except Exception as ex:
+        result.error = str(ex)
+        log.error("Loading %s failed: %s", path, ex)
+    return result
+
+
+def load_shapefiles(paths, processes=4, srid=4326):
+    """
+    Load the shape files, processes at a time, one at a time into SpatiaLite
+    :return: LayerLoad list in the order of paths
+    """
+    if uses_spatialite():
+        processes = 1
+    pool = ThreadPool(processes)
+    try:
+        return pool.map(lambda path: load_layer(path, srid), paths, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
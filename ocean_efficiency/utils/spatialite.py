@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import copy
+
+from sqlalchemy import MetaData, and_, column, event, func, select, table, text
+from geoalchemy2 import Geometry
+
+from ocean_efficiency import settings
+from ocean_efficiency.utils.log.logging_mixin import LoggingMixin
+
+log = LoggingMixin().log
+
+"""
+Embedded SpatiaLite backend, used when settings.SQL_ALCHEMY_CONN is a
+sqlite:/// file, eg on a vessel or for read-only lookups next to the app.
+
+The SpatiaLite extension is loaded into every connection. The model tables
+are created with AddGeometryColumn and an R*Tree spatial index on each
+geometry column. SpatiaLite queries do not use those indexes by themselves,
+the lookups go through the SpatialIndex virtual table, see
+spatial_index_search. SpatiaLite has no curve types: journeys are stored as
+their linearized LineString.
+"""
+
+# geometry types of the model columns that SpatiaLite stores differently
+SPATIALITE_GEOMETRY_TYPES = {
+    'COMPOUNDCURVE': 'LINESTRING',
+}
+
+
+def uses_spatialite(conn=None):
+    """
+    :param conn: SqlAlchemy connection string, default settings.SQL_ALCHEMY_CONN
+    """
+    return (conn or settings.SQL_ALCHEMY_CONN).startswith('sqlite')
+
+
+def spatialite_available():
+    """
+    :return: whether settings.SPATIALITE_LIBRARY can be loaded into sqlite3
+    """
+    import sqlite3
+
+    connection = sqlite3.connect(':memory:')
+    if not settings.SPATIALITE_LIBRARY or not hasattr(connection, 'enable_load_extension'):
+        connection.close()
+        return False
+    try:
+        connection.enable_load_extension(True)
+        connection.load_extension(settings.SPATIALITE_LIBRARY)
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+
+
+def load_spatialite(dbapi_connection, connection_record):
+    """
+    connect event handler: load the extension into a new sqlite3 connection
+    """
+    if not settings.SPATIALITE_LIBRARY:
+        return
+    if not hasattr(dbapi_connection, 'enable_load_extension'):
+        raise RuntimeError("This Python's sqlite3 cannot load extensions, SpatiaLite is not available")
+    dbapi_connection.enable_load_extension(True)
+    try:
+        dbapi_connection.load_extension(settings.SPATIALITE_LIBRARY)
+    finally:
+        dbapi_connection.enable_load_extension(False)
+
+
+def setup_spatialite(engine):
+    event.listen(engine, 'connect', load_spatialite)
+
+
+def spatial_index_search(table_name, column_name, geometry):
+    """
+    Rowids of the rows whose geometry's bounding box intersects geometry's,
+    from the R*Tree of the column. The zone tables' gid is their rowid
+    """
+    spatial_index = table(
+        'SpatialIndex', column('rowid'), column('f_table_name'), column('f_geometry_column'), column('search_frame'))
+    return select([spatial_index.c.rowid]).where(and_(
+        spatial_index.c.f_table_name == table_name,
+        spatial_index.c.f_geometry_column == column_name,
+        spatial_index.c.search_frame == geometry,
+    ))
+
+
+def spatialite_tables(tables):
+    """
+    Copies of the model tables for SpatiaLite: geometry columns added by
+    AddGeometryColumn, with the types SpatiaLite has
+    :param tables: sqlalchemy Table list
+    :return: Table list in a new MetaData, in the same order
+    """
+    metadata = MetaData()
+    copies = [t.tometadata(metadata) for t in tables]
+    for t in copies:
+        for c in t.columns:
+            if isinstance(c.type, Geometry):
+                c.type = copy.copy(c.type)
+                c.type.management = True
+                c.type.geometry_type = SPATIALITE_GEOMETRY_TYPES.get(c.type.geometry_type, c.type.geometry_type)
+    return copies
+
+
+def init_spatial_metadata(connection):
+    """
+    Create the SpatiaLite metadata tables of a new database
+    """
+    exists = connection.execute(text(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'spatial_ref_sys'")).scalar()
+    if not exists:
+        log.info("Initialising SpatiaLite metadata")
+        # in one transaction, it is slow otherwise
+        connection.execute(select([func.InitSpatialMetadata(1)]))
+
+
+def initdb(engine, tables):
+    with engine.begin() as connection:
+        init_spatial_metadata(connection)
+        for t in spatialite_tables(tables):
+            t.create(connection, checkfirst=True)
+
+
+def resetdb(engine, tables):
+    """
+    Drop and create the tables again, dependent tables first in tables
+    """
+    with engine.begin() as connection:
+        init_spatial_metadata(connection)
+        for t in tables:
+            # the table, its geometry column metadata and spatial index
+            connection.execute(select([func.DropGeoTable(t.name)]))
+            connection.execute(text('DROP TABLE IF EXISTS "{}"'.format(t.name)))
+        for t in reversed(spatialite_tables(tables)):
+            t.create(connection)
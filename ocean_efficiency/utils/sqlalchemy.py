@@ -3,21 +3,117 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 import os
+import threading
 import time
 import random
 
 from sqlalchemy import event, exc, select
+from sqlalchemy.pool import QueuePool
 
 from ocean_efficiency.utils.log.logging_mixin import LoggingMixin
 
 log = LoggingMixin().log
 
+# health check strategies, see settings.SQL_ALCHEMY_HEALTH_CHECK
+HEALTH_CHECKS = ('always', 'idle', 'pre_ping', 'none')
+
+
+class PoolMetrics(object):
+    """
+    Counters of the connection pool events, for sizing the pool
+    """
+    counters = (
+        'connects', 'checkouts', 'checkins', 'pings', 'pings_skipped',
+        'invalidations', 'reconnect_backoffs', 'pid_disconnects',
+    )
+    timers = ('checkout_wait_seconds', 'checkout_wait_max_seconds', 'ping_seconds', 'reconnect_backoff_seconds')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.values = dict.fromkeys(self.counters, 0)
+            self.values.update(dict.fromkeys(self.timers, 0.0))
+            self.values['overflow_max'] = 0
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.values[name] += value
+
+    def maximum(self, name, value):
+        with self._lock:
+            if value > self.values[name]:
+                self.values[name] = value
+
+    def snapshot(self, pool=None):
+        """
+        :param pool: the engine's pool, to add its current state
+        :return: dict of the counters
+        """
+        with self._lock:
+            values = dict(self.values)
+        if isinstance(pool, QueuePool):
+            values.update(
+                pool_size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=max(pool.overflow(), 0),
+            )
+        return values
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool timing how long each checkout waits for a connection, opening
+    one included when the pool has none free
+    """
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        finally:
+            wait = time.time() - start
+            pool_metrics.incr('checkout_wait_seconds', wait)
+            pool_metrics.maximum('checkout_wait_max_seconds', wait)
+            pool_metrics.maximum('overflow_max', self.overflow())
+
+
+def needs_ping(health_check, connection_info, ping_idle_seconds, now=None):
+    """
+    :param health_check: one of HEALTH_CHECKS
+    :param connection_info: info dict of the pooled connection
+    :return: whether to ping the connection before use
+    """
+    if health_check == 'always':
+        return True
+    if health_check == 'idle':
+        # a new connection has not been checked in yet and needs no ping
+        checked_in = connection_info.get('checkin_time')
+        return checked_in is not None and (now or time.time()) - checked_in >= ping_idle_seconds
+    return False
+
 
 def setup_event_handlers(
         engine,
         reconnect_timeout_seconds,
         initial_backoff_seconds=0.2,
-        max_backoff_seconds=120):
+        max_backoff_seconds=120,
+        health_check='always',
+        ping_idle_seconds=30):
+    """
+    :param health_check: when to ping a connection before use, one of
+        HEALTH_CHECKS. 'pre_ping' and 'none' add no ping here, pre_ping relies
+        on the engine being created with pool_pre_ping
+    :param ping_idle_seconds: idle time after which 'idle' pings a connection
+    """
+    if health_check not in HEALTH_CHECKS:
+        raise ValueError('Unknown health check {}, one of {}'.format(health_check, HEALTH_CHECKS))
 
     @event.listens_for(engine, "engine_connect")
     def ping_connection(connection, branch):
@@ -32,6 +128,13 @@ def setup_event_handlers(
             # we don't want to bother pinging on these.
             return
 
+        if not needs_ping(health_check, connection.connection.info, ping_idle_seconds):
+            if health_check == 'idle':
+                # only 'idle' skips pings, 'pre_ping' and 'none' never ping here
+                pool_metrics.incr('pings_skipped')
+            return
+
+        pool_metrics.incr('pings')
         start = time.time()
         backoff = initial_backoff_seconds
 
@@ -60,6 +163,8 @@ def setup_event_handlers(
                     # a jitter to prevent the thundering herd problem of
                     # simultaneous client reconnects
                     backoff += backoff * random.random()
+                    pool_metrics.incr('reconnect_backoffs')
+                    pool_metrics.incr('reconnect_backoff_seconds', min(backoff, max_backoff_seconds))
                     time.sleep(min(backoff, max_backoff_seconds))
 
                     # run the same SELECT again - the connection will re-validate
@@ -75,15 +180,30 @@ def setup_event_handlers(
             finally:
                 # restore "close with result"
                 connection.should_close_with_result = save_should_close_with_result
+        pool_metrics.incr('ping_seconds', time.time() - start)
 
     @event.listens_for(engine, "connect")
     def connect(dbapi_connection, connection_record):
         connection_record.info['pid'] = os.getpid()
+        pool_metrics.incr('connects')
+
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        connection_record.info['checkin_time'] = time.time()
+        pool_metrics.incr('checkins')
+
+    @event.listens_for(engine, "invalidate")
+    def invalidate(dbapi_connection, connection_record, exception):
+        # the record connects again on next use, not idle any more
+        connection_record.info.pop('checkin_time', None)
+        pool_metrics.incr('invalidations')
 
     @event.listens_for(engine, "checkout")
     def checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_metrics.incr('checkouts')
         pid = os.getpid()
         if connection_record.info['pid'] != pid:
+            pool_metrics.incr('pid_disconnects')
             connection_record.connection = connection_proxy.connection = None
             raise exc.DisconnectionError(
                 "Connection record belongs to pid {}, "
@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from sqlalchemy import text
+
+from ocean_efficiency import settings
+from ocean_efficiency.utils.log.logging_mixin import LoggingMixin
+
+log = LoggingMixin().log
+
+"""
+Build the companion tables of the zone polygon layers, see
+model.SubdividedLayer. Run after the shape files have been (re)loaded.
+
+<table>_subdivided: ST_Subdivide pieces of at most max_vertices vertices.
+
+<table>_approx: the polygon simplified with tolerance t (degrees) and then
+buffered by -m and +m, with m a little over t to absorb the chord error of
+the buffer arcs. The simplified boundary stays within t of the original, so
+the inner approximation lies inside the polygon and the outer one contains it.
+
+<table>_lod: the levels of detail of the vector tiles, the polygon simplified
+with each of settings.TILE_LOD_TOLERANCES, see utils.tiles.
+"""
+
+# buffer arcs are approximated by chords of 8 segments per quarter circle,
+# which fall 0.5% inside the true buffer distance
+BUFFER_MARGIN = 1.01
+
+SUBDIVIDE_SQL = """
+DROP TABLE IF EXISTS {table}_subdivided;
+CREATE TABLE {table}_subdivided AS
+    SELECT gid, ST_Subdivide(geom, {max_vertices}) AS geom
+    FROM {table}
+    WHERE geom IS NOT NULL;
+ALTER TABLE {table}_subdivided ADD COLUMN id serial PRIMARY KEY;
+CREATE INDEX {table}_subdivided_geom_idx ON {table}_subdivided USING gist (geom);
+CREATE INDEX {table}_subdivided_gid_idx ON {table}_subdivided (gid);
+ANALYZE {table}_subdivided;
+"""
+
+APPROX_SQL = """
+DROP TABLE IF EXISTS {table}_approx;
+CREATE TABLE {table}_approx AS
+    SELECT gid,
+           ST_Buffer(simplified, -{margin}) AS inner_geom,
+           ST_Buffer(simplified, {margin}) AS outer_geom
+    FROM (
+        SELECT gid, ST_MakeValid(ST_SimplifyPreserveTopology(geom, {tolerance})) AS simplified
+        FROM {table}
+        WHERE geom IS NOT NULL
+    ) s;
+ALTER TABLE {table}_approx ADD PRIMARY KEY (gid);
+CREATE INDEX {table}_approx_outer_geom_idx ON {table}_approx USING gist (outer_geom);
+ANALYZE {table}_approx;
+"""
+
+LOD_SQL = """
+DROP TABLE IF EXISTS {table}_lod;
+CREATE TABLE {table}_lod AS
+    SELECT gid, l.level::integer AS level, ST_MakeValid(ST_SimplifyPreserveTopology(geom, l.tolerance)) AS geom
+    FROM {table}, unnest(ARRAY[{lod_tolerances}]::float8[]) WITH ORDINALITY AS l(tolerance, level)
+    WHERE geom IS NOT NULL;
+DELETE FROM {table}_lod WHERE ST_IsEmpty(geom);
+ALTER TABLE {table}_lod ADD PRIMARY KEY (gid, level);
+CREATE INDEX {table}_lod_geom_idx ON {table}_lod USING gist (geom);
+ANALYZE {table}_lod;
+"""
+
+
+def build_companion_tables(engine=None, tables=None, max_vertices=None, tolerance=None):
+    """
+    (Re)create the subdivided, approximation and tile level of detail tables
+    of each layer, each layer in its own transaction
+    :param tables: layer table names, default settings.SUBDIVIDED_ZONE_TABLES
+    :param max_vertices: ST_Subdivide vertex limit
+    :param tolerance: simplification tolerance, degrees
+    """
+    from ocean_efficiency.utils.spatialite import uses_spatialite
+    if uses_spatialite():
+        raise NotImplementedError('The companion tables need PostGIS, SpatiaLite lookups use the R*Tree indexes')
+
+    engine = engine or settings.get_engine()
+    tables = tables or settings.SUBDIVIDED_ZONE_TABLES
+    params = dict(
+        max_vertices=int(max_vertices or settings.SUBDIVIDE_MAX_VERTICES),
+        tolerance=float(tolerance or settings.APPROX_TOLERANCE),
+    )
+    params['margin'] = params['tolerance'] * BUFFER_MARGIN
+    params['lod_tolerances'] = ', '.join(repr(float(t)) for t in settings.TILE_LOD_TOLERANCES)
+
+    for table in tables:
+        log.info("Building companion tables of %s", table)
+        with engine.begin() as connection:
+            for sql in (SUBDIVIDE_SQL, APPROX_SQL, LOD_SQL):
+                connection.execute(text(sql.format(table=table, **params)))
+
+    # cached lookups, zone indexes and tiles were made from the tables as they
+    # were before, in the web workers as much as here
+    from ocean_efficiency.utils.lookup_cache import mark_zone_tables_reloaded
+    from ocean_efficiency.utils.tiles import invalidate_tiles
+    mark_zone_tables_reloaded()
+    invalidate_tiles()
@@ -0,0 +1,375 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+import os
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import text
+
+from ocean_efficiency import settings
+from ocean_efficiency.utils import instrumentation
+from ocean_efficiency.utils.db import provide_session
+from ocean_efficiency.utils.log.logging_mixin import LoggingMixin
+
+log = LoggingMixin().log
+
+"""
+Mapbox vector tiles of the journeys, EEZ12 and WorldBorders layers, in web
+mercator z/x/y, rendered by PostGIS ST_AsMVT.
+
+Geometries are clipped to the tile (and its buffer) in lon lat before they
+are projected, and simplified to the tile's pixel size:
+- journeys: journey.line, the stored linearized journey, simplified as it is
+  rendered
+- zones: at the zooms of the levels of detail built by build_subdivided.py
+  (<table>_lod, see utils.subdivide) the polygon simplified beforehand, the
+  full polygon at higher zooms, or at every zoom without USE_SUBDIVIDED_ZONES
+
+Tiles are cached on disk as TILE_CACHE_DIR/z/x/y.mvt, shared by every process.
+Writing a journey removes the cached tiles over its bounding box, reloading
+the zone layers removes them all.
+"""
+
+MVT_MIMETYPE = 'application/vnd.mapbox-vector-tile'
+
+# web mercator: the world is a square of +-ORIGIN metres, cut at MAX_LATITUDE
+EARTH_RADIUS = 6378137.0
+ORIGIN = math.pi * EARTH_RADIUS
+MAX_LATITUDE = math.degrees(2 * math.atan(math.exp(math.pi)) - math.pi / 2)
+
+# layer name, table, properties. Zone tables of a level of detail are <table>_lod
+ZONE_LAYERS = [
+    ('eez', 'eez_12nm_v2', 'gid, geoname, sovereign1'),
+    ('country', 'tm_world_borders_v03', 'gid, name, iso3'),
+]
+
+JOURNEY_LAYER_SQL = """
+SELECT ST_AsMVT(t, 'journey', :extent, 'geom') FROM (
+    SELECT journey_id, name, length_nm,
+           ST_AsMVTGeom(ST_Transform(ST_Simplify(ST_ClipByBox2D(line, {clip}), :tolerance), 3857),
+                        {bounds}, :extent, :buffer) AS geom
+    FROM journey
+    WHERE line && {clip}
+) t
+WHERE geom IS NOT NULL
+"""
+
+ZONE_LAYER_SQL = """
+SELECT ST_AsMVT(t, '{layer}', :extent, 'geom') FROM (
+    SELECT {properties},
+           ST_AsMVTGeom(ST_Transform(ST_ClipByBox2D(z.geom, {clip}), 3857), {bounds}, :extent, :buffer) AS geom
+    FROM {source}
+    WHERE {level}z.geom && {clip}
+) t
+WHERE geom IS NOT NULL
+"""
+
+# the layers of a tile, concatenated: an MVT is a sequence of layers
+TILE_SQL = """
+SELECT coalesce(({journey}), '') || {zones}
+"""
+
+BOUNDS_SQL = 'ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 3857)'
+CLIP_SQL = 'ST_MakeEnvelope(:min_lon, :min_lat, :max_lon, :max_lat, 4326)'
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= settings.TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z, x, y):
+    """
+    :return: (xmin, ymin, xmax, ymax) of the tile, web mercator metres
+    """
+    size = 2 * ORIGIN / 2 ** z
+    return -ORIGIN + x * size, ORIGIN - (y + 1) * size, -ORIGIN + (x + 1) * size, ORIGIN - y * size
+
+
+def mercator_to_lonlat(mx, my):
+    return math.degrees(mx / EARTH_RADIUS), math.degrees(2 * math.atan(math.exp(my / EARTH_RADIUS)) - math.pi / 2)
+
+
+def clip_box(z, x, y, extent, buffer):
+    """
+    :return: (min_lon, min_lat, max_lon, max_lat) of the tile and its buffer
+    """
+    xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+    margin = (xmax - xmin) * buffer / extent
+    min_lon, min_lat = mercator_to_lonlat(max(xmin - margin, -ORIGIN), max(ymin - margin, -ORIGIN))
+    max_lon, max_lat = mercator_to_lonlat(min(xmax + margin, ORIGIN), min(ymax + margin, ORIGIN))
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def tile_range(z, min_lon, min_lat, max_lon, max_lat, margin=0):
+    """
+    :param margin: widen the box by this fraction of a tile, eg a tile buffer
+    :return: (x0, y0, x1, y1), inclusive, of the tiles of zoom z over the box
+    """
+    n = 2 ** z
+
+    def tile_x(lon, offset):
+        return min(max(int(math.floor((lon + 180) / 360 * n + offset)), 0), n - 1)
+
+    def tile_y(lat, offset):
+        lat = math.radians(min(max(lat, -MAX_LATITUDE), MAX_LATITUDE))
+        return min(max(int(math.floor((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n + offset)), 0), n - 1)
+
+    return tile_x(min_lon, -margin), tile_y(max_lat, -margin), tile_x(max_lon, margin), tile_y(min_lat, margin)
+
+
+def pixel_degrees(z, extent):
+    """
+    :return: width of a tile pixel, degrees of longitude
+    """
+    return 360 / 2 ** z / extent
+
+
+def lod_level(z, extent=None, tolerances=None):
+    """
+    :return: the coarsest level of detail, 1-based in
+        settings.TILE_LOD_TOLERANCES, simplified within a pixel at zoom z, or
+        None if a pixel is finer than every level
+    """
+    extent = extent or settings.TILE_EXTENT
+    tolerances = [float(t) for t in (tolerances or settings.TILE_LOD_TOLERANCES)]
+    pixel = pixel_degrees(z, extent)
+    for level, tolerance in enumerate(tolerances, 1):
+        if tolerance <= pixel:
+            return level
+    return None
+
+
+def tile_sql(level):
+    """
+    :param level: level of detail of the zone layers, None for the full polygons
+    """
+    zones = []
+    for layer, table, properties in ZONE_LAYERS:
+        if level is None:
+            source, level_filter = '{} z'.format(table), ''
+        else:
+            source, level_filter = '{0}_lod z JOIN {0} USING (gid)'.format(table), 'z.level = {:d} AND '.format(level)
+        sql = ZONE_LAYER_SQL.format(
+            layer=layer, properties=properties, source=source, level=level_filter, clip=CLIP_SQL, bounds=BOUNDS_SQL)
+        zones.append("coalesce(({}), '')".format(sql.strip()))
+    return text(TILE_SQL.format(
+        journey=JOURNEY_LAYER_SQL.format(clip=CLIP_SQL, bounds=BOUNDS_SQL).strip(),
+        zones=' || '.join(zones),
+    ))
+
+
+@provide_session
+def render_tile(z, x, y, session):
+    """
+    :return: MVT bytes of the tile, empty if it has no features
+    """
+    from ocean_efficiency.utils.spatialite import uses_spatialite
+    if uses_spatialite():
+        raise NotImplementedError('Vector tiles are rendered by PostGIS ST_AsMVT')
+
+    extent, buffer = settings.TILE_EXTENT, settings.TILE_BUFFER
+    xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+    min_lon, min_lat, max_lon, max_lat = clip_box(z, x, y, extent, buffer)
+    with instrumentation.timer('render_tile'):
+        # the levels of detail are companion tables of the zone layers
+        level = lod_level(z, extent) if settings.USE_SUBDIVIDED_ZONES else None
+        data = session.execute(tile_sql(level), dict(
+            xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax,
+            min_lon=min_lon, min_lat=min_lat, max_lon=max_lon, max_lat=max_lat,
+            extent=extent, buffer=buffer, tolerance=pixel_degrees(z, extent),
+        )).scalar()
+    return bytes(data or b'')
+
+
+class TileCache(object):
+    """
+    Tiles as files directory/z/x/y.mvt, written to a temporary file and
+    renamed, so a reader never sees part of one.
+
+    A tile rendered while tiles were being invalidated may predate the
+    change: put is given the time the rendering started and does not store the
+    tile if an invalidation has happened since, before or after writing it,
+    see the stamp file
+    """
+
+    STAMP = 'invalidated'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, z, x, y):
+        return os.path.join(self.directory, str(z), str(x), '{}.mvt'.format(y))
+
+    def get(self, z, x, y):
+        """
+        :return: the tile bytes, or None if not cached
+        """
+        try:
+            with open(self.path(z, x, y), 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def put(self, z, x, y, data, started):
+        """
+        :param started: time.time() when the rendering of data started
+        """
+        if self._invalidated_on() >= started:
+            return
+        path = self.path(z, x, y)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            if self._invalidated_on() >= started:
+                # invalidated while it was being written, maybe after the
+                # invalidation had listed the tiles to remove
+                os.remove(path)
+        except (IOError, OSError) as ex:
+            # a cache that cannot be written is no cache, the tile is still served
+            log.warning("Could not cache tile %s/%s/%s: %s", z, x, y, ex)
+
+    def _invalidated_on(self):
+        try:
+            return os.path.getmtime(os.path.join(self.directory, self.STAMP))
+        except OSError:
+            return 0
+
+    def _stamp(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.STAMP), 'a'):
+            pass
+        os.utime(os.path.join(self.directory, self.STAMP), None)
+
+    def _zooms(self):
+        try:
+            return [int(d) for d in os.listdir(self.directory) if d.isdigit()]
+        except OSError:
+            return []
+
+    def invalidate_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        """
+        Remove the cached tiles over the box, and their neighbours whose
+        buffer overlaps it
+        :return: number of tiles removed
+        """
+        return self.invalidate_bboxes([(min_lon, min_lat, max_lon, max_lat)])
+
+    def invalidate_bboxes(self, bboxes):
+        """
+        invalidate_bbox of each box, in one pass over the cached tiles
+        :param bboxes: list of (min_lon, min_lat, max_lon, max_lat)
+        :return: number of tiles removed
+        """
+        self._stamp()
+        removed = 0
+        margin = settings.TILE_BUFFER / settings.TILE_EXTENT
+        # only the cached tiles are listed, not every tile over the boxes
+        for z in self._zooms():
+            ranges = [tile_range(z, *bbox, margin=margin) for bbox in bboxes]
+            z_dir = os.path.join(self.directory, str(z))
+            for x_name in os.listdir(z_dir):
+                if not x_name.isdigit():
+                    continue
+                x = int(x_name)
+                y_ranges = [(y0, y1) for x0, y0, x1, y1 in ranges if x0 <= x <= x1]
+                if not y_ranges:
+                    continue
+                x_dir = os.path.join(z_dir, x_name)
+                for y_name in os.listdir(x_dir):
+                    y = y_name[:-len('.mvt')]
+                    if not y_name.endswith('.mvt') or not y.isdigit():
+                        continue
+                    if any(y0 <= int(y) <= y1 for y0, y1 in y_ranges):
+                        try:
+                            os.remove(os.path.join(x_dir, y_name))
+                            removed += 1
+                        except OSError:
+                            # removed by another process
+                            pass
+        return removed
+
+    def invalidate_all(self):
+        self._stamp()
+        for z in self._zooms():
+            z_dir = os.path.join(self.directory, str(z))
+            # moved aside first, the tiles are gone at once
+            old = tempfile.mkdtemp(dir=self.directory, prefix='old')
+            try:
+                os.rename(z_dir, os.path.join(old, str(z)))
+            except OSError:
+                pass
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def tile_cache():
+    """
+    :return: TileCache of settings.TILE_CACHE_DIR, or None when disabled
+    """
+    if not settings.TILE_CACHE_ENABLED:
+        return None
+    return TileCache(settings.TILE_CACHE_DIR)
+
+
+def get_tile(z, x, y):
+    """
+    :return: MVT bytes of the tile, from the cache if there
+    """
+    cache = tile_cache()
+    if cache is not None:
+        data = cache.get(z, x, y)
+        if data is not None:
+            instrumentation.count('tile_cache_hit')
+            return data
+
+    started = time.time()
+    data = render_tile(z, x, y)
+    if cache is not None:
+        cache.put(z, x, y, data, started)
+    return data
+
+
+def invalidate_journey_tiles(min_lon, min_lat, max_lon, max_lat):
+    """
+    Call after writing a journey, with the bounding box of its line. None
+    bounds, of a journey written before the box was stored, remove every tile
+    """
+    cache = tile_cache()
+    if cache is None:
+        return
+    if None in (min_lon, min_lat, max_lon, max_lat):
+        cache.invalidate_all()
+    else:
+        cache.invalidate_bbox(min_lon, min_lat, max_lon, max_lat)
+
+
+def invalidate_journeys_tiles(bboxes):
+    """
+    invalidate_journey_tiles of many journeys, eg a batch of a bulk load, in
+    one pass over the cache
+    :param bboxes: list of (min_lon, min_lat, max_lon, max_lat)
+    """
+    cache = tile_cache()
+    if cache is None or not bboxes:
+        return
+    if any(None in bbox for bbox in bboxes):
+        cache.invalidate_all()
+    else:
+        cache.invalidate_bboxes(bboxes)
+
+
+def invalidate_tiles():
+    """
+    Call after reloading the zone layers
+    """
+    cache = tile_cache()
+    if cache is not None:
+        cache.invalidate_all()
@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+
+from sqlalchemy import func
+
+from ocean_efficiency import settings
+from ocean_efficiency.utils.db import provide_session
+from ocean_efficiency.utils.lookup_cache import invalidate_lookup_caches, zone_tables_generation
+from ocean_efficiency.utils.log.logging_mixin import LoggingMixin
+
+log = LoggingMixin().log
+
+"""
+In-process point-in-polygon lookups over the read-only polygon layers
+(EEZ12, WorldBorders), so lookup_coordinates needs no db round trip.
+
+Polygons are loaded once into a shapely STR-tree. The candidates from the
+tree are tested with GEOS 'within', the predicate behind PostGIS ST_Within,
+so points on a boundary are excluded exactly as in the db. Matches are ordered
+by the rank of their label in an ORDER BY done by the db when loading, so the
+order follows the db collation too.
+
+Requires shapely >= 2.0, enable with settings.ZONE_INDEX_ENABLED
+"""
+
+
+class PolygonIndex(object):
+    """
+    STR-tree over one polygon layer, answering which labels contain a point
+    """
+
+    def __init__(self, labels, geometries):
+        """
+        :param labels: value returned for each polygon, in the order the
+            results should be sorted by
+        :param geometries: shapely polygons / multipolygons
+        """
+        from shapely import STRtree
+
+        self.labels = list(labels)
+        self.tree = STRtree(list(geometries))
+
+    @classmethod
+    @provide_session
+    def from_query(cls, label_column, geom_column, session):
+        """
+        Load a layer, eg PolygonIndex.from_query(EEZ12.geoname, EEZ12.geom)
+        """
+        from shapely import wkb
+
+        rows = session\
+            .query(label_column, func.ST_AsBinary(geom_column))\
+            .filter(geom_column.isnot(None))\
+            .order_by(label_column)\
+            .all()
+        return cls([r[0] for r in rows], [wkb.loads(bytes(r[1])) for r in rows])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def lookup(self, lon, lat):
+        """
+        :return: labels of the polygons the point is within, in label order
+        """
+        from shapely import Point
+
+        indexes = self.tree.query(Point(float(lon), float(lat)), predicate='within')
+        return [self.labels[i] for i in sorted(indexes)]
+
+    def lookup_many(self, lons, lats):
+        """
+        Vectorised lookup of many points
+        :return: list of label lists, one per point
+        """
+        from shapely import points
+
+        point_indexes, polygon_indexes = self.tree.query(points(lons, y=lats), predicate='within')
+        matches = [[] for _ in range(len(lons))]
+        for p, g in sorted(zip(point_indexes.tolist(), polygon_indexes.tolist())):
+            matches[p].append(self.labels[g])
+        return matches
+
+
+class ZoneIndex(object):
+    """
+    The layers queried by lookup_coordinates
+    """
+
+    def __init__(self, zones, countries):
+        self.zones = zones
+        self.countries = countries
+
+    @classmethod
+    @provide_session
+    def load(cls, session):
+        from ocean_efficiency.model import EEZ12, WorldBorders
+
+        zones = PolygonIndex.from_query(EEZ12.geoname, EEZ12.geom, session=session)
+        countries = PolygonIndex.from_query(WorldBorders.name, WorldBorders.geom, session=session)
+        log.info("Loaded zone index, %s zones, %s countries", len(zones), len(countries))
+        return cls(zones, countries)
+
+    def lookup(self, lon, lat):
+        """
+        :return: (zone names, country names), as the ST_Within queries return them
+        """
+        return self.zones.lookup(lon, lat), self.countries.lookup(lon, lat)
+
+
+_zone_index = None
+_zone_index_generation = None
+_zone_index_lock = threading.Lock()
+
+
+def _zone_index_stale(generation):
+    # an index set without a generation, eg a stand-in, is kept
+    return _zone_index is None or (_zone_index_generation is not None and generation != _zone_index_generation)
+
+
+def get_zone_index():
+    """
+    :return: the process wide ZoneIndex, loaded on first use and again after
+        the zone tables have been reloaded, or None when
+        settings.ZONE_INDEX_ENABLED is off
+    """
+    global _zone_index, _zone_index_generation
+    if not settings.ZONE_INDEX_ENABLED:
+        return None
+    generation = zone_tables_generation()
+    if _zone_index_stale(generation):
+        with _zone_index_lock:
+            if _zone_index_stale(generation):
+                if _zone_index is not None:
+                    log.info("Zone tables reloaded, reloading the zone index")
+                _zone_index = ZoneIndex.load()
+                _zone_index_generation = generation
+    return _zone_index
+
+
+def reload_zone_index():
+    """
+    Rebuild the index of this process if it is enabled and empty its lookup
+    caches. Other processes reload theirs when the stamp moves, see
+    lookup_cache.mark_zone_tables_reloaded
+    """
+    global _zone_index, _zone_index_generation
+    with _zone_index_lock:
+        _zone_index = ZoneIndex.load() if settings.ZONE_INDEX_ENABLED else None
+        _zone_index_generation = zone_tables_generation() if _zone_index is not None else None
+    invalidate_lookup_caches()
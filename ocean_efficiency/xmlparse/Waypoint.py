@@ -22,3 +22,14 @@ class Waypoint(dexml.Model):
     # latter sailmode corresponds to leg's sailmode
     sail_mode = fields.Integer(tagname="SailMode")
     radius = fields.Float(tagname='Radius')  # meters
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Fast constructor for already parsed field values, used by the
+        streaming reader
+        :param values: dict of field name to value
+        """
+        waypoint = cls.__new__(cls)
+        waypoint.__dict__.update(values)
+        return waypoint
@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import xml.etree.ElementTree as ET
+
+from ocean_efficiency.xmlparse.RouteModel import RouteModel, RouteModelType
+from ocean_efficiency.xmlparse.Waypoint import Waypoint
+
+"""
+Streaming route XML reader. The document is read once with iterparse, the
+root element decides the route model type, no reparse per candidate class
+as dexml needed, and each
+<Waypoints> element is turned into a Waypoint as soon as it is closed and then
+dropped, so memory does not grow with the size of the XML tree.
+
+eg
+reader = RouteModelReader(path)
+for wp in reader:
+    ...
+reader.name
+"""
+
+ROOT_CLASSES = {C.meta.tagname: C for C in (RouteModel, RouteModelType)}
+
+# field name, dexml field, keyed by the child tag of <Waypoints>
+WAYPOINT_FIELDS = {f.tagname: f for f in Waypoint._fields}
+WAYPOINT_DEFAULTS = {f.field_name: f.default for f in Waypoint._fields if not f.required}
+WAYPOINT_REQUIRED = frozenset(f.field_name for f in Waypoint._fields if f.required)
+
+
+def local_name(tag):
+    """
+    :return: tag without its {namespace}
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def namespace(tag):
+    return tag[1:].split('}', 1)[0] if tag.startswith('{') else None
+
+
+class RouteModelReader(object):
+    """
+    Iterate the Waypoints of a RouteModel or RouteModelType document.
+    root_tag and namespace are known after the first waypoint is read (or
+    after read_header()), name as soon as the <Name> element has been read,
+    which in the exports is before the first waypoint.
+    """
+
+    def __init__(self, source):
+        """
+        :param source: file name, file object, or the document as bytes or str.
+            A str is the document if it starts with '<' after any byte order
+            mark and white space, which are dropped as expat rejects them
+            before the XML declaration
+        """
+        if isinstance(source, bytes):
+            source = io.BytesIO(source.lstrip())
+        elif isinstance(source, str):
+            document = source.lstrip().lstrip('\ufeff').lstrip()
+            if document.startswith('<'):
+                source = io.StringIO(document)
+        self.source = source
+        self.route_model_class = None
+        self.root_tag = None
+        self.namespace = None
+        self.name = None
+        self.waypoint_count = 0
+        self._events = None
+        self._root = None
+
+    def read_header(self):
+        """
+        Read up to the root element and check it is a route model
+        :return: the dexml class the document would have been parsed with
+        """
+        if self._events is None:
+            self._events = ET.iterparse(self.source, events=('start', 'end'))
+            event, root = next(self._events)
+            self._root = root
+            self.root_tag = local_name(root.tag)
+            self.namespace = namespace(root.tag)
+            if self.root_tag not in ROOT_CLASSES:
+                raise ValueError('Unexpected root element {!r}, not a route model'.format(self.root_tag))
+            self.route_model_class = ROOT_CLASSES[self.root_tag]
+        return self.route_model_class
+
+    def __iter__(self):
+        self.read_header()
+        root = self._root
+        depth = 0
+        for event, element in self._events:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 0:
+                # a field of a waypoint, read with the waypoint
+                continue
+
+            tag = local_name(element.tag)
+            if tag == 'Waypoints':
+                self.waypoint_count += 1
+                yield self._waypoint(element)
+            elif tag == 'Name':
+                self.name = element.text or ''
+            # forget the elements already read
+            root.clear()
+
+    def _waypoint(self, element):
+        values = dict(WAYPOINT_DEFAULTS)
+        for child in element:
+            field = WAYPOINT_FIELDS.get(local_name(child.tag))
+            if field is not None:
+                values[field.field_name] = field.parse_value(child.text or '')
+
+        missing = WAYPOINT_REQUIRED.difference(values)
+        if missing:
+            raise ValueError('Waypoint {} is missing {}'.format(self.waypoint_count, ', '.join(sorted(missing))))
+        return Waypoint.from_values(values)
+
+    def read(self):
+        """
+        Read the whole document
+        :return: RouteModel or RouteModelType, as dexml would have built it
+        """
+        waypoints = list(self)
+        return self.route_model_class(name=self.name, waypoints=waypoints)
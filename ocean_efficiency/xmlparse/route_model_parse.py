@@ -1,21 +1,11 @@
-import dexml
-import logging
-
-from ocean_efficiency.xmlparse.RouteModel import RouteModel, RouteModelType
-
-
-CLASSES_TO_TRY = [
-    RouteModel,
-    RouteModelType
-]
+from ocean_efficiency.utils.instrumentation import timed
+from ocean_efficiency.xmlparse.route_model_iterparse import RouteModelReader
 
 
+@timed('xml_parse')
 def parse(xml_str):
-    rm = None
-    for C in CLASSES_TO_TRY:
-        try:
-            return C.parse(xml_str)
-        except dexml.ParseError as ex:
-            logging.error(ex)
-        except Exception:
-            raise
+    """
+    The root element picks the route model class, see RouteModelReader.
+    Unlike dexml the waypoint fields may come in any order
+    """
+    return RouteModelReader(xml_str).read()
@@ -3,14 +3,21 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from flask import Flask, request, redirect, url_for, render_template, flash
+import json
+from time import perf_counter
+
+from flask import Flask, Response, g, request, redirect, url_for, render_template, flash, jsonify, stream_with_context
 from geoalchemy2 import WKTElement
-from sqlalchemy import func
+from sqlalchemy import literal_column, text
+from sqlalchemy.dialects import postgresql
 
-from ocean_efficiency.legacy_model.Journey import Journey
-from ocean_efficiency.utils.db import provide_session
+from ocean_efficiency import settings
+from ocean_efficiency.utils import instrumentation, job_queue, journey_search, tiles
+from ocean_efficiency.utils.db import create_session, provide_session
+from ocean_efficiency.utils.lookup_cache import cached_lookup
+from ocean_efficiency.utils.spatialite import uses_spatialite
+from ocean_efficiency.utils.zone_index import get_zone_index
 from ocean_efficiency.www.forms import LatLongForm
-from ocean_efficiency.xmlparse.RouteModel import RouteModel
 from ocean_efficiency.model import EEZ12, WorldBorders
 
 UPLOAD_FOLDER = '/Users/ben.marengo/Downloads'
@@ -21,40 +28,210 @@ app = Flask(__name__, template_folder='ocean_efficiency/www/templates')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 1 * 1024 * 1024
 
+if settings.ZONE_INDEX_ENABLED:
+    # load the polygons as the worker starts, not on its first request
+    get_zone_index()
+
+
+@app.before_request
+def start_request_timer():
+    if instrumentation.is_enabled():
+        g.request_start = perf_counter()
+
+
+@app.after_request
+def observe_request_time(response):
+    # a streamed body is still being sent, its time is not included
+    start = g.pop('request_start', None)
+    if start is not None:
+        instrumentation.observe(
+            instrumentation.HTTP_REQUEST_SECONDS,
+            perf_counter() - start,
+            endpoint=request.endpoint or 'unknown',
+            method=request.method,
+            status=response.status_code,
+        )
+    return response
+
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+@provide_session
+def lookup_zones_in_db(lon, lat, session):
+    """
+    :return: (zone names, country names) of the polygons the point is within
+    """
+    current_point = WKTElement('POINT(%s %s)' % (lon, lat), srid=4326)
+
+    zones = session\
+        .query(EEZ12.geoname)\
+        .filter(EEZ12.point_within(current_point))\
+        .order_by(EEZ12.geoname)\
+        .all()
+
+    countries = session\
+        .query(WorldBorders.name)\
+        .filter(WorldBorders.point_within(current_point))\
+        .order_by(WorldBorders.name)\
+        .all()
+
+    return [r.geoname for r in zones], [r.name for r in countries]
+
+
+def lookup_zones(lon, lat):
+    """
+    :return: (zone names, country names), from the zone index when enabled
+    """
+    zone_index = get_zone_index()
+    if zone_index is not None:
+        return zone_index.lookup(lon, lat)
+    return lookup_zones_in_db(lon, lat)
+
+
+lookup_zones_cached = cached_lookup(lookup_zones)
+
+
+# one round trip for a whole batch: the points are unnested from three array
+# parameters and each is joined laterally to the polygons it is within
+BATCH_LOOKUP_SQL = """
+SELECT p.idx, coalesce(z.names, '{{}}') AS zones, coalesce(c.names, '{{}}') AS countries
+FROM (
+    SELECT idx, ST_SetSRID(ST_MakePoint(lon, lat), 4326) AS pt
+    FROM unnest(CAST(:idx AS integer[]), CAST(:lons AS float8[]), CAST(:lats AS float8[])) AS u(idx, lon, lat)
+) p
+CROSS JOIN LATERAL (
+    SELECT array_agg(eez_12nm_v2.geoname ORDER BY eez_12nm_v2.geoname) AS names
+    FROM eez_12nm_v2
+    WHERE {eez_within}
+) z
+CROSS JOIN LATERAL (
+    SELECT array_agg(tm_world_borders_v03.name ORDER BY tm_world_borders_v03.name) AS names
+    FROM tm_world_borders_v03
+    WHERE {country_within}
+) c
+ORDER BY p.idx
+"""
+
+
+def batch_lookup_sql():
+    """
+    BATCH_LOOKUP_SQL with the point in polygon tests of the ORM models, so it
+    uses the subdivided tables the same way single lookups do
+    """
+    point = literal_column('p.pt')
+
+    def compile_sql(expression):
+        return str(expression.compile(dialect=postgresql.dialect(), compile_kwargs=dict(literal_binds=True)))
+
+    return text(BATCH_LOOKUP_SQL.format(
+        eez_within=compile_sql(EEZ12.point_within(point)),
+        country_within=compile_sql(WorldBorders.point_within(point)),
+    ))
+
+
+def lookup_zones_batch_in_db(lons, lats):
+    """
+    Generator of (index, zone names, country names) for each point, in input
+    order. Rows are fetched through a server side cursor as they are produced.
+    SpatiaLite has no arrays nor LATERAL joins, but no round trips either:
+    there the points are looked up one by one in the same session
+    """
+    if uses_spatialite():
+        with create_session() as session:
+            for i, (lon, lat) in enumerate(zip(lons, lats)):
+                zones, countries = lookup_zones_in_db(lon, lat, session=session)
+                yield i, zones, countries
+        return
+
+    with create_session() as session:
+        result = session.connection().execution_options(stream_results=True).execute(
+            batch_lookup_sql(), idx=list(range(len(lons))), lons=list(lons), lats=list(lats))
+        for row in result:
+            yield row.idx, list(row.zones), list(row.countries)
+
+
+def lookup_zones_batch(lons, lats):
+    """
+    Generator of (index, zone names, country names), from the zone index when
+    enabled, otherwise from the db in one query
+    """
+    zone_index = get_zone_index()
+    if zone_index is None:
+        for row in lookup_zones_batch_in_db(lons, lats):
+            yield row
+        return
+
+    zones = zone_index.zones.lookup_many(lons, lats)
+    countries = zone_index.countries.lookup_many(lons, lats)
+    for i in range(len(lons)):
+        yield i, zones[i], countries[i]
+
+
+def parse_batch_points(payload):
+    """
+    :param payload: {"points": [[lon, lat], ...]} or {"points": [{"lon": .., "lat": ..}, ...]}
+    :return: lons, lats
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('points'), list):
+        raise ValueError('expected a JSON object with a "points" array')
+
+    lons, lats = [], []
+    for i, point in enumerate(payload['points']):
+        try:
+            if isinstance(point, dict):
+                lon, lat = float(point['lon']), float(point['lat'])
+            else:
+                lon, lat = (float(v) for v in point)
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('point {} is not [lon, lat] or {{"lon", "lat"}}'.format(i))
+        if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+            raise ValueError('point {} is out of range'.format(i))
+        lons.append(lon)
+        lats.append(lat)
+    return lons, lats
+
+
+@app.route('/lookup_coordinates/batch', methods=['POST'])
+def lookup_coordinates_batch():
+    """
+    Zones and countries of a batch of points, by input index.
+    With ?stream=1 the result is newline delimited JSON, one line per point,
+    written as the rows come back
+    """
+    try:
+        lons, lats = parse_batch_points(request.get_json(silent=True))
+    except ValueError as ex:
+        return jsonify(error=str(ex)), 400
+
+    rows = lookup_zones_batch(lons, lats)
+
+    if request.args.get('stream'):
+        def generate():
+            for idx, zones, countries in rows:
+                yield json.dumps(dict(index=idx, zones=zones, countries=countries)) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    return jsonify(results=[dict(index=idx, zones=zones, countries=countries) for idx, zones, countries in rows])
+
+
 @app.route('/', methods=['GET', 'POST'])
 @app.route('/lookup_coordinates', methods=['GET', 'POST'])
-@provide_session
-def lookup_coordinates(session):
+def lookup_coordinates():
     form = LatLongForm(request.form)
     if request.method == 'POST' and form.validate():
         lon = form.longitude.data
         lat = form.latitude.data
 
-        current_point = WKTElement('POINT(%s %s)' % (lon, lat), srid=4326)
-
-        zones = session\
-            .query(EEZ12.geoname)\
-            .filter(func.ST_Within(current_point, EEZ12.geom))\
-            .order_by(EEZ12.geoname)\
-            .all()
-
-        countries = session\
-            .query(WorldBorders.name)\
-            .filter(func.ST_Within(current_point, WorldBorders.geom))\
-            .order_by(WorldBorders.name)\
-            .all()
+        zones, countries = lookup_zones_cached(lon, lat)
 
         data = {
             'input_lat': lat,
             'input_lon': lon,
-            'zones': [r.geoname for r in zones],
-            'countries': [r.name for r in countries],
+            'zones': zones,
+            'countries': countries,
         }
 
         return render_template('ocean/lookup_coordinates.html', form=form, data=data)
@@ -77,13 +254,140 @@ def upload_file():
             return redirect(request.url)
 
         if file and allowed_file(file.filename):
-            xml_str = file.read().strip()
-            rm = RouteModel.parse(xml_str)
-            j = Journey.from_route_model(rm)
-            return str(j)
-            # return redirect(url_for('uploaded_file', filename=filename))
+            # processed by route_worker.py, poll the status url for the result
+            job_id = job_queue.enqueue(file.read().strip(), file.filename)
+            status_url = url_for('route_upload_status', job_id=job_id)
+            return jsonify(job_id=job_id, status='queued', status_url=status_url), 202, {'Location': status_url}
     return render_template('ocean/upload_file.html')
 
 
+@app.route('/route_upload/<int:job_id>')
+def route_upload_status(job_id):
+    status = job_queue.job_status(job_id)
+    if status is None:
+        return jsonify(error='no job {}'.format(job_id)), 404
+    return jsonify(status)
+
+
+@app.route('/route_upload/queue')
+def route_upload_queue():
+    return jsonify(job_queue.queue_stats())
+
+
+def float_args(*names):
+    """
+    :return: the query string arguments as floats
+    """
+    values = []
+    for name in names:
+        try:
+            values.append(float(request.args[name]))
+        except KeyError:
+            raise ValueError('missing argument {}'.format(name))
+        except ValueError:
+            raise ValueError('argument {} is not a number'.format(name))
+    return values
+
+
+def page_args():
+    """
+    :return: limit, after of the journey searches
+    """
+    try:
+        limit = int(request.args.get('limit', journey_search.DEFAULT_LIMIT))
+        after = request.args.get('after')
+        after = int(after) if after is not None else None
+    except ValueError:
+        raise ValueError('limit and after must be integers')
+    if not 0 < limit <= journey_search.MAX_LIMIT:
+        raise ValueError('limit must be 1 to {}'.format(journey_search.MAX_LIMIT))
+    return limit, after
+
+
+def journeys_page(journeys, limit):
+    """
+    The page of search results, with the after argument of the next page if
+    there may be one
+    """
+    result = dict(journeys=journeys)
+    if len(journeys) == limit:
+        result['next_after'] = journeys[-1]['journey_id']
+    return jsonify(result)
+
+
+@app.route('/journeys/bbox')
+def journeys_in_bbox():
+    """
+    ?min_lon=&min_lat=&max_lon=&max_lat=, min_lon > max_lon crosses the antimeridian
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = float_args('min_lon', 'min_lat', 'max_lon', 'max_lat')
+        limit, after = page_args()
+        if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+            raise ValueError('box is out of range')
+    except ValueError as ex:
+        return jsonify(error=str(ex)), 400
+    return journeys_page(
+        journey_search.journeys_in_bbox(min_lon, min_lat, max_lon, max_lat, limit=limit, after=after), limit)
+
+
+@app.route('/journeys/zone/<int:gid>')
+def journeys_in_zone(gid):
+    try:
+        limit, after = page_args()
+    except ValueError as ex:
+        return jsonify(error=str(ex)), 400
+    journeys = journey_search.journeys_in_zone(gid, limit=limit, after=after)
+    if journeys is None:
+        return jsonify(error='no zone {}'.format(gid)), 404
+    return journeys_page(journeys, limit)
+
+
+@app.route('/journeys/near')
+def journeys_near():
+    """
+    ?lon=&lat=&radius_nm=
+    """
+    try:
+        lon, lat, radius_nm = float_args('lon', 'lat', 'radius_nm')
+        limit, after = page_args()
+        if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+            raise ValueError('point is out of range')
+        if not 0 < radius_nm <= 10800:
+            raise ValueError('radius_nm must be more than 0 and at most 10800')
+    except ValueError as ex:
+        return jsonify(error=str(ex)), 400
+    return journeys_page(journey_search.journeys_near(lon, lat, radius_nm, limit=limit, after=after), limit)
+
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.mvt')
+def tile(z, x, y):
+    """
+    Mapbox vector tile of the journey, eez and country layers
+    """
+    if not tiles.valid_tile(z, x, y):
+        return jsonify(error='no tile {}/{}/{}'.format(z, x, y)), 404
+    if uses_spatialite():
+        return jsonify(error='vector tiles need PostGIS'), 501
+    return Response(tiles.get_tile(z, x, y), mimetype=tiles.MVT_MIMETYPE,
+                    headers={'Cache-Control': 'public, max-age={:d}'.format(settings.TILE_MAX_AGE)})
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus text exposition of the instrumentation and pool metrics
+    """
+    return Response(instrumentation.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/pool_metrics')
+def pool_metrics():
+    from ocean_efficiency.utils.sqlalchemy import pool_metrics
+
+    # the pool's current state only if the engine exists, do not create it here
+    return jsonify(pool_metrics.snapshot(settings.engine.pool if settings.engine else None))
+
+
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,39 @@
+import multiprocessing
+from optparse import OptionParser
+
+from ocean_efficiency.utils.job_queue import run_worker
+
+"""
+Process the route uploads queued by /route_upload. Run as many as needed,
+on as many hosts as needed, against the same db.
+
+eg python route_worker.py -p 4
+"""
+
+
+def _run(options):
+    from ocean_efficiency import settings
+    # each process needs its own connections, not copies of the parent's,
+    # they are made again on first use
+    settings.dispose_orm()
+    run_worker(options.poll_interval, options.stale_timeout)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-p", "--processes", dest="processes", type="int", default=1,
+                      help="worker processes on this host")
+    parser.add_option("--poll-interval", dest="poll_interval", type="float", default=1.0,
+                      help="seconds between polls of an empty queue")
+    parser.add_option("--stale-timeout", dest="stale_timeout", type="float", default=600,
+                      help="seconds after which a running job is assumed lost and requeued")
+    (options, args) = parser.parse_args()
+
+    if options.processes == 1:
+        run_worker(options.poll_interval, options.stale_timeout)
+    else:
+        workers = [multiprocessing.Process(target=_run, args=(options,)) for _ in range(options.processes)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
@@ -0,0 +1,62 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import json
+import unittest
+
+from shapely import box
+
+from ocean_efficiency import settings
+from ocean_efficiency.utils import zone_index
+from ocean_efficiency.utils.zone_index import PolygonIndex, ZoneIndex
+from oceanefficiency import app, parse_batch_points
+
+
+class TestBatchLookup(unittest.TestCase):
+
+    def setUp(self):
+        self.enabled = settings.ZONE_INDEX_ENABLED
+        settings.ZONE_INDEX_ENABLED = True
+        zone_index._zone_index = ZoneIndex(
+            PolygonIndex(['Zone A', 'Zone B'], [box(0, 0, 10, 10), box(5, 5, 15, 15)]),
+            PolygonIndex(['Country'], [box(-20, -20, 6, 6)]),
+        )
+        self.client = app.test_client()
+
+    def tearDown(self):
+        settings.ZONE_INDEX_ENABLED = self.enabled
+        zone_index._zone_index = None
+
+    def test_parse_batch_points(self):
+        self.assertEqual(parse_batch_points({'points': [[1, 2], {'lon': 3, 'lat': '4'}]}), ([1.0, 3.0], [2.0, 4.0]))
+        for payload in [None, [], {'points': [[1]]}, {'points': [{'lon': 1}]}, {'points': [[0, 91]]}]:
+            with self.assertRaises(ValueError):
+                parse_batch_points(payload)
+
+    def test_batch(self):
+        response = self.client.post('/lookup_coordinates/batch', json={'points': [[7, 7], [5.5, 5.5], [50, 50]]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['results'], [
+            {'index': 0, 'zones': ['Zone A', 'Zone B'], 'countries': []},
+            {'index': 1, 'zones': ['Zone A', 'Zone B'], 'countries': ['Country']},
+            {'index': 2, 'zones': [], 'countries': []},
+        ])
+
+    def test_batch_stream(self):
+        response = self.client.post('/lookup_coordinates/batch?stream=1', json={'points': [[1, 1], [12, 12]]})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(l) for l in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines, [
+            {'index': 0, 'zones': ['Zone A'], 'countries': ['Country']},
+            {'index': 1, 'zones': ['Zone B'], 'countries': []},
+        ])
+
+    def test_bad_request(self):
+        response = self.client.post('/lookup_coordinates/batch', json={'points': [[200, 0]]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('out of range', response.get_json()['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+from load_files import build_journey, find_files, run
+from ocean_efficiency.legacy_model.GeoWKT import CompoundCurve
+
+SAMPLE_ROUTE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'B624.1 - GBSOU - NOSVG.xml')
+
+
+class TestLoadFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for i in range(3):
+            shutil.copy(SAMPLE_ROUTE, os.path.join(self.directory, 'route%s.xml' % i))
+        with open(os.path.join(self.directory, 'broken.xml'), 'w') as f:
+            f.write('<RouteModel')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_build_journey(self):
+        result = build_journey(SAMPLE_ROUTE)
+        self.assertNotIn('error', result)
+        self.assertGreater(result['waypoints'], 2)
+        self.assertEqual(CompoundCurve.from_ewkb(result['ewkb']).srid, 4326)
+
+    def test_failures_do_not_abort(self):
+        paths = find_files(directory=self.directory)
+        self.assertEqual(len(paths), 4)
+
+        loaded, failures = run(paths, processes=2, dry_run=True)
+        self.assertEqual(loaded, 3)
+        self.assertEqual([os.path.basename(path) for path, error in failures], ['broken.xml'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+
+from fixtures import synthetic_route
+from benchmarks.suite import BUNDLED_ROUTE
+from job_queue import JobQueueSettings
+from ocean_efficiency import settings
+from ocean_efficiency.legacy_model.Journey import Journey
+from ocean_efficiency.legacy_model.RouteGeometry import RouteGeometry
+from ocean_efficiency.utils import columnar_export, job_queue
+from ocean_efficiency.utils.columnar_export import BatchFileWriter, leg_columns, leg_schema
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+JOURNEY_COLUMNS = ('journey_id', 'name', 'created_on', 'updated_on', 'length_nm',
+                   'min_lon', 'min_lat', 'max_lon', 'max_lat', 'geometry')
+JourneyRow = namedtuple('JourneyRow', JOURNEY_COLUMNS)
+Schema = namedtuple('Schema', 'names')
+
+
+class ListWriter(BatchFileWriter):
+    """
+    BatchFileWriter keeping the batches, no pyarrow needed
+    """
+
+    def _open(self, path, file_format):
+        self.batches = []
+        self.closed = False
+
+    def _write_batch(self, columns):
+        self.batches.append(columns)
+
+    def _close(self):
+        self.closed = True
+
+
+def journey_rows(n):
+    created_on = datetime(2019, 1, 1)
+    # psycopg2 returns the WKB as a memoryview
+    return [JourneyRow(i, 'j%s' % i, created_on, created_on, 1.5 * i, 0, 1, 2, 3, memoryview(b'wkb%d' % i))
+            for i in range(n)]
+
+
+def mock_session(rows):
+    session = mock.Mock()
+    query = session.query.return_value.order_by.return_value.execution_options.return_value
+    query.yield_per.return_value = rows
+    return session
+
+
+class TestBatchFileWriter(unittest.TestCase):
+
+    def test_batches(self):
+        with ListWriter('unused', Schema(['a', 'b']), chunk_size=3) as writer:
+            writer.write(dict(a=1, b='x'))
+            writer.write(dict(a=2, b='y'))
+            self.assertEqual(writer.batches, [])
+            # batched with the rows before, not split
+            writer.write_columns(dict(a=np.arange(3, 8), b=['z'] * 5), 5)
+            self.assertEqual(len(writer.batches), 1)
+            writer.write(dict(a=8, b='w'))
+        self.assertTrue(writer.closed)
+        self.assertEqual(writer.rows, 8)
+        self.assertEqual([batch['a'] for batch in writer.batches], [[1, 2, 3, 4, 5, 6, 7], [8]])
+        self.assertIsInstance(writer.batches[0]['a'][2], int)
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, ListWriter, 'unused', Schema(['a']), 'csv')
+
+    def test_export_journeys(self):
+        session = mock_session(journey_rows(5))
+        writers = []
+
+        def writer(*args):
+            writers.append(ListWriter(*args))
+            return writers[-1]
+
+        with mock.patch.object(columnar_export, 'journey_schema', return_value=Schema(JOURNEY_COLUMNS)), \
+                mock.patch.object(columnar_export, 'BatchFileWriter', side_effect=writer):
+            self.assertEqual(columnar_export.export_journeys('unused', session=session, chunk_size=2), 5)
+
+        # read through a server side cursor, chunk_size rows at a time
+        query = session.query.return_value.order_by.return_value
+        query.execution_options.assert_called_once_with(stream_results=True)
+        query.execution_options.return_value.yield_per.assert_called_once_with(2)
+
+        [writer] = writers
+        self.assertEqual([len(batch['journey_id']) for batch in writer.batches], [2, 2, 1])
+        self.assertEqual(writer.batches[2]['geometry'], [b'wkb4'])
+        self.assertIsInstance(writer.batches[0]['geometry'][0], bytes)
+
+
+class TestRouteJobExport(JobQueueSettings):
+
+    def finish_jobs(self, *xmls):
+        """
+        :return: ids of the jobs, done but for the last, failed
+        """
+        job_ids = [job_queue.enqueue(xml, 'route{}.xml'.format(i)) for i, xml in enumerate(xmls)]
+        for job_id in job_ids:
+            self.assertEqual(job_queue.claim(worker='w1')[0], job_id)
+            if job_id == job_ids[-1]:
+                job_queue.finish(job_id, 'w1', error='ValueError: bad')
+            else:
+                job_queue.finish(job_id, 'w1', result='journey')
+        return job_ids
+
+    def export(self):
+        columns, _ = leg_columns(RouteGeometry.from_waypoints(synthetic_route(3).waypoints), 'route', 'source')
+        job_ids, written = {}, []
+        with mock.patch.object(columnar_export, 'leg_schema', return_value=Schema(list(columns))), \
+                mock.patch.object(columnar_export, 'BatchFileWriter', ListWriter):
+            legs, failures = columnar_export.export_legs(
+                'unused', columnar_export.route_job_xmls(job_ids=job_ids), written=written)
+        return legs, failures, [job_ids[source] for source in written]
+
+    def test_export_done_jobs(self):
+        with open(BUNDLED_ROUTE, 'rb') as f:
+            xml = f.read()
+        with mock.patch.object(settings, 'KEEP_JOB_UPLOADS', True):
+            done, unreadable, _ = self.finish_jobs(xml, b'<not a route', xml)
+        job_queue.enqueue(xml, 'queued.xml')
+
+        legs, failures, exported = self.export()
+        self.assertGreater(legs, 0)
+        self.assertEqual([source for source, _ in failures], ['route_job/{}/route1.xml'.format(unreadable)])
+        self.assertEqual(exported, [done])
+
+        # exported once, the upload that could not be read is kept
+        self.assertEqual(job_queue.drop_uploads(exported), 1)
+        self.assertEqual([source for source, _ in columnar_export.route_job_xmls()],
+                         ['route_job/{}/route1.xml'.format(unreadable)])
+
+    def test_uploads_not_kept(self):
+        with open(BUNDLED_ROUTE, 'rb') as f:
+            xml = f.read()
+        self.finish_jobs(xml, xml)
+        self.assertEqual(self.export(), (0, [], []))
+
+
+class TestLegColumns(unittest.TestCase):
+
+    def test_leg_columns(self):
+        route = synthetic_route(6)
+        journey = Journey.from_route_model_per_leg(route)
+        columns, n = leg_columns(RouteGeometry.from_waypoints(route.waypoints), 'route', 'source')
+        self.assertEqual(n, len(journey.legs))
+        for i, leg in enumerate(journey.legs):
+            self.assertEqual(columns['origin_name'][i], leg.origin_name)
+            self.assertEqual(columns['destination_name'][i], leg.destination_name)
+            self.assertEqual(bool(columns['rhumb_mode'][i]), bool(leg.rhumb_mode))
+            self.assertAlmostEqual(columns['leg_distance_nm'][i], leg.leg_distance, places=6)
+            self.assertAlmostEqual(columns['incoming_turn_radius_nm'][i], leg.incoming_turn_radius, places=6)
+            self.assertAlmostEqual(columns['outgoing_turn_radius_nm'][i], leg.outgoing_turn_radius, places=6)
+
+
+@unittest.skipUnless(pyarrow, 'pyarrow is not installed')
+class TestColumnarFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export_legs(self):
+        import pyarrow.ipc
+        import pyarrow.parquet as pq
+        from ocean_efficiency.utils.columnar_export import export_legs
+
+        routes = [('bundled', BUNDLED_ROUTE), ('broken', b'<not a route'), ('bundled again', BUNDLED_ROUTE)]
+        for file_format in ('parquet', 'arrow'):
+            path = os.path.join(self.directory, 'legs.' + file_format)
+            legs, failures = export_legs(path, routes, file_format, chunk_size=5)
+            self.assertEqual([source for source, _ in failures], ['broken'])
+
+            if file_format == 'parquet':
+                table = pq.read_table(path)
+            else:
+                table = pyarrow.ipc.open_file(path).read_all()
+            self.assertEqual(table.num_rows, legs)
+            self.assertEqual(table.schema, leg_schema())
+            self.assertEqual(set(table.column('source').to_pylist()), {'bundled', 'bundled again'})
+
+    def test_journey_geo_metadata(self):
+        from ocean_efficiency.utils.columnar_export import journey_schema
+
+        geo = json.loads(journey_schema().metadata[b'geo'])
+        self.assertEqual(geo['columns']['geometry']['encoding'], 'WKB')
+
+    def test_export_journeys(self):
+        import pyarrow.parquet as pq
+
+        path = os.path.join(self.directory, 'journeys.parquet')
+        self.assertEqual(columnar_export.export_journeys(path, session=mock_session(journey_rows(3)), chunk_size=2), 3)
+        table = pq.read_table(path)
+        geo = json.loads(table.schema.metadata[b'geo'])
+        self.assertEqual(geo['primary_column'], 'geometry')
+        self.assertEqual(table.column('geometry').to_pylist(), [b'wkb0', b'wkb1', b'wkb2'])
+        self.assertEqual(pq.ParquetFile(path).num_row_groups, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+"""
+Synthetic routes shared by the tests and the benchmarks
+(eg from tests.fixtures import synthetic_route when run from the repository root).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+import random
+
+from ocean_efficiency.xmlparse.Waypoint import Waypoint
+
+
+class RouteModelStub(object):
+    def __init__(self, name, waypoints):
+        self.name = name
+        self.waypoints = waypoints
+
+
+def synthetic_route(n, seed=0):
+    rnd = random.Random(seed)
+    lat, lon = 50.0, -1.0
+    waypoints = []
+    for i in range(n):
+        waypoints.append(Waypoint(
+            name='WP%s' % i,
+            latitude=math.radians(lat),
+            longitude=math.radians(lon),
+            sail_mode=rnd.choice([0, 1]),
+            radius=rnd.choice([0, 185.2, 370.4, 926]),
+        ))
+        lat = max(-80, min(80, lat + rnd.uniform(-0.3, 0.3)))
+        lon = (lon + rnd.uniform(-0.3, 0.5) + 180) % 360 - 180
+    return RouteModelStub('synthetic', waypoints)
@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import unittest
+
+from fixtures import synthetic_route
+from ocean_efficiency.legacy_model.Journey import Journey
+from ocean_efficiency.utils import instrumentation
+from ocean_efficiency.utils.instrumentation import STAGE_SECONDS, registry, timed, timer
+
+
+@timed('recursive')
+def countdown(n):
+    return n if n == 0 else countdown(n - 1)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.enabled = instrumentation.is_enabled()
+        registry.reset()
+
+    def tearDown(self):
+        instrumentation.enable(self.enabled)
+        registry.reset()
+
+    def stage_count(self, stage):
+        values = registry.histograms.get((STAGE_SECONDS, (('stage', stage),)))
+        return values[-2] if values else 0
+
+    def test_disabled_records_nothing(self):
+        instrumentation.enable(False)
+        countdown(3)
+        with timer('block'):
+            pass
+        instrumentation.count('waypoints', 5)
+        self.assertEqual(registry.histograms, {})
+        self.assertEqual(registry.counters, {})
+
+    def test_nested_calls_timed_once(self):
+        instrumentation.enable()
+        countdown(5)
+        countdown(2)
+        self.assertEqual(self.stage_count('recursive'), 2)
+
+    def test_journey_stages(self):
+        instrumentation.enable()
+        journey = Journey.from_route_model(synthetic_route(50))
+        journey.wkt_obj.ewkb
+        for stage in ('journey', 'waypoint_read', 'sail_vectors', 'turns', 'turn_points', 'legs',
+                      'segmentation', 'ewkb_format'):
+            self.assertEqual(self.stage_count(stage), 1, stage)
+
+    def test_prometheus_text(self):
+        instrumentation.enable()
+        instrumentation.observe(STAGE_SECONDS, 0.002, stage='a"b')
+        instrumentation.observe(STAGE_SECONDS, 20, stage='a"b')
+        instrumentation.count('legs', 3)
+        lines = registry.prometheus_text().splitlines()
+        self.assertIn('# TYPE ocean_efficiency_stage_seconds histogram', lines)
+        self.assertIn('ocean_efficiency_stage_seconds_bucket{stage="a\\"b",le="0.001"} 0', lines)
+        self.assertIn('ocean_efficiency_stage_seconds_bucket{stage="a\\"b",le="0.005"} 1', lines)
+        self.assertIn('ocean_efficiency_stage_seconds_bucket{stage="a\\"b",le="10.0"} 1', lines)
+        self.assertIn('ocean_efficiency_stage_seconds_bucket{stage="a\\"b",le="+Inf"} 2', lines)
+        self.assertIn('ocean_efficiency_stage_seconds_count{stage="a\\"b"} 2', lines)
+        self.assertIn('ocean_efficiency_items_total{item="legs"} 3', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
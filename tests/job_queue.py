@@ -0,0 +1,156 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from sqlalchemy.exc import OperationalError
+
+from ocean_efficiency import settings
+from ocean_efficiency.model import RouteJob
+from ocean_efficiency.utils import job_queue
+from ocean_efficiency.utils.db import create_session
+from ocean_efficiency.utils.job_queue import DONE, FAILED, QUEUED, RUNNING
+
+
+class JobQueueSettings(unittest.TestCase):
+    """
+    route_job in a plain SQLite file, no SpatiaLite needed
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = settings.SQL_ALCHEMY_CONN, settings.SPATIALITE_LIBRARY
+        settings.dispose_orm()
+        settings.SQL_ALCHEMY_CONN = 'sqlite:///' + os.path.join(self.directory, 'ocean_efficiency.db')
+        settings.SPATIALITE_LIBRARY = ''
+        RouteJob.__table__.create(settings.get_engine())
+
+    def tearDown(self):
+        settings.dispose_orm()
+        settings.SQL_ALCHEMY_CONN, settings.SPATIALITE_LIBRARY = self.settings
+        shutil.rmtree(self.directory)
+
+    def db_now(self):
+        with create_session() as session:
+            return job_queue.db_now(session)
+
+    def set_times(self, job_id, **times):
+        with create_session() as session:
+            session.query(RouteJob).filter(RouteJob.job_id == job_id).update(times, synchronize_session=False)
+
+
+class TestJobQueue(JobQueueSettings):
+
+    def test_enqueue_claim_finish(self):
+        first = job_queue.enqueue(b'<RouteModel/>', 'a.xml')
+        second = job_queue.enqueue(b'<RouteModel/>', 'b.xml')
+        self.assertEqual(job_queue.job_status(first)['status'], QUEUED)
+
+        self.assertEqual(job_queue.claim(worker='w1'), (first, b'<RouteModel/>', 'a.xml'))
+        self.assertEqual(job_queue.claim(worker='w2')[0], second)
+        self.assertIsNone(job_queue.claim(worker='w3'))
+        self.assertEqual(job_queue.job_status(first)['status'], RUNNING)
+
+        # only the worker running a job finishes it, once
+        self.assertFalse(job_queue.finish(first, 'w2', result='journey'))
+        self.assertTrue(job_queue.finish(first, 'w1', result='journey'))
+        self.assertFalse(job_queue.finish(first, 'w1', error='late'))
+        self.assertTrue(job_queue.finish(second, 'w2', error='ValueError: bad'))
+
+        status = job_queue.job_status(first)
+        self.assertEqual((status['status'], status['result']), (DONE, 'journey'))
+        self.assertIsNotNone(status['finished_on'])
+        status = job_queue.job_status(second)
+        self.assertEqual((status['status'], status['error']), (FAILED, 'ValueError: bad'))
+        self.assertNotIn('result', status)
+        self.assertIsNone(job_queue.job_status(second + 1))
+
+    def test_claim_race(self):
+        first = job_queue.enqueue(b'<RouteModel/>', 'a.xml')
+        second = job_queue.enqueue(b'<RouteModel/>', 'b.xml')
+        oldest_queued = job_queue._oldest_queued
+        raced = []
+
+        def claimed_meanwhile(session):
+            # another worker claims the job between the read and the update,
+            # as it can on SQLite, which ignores FOR UPDATE
+            job_id = oldest_queued(session)
+            if not raced:
+                raced.append(None)
+                raced[0] = job_queue.claim(worker='w2')
+            return job_id
+
+        with mock.patch.object(job_queue, '_oldest_queued', side_effect=claimed_meanwhile):
+            self.assertEqual(job_queue.claim(worker='w1')[0], second)
+        self.assertEqual(raced[0][0], first)
+        self.assertTrue(job_queue.finish(first, 'w2', result='journey'))
+        self.assertTrue(job_queue.finish(second, 'w1', result='journey'))
+
+    def test_worker_survives_db_errors(self):
+        job_id = job_queue.enqueue(b'<RouteModel/>', 'a.xml')
+        claim = job_queue.claim
+        errors = [OperationalError('SELECT', {}, Exception('database is locked'))]
+
+        def flaky_claim(**kwargs):
+            if errors:
+                raise errors.pop()
+            return claim(**kwargs)
+
+        with mock.patch.object(job_queue, 'claim', side_effect=flaky_claim), \
+                mock.patch.object(job_queue, 'process', return_value='journey'), \
+                mock.patch.object(job_queue.time, 'sleep') as sleep:
+            job_queue.run_worker(poll_interval=0.5, max_jobs=1)
+        sleep.assert_called_once_with(0.5)
+        self.assertEqual(job_queue.job_status(job_id)['status'], DONE)
+
+    def test_requeue_stale(self):
+        job_id = job_queue.enqueue(b'<RouteModel/>', 'a.xml')
+        job_queue.claim(worker='w1')
+        self.assertEqual(job_queue.requeue_stale(60), 0)
+
+        self.set_times(job_id, started_on=self.db_now() - timedelta(seconds=120))
+        self.assertEqual(job_queue.requeue_stale(60), 1)
+        self.assertEqual(job_queue.job_status(job_id)['status'], QUEUED)
+        # claimed again by another worker, the first one's outcome is dropped
+        job_queue.claim(worker='w2')
+        self.assertFalse(job_queue.finish(job_id, 'w1', result='journey'))
+        self.assertEqual(job_queue.job_status(job_id)['status'], RUNNING)
+
+        self.set_times(job_id, started_on=self.db_now() - timedelta(seconds=120))
+        self.assertEqual(job_queue.requeue_stale(60, max_attempts=2), 1)
+        status = job_queue.job_status(job_id)
+        self.assertEqual((status['status'], status['error']), (FAILED, 'gave up after 2 attempts'))
+
+    def test_queue_stats(self):
+        stats = job_queue.queue_stats()
+        self.assertEqual((stats['queued'], stats['running'], stats['finished_last_window']), (0, 0, 0))
+        self.assertEqual(stats['mean_run_s'], 0)
+
+        now = self.db_now()
+        done = job_queue.enqueue(b'<RouteModel/>', 'a.xml')
+        job_queue.claim(worker='w1')
+        job_queue.finish(done, 'w1', result='journey')
+        self.set_times(done, created_on=now - timedelta(seconds=30), started_on=now - timedelta(seconds=20),
+                       finished_on=now - timedelta(seconds=5))
+        running = job_queue.enqueue(b'<RouteModel/>', 'b.xml')
+        job_queue.claim(worker='w1')
+        queued = job_queue.enqueue(b'<RouteModel/>', 'c.xml')
+        self.set_times(queued, created_on=now - timedelta(seconds=50))
+        self.assertNotEqual(running, queued)
+
+        stats = job_queue.queue_stats()
+        self.assertEqual((stats['queued'], stats['running'], stats['finished_last_window']), (1, 1, 1))
+        self.assertAlmostEqual(stats['oldest_queued_s'], 50, delta=5)
+        self.assertAlmostEqual(stats['mean_wait_s'], 10, delta=0.01)
+        self.assertAlmostEqual(stats['mean_run_s'], 15, delta=0.01)
+        self.assertEqual(job_queue.queue_stats(window=1)['finished_last_window'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import unittest
+from unittest import mock
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from fixtures import synthetic_route
+from ocean_efficiency import settings
+from ocean_efficiency.legacy_model.Journey import Journey
+from ocean_efficiency.utils import journey_search
+from ocean_efficiency.utils.journey_search import circle_boxes, split_antimeridian
+from oceanefficiency import app
+from spatialite import SpatiaLiteSettings, spatialite_available
+
+
+def compiled_condition(search, *args):
+    """
+    SQL of the filter search builds on PostGIS, the query is not run
+    """
+    session = mock.Mock()
+    with mock.patch.object(journey_search, '_search') as _search:
+        search(*args, session=session)
+    condition = _search.call_args[0][1]
+    return str(condition.compile(dialect=postgresql.dialect()))
+
+
+class TestJourneySearch(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = settings.SQL_ALCHEMY_CONN
+        self.use_subdivided = settings.USE_SUBDIVIDED_ZONES
+        settings.SQL_ALCHEMY_CONN = 'postgresql://localhost/ocean_efficiency'
+
+    def tearDown(self):
+        settings.SQL_ALCHEMY_CONN = self.conn
+        settings.USE_SUBDIVIDED_ZONES = self.use_subdivided
+
+    def test_split_antimeridian(self):
+        self.assertEqual(split_antimeridian((1, 2, 3, 4)), [(1, 2, 3, 4)])
+        self.assertEqual(split_antimeridian((170, -5, -170, 5)), [(170, -5, 180.0, 5), (-180.0, -5, -170, 5)])
+
+    def test_circle_boxes(self):
+        [(min_lon, min_lat, max_lon, max_lat)] = circle_boxes(0, 0, 60)
+        # 60 NM is a degree of latitude
+        self.assertAlmostEqual(max_lat, 1.0, delta=0.02)
+        self.assertAlmostEqual(max_lon, -min_lon)
+
+        # wider in longitude away from the equator
+        [box] = circle_boxes(0, 60, 60)
+        self.assertAlmostEqual(box[2], 2.0, delta=0.05)
+
+        west, east = circle_boxes(179.9, 50, 30)
+        self.assertEqual(west[2], 180.0)
+        self.assertEqual(east[0], -180.0)
+
+        # a pole within the circle, every longitude
+        [box] = circle_boxes(10, 89.5, 60)
+        self.assertEqual((box[0], box[2], box[3]), (-180.0, 180.0, 90.0))
+
+    def test_bbox_uses_line_index(self):
+        sql = compiled_condition(journey_search.journeys_in_bbox, 170, -5, -170, 5)
+        self.assertEqual(sql.count('journey.line && ST_MakeEnvelope'), 2)
+        self.assertIn('journey.max_lon <=', sql)
+
+    def test_near_uses_geography(self):
+        sql = compiled_condition(journey_search.journeys_near, 0, 0, 10)
+        self.assertIn('journey.line && ST_MakeEnvelope', sql)
+        self.assertIn('ST_DWithin(CAST(journey.line AS geography', sql)
+
+    def test_zone_subdivided(self):
+        settings.USE_SUBDIVIDED_ZONES = True
+        sql = compiled_condition(journey_search.journeys_in_zone, 5)
+        self.assertIn('journey_1.line && eez_12nm_v2_subdivided.geom', sql)
+
+        settings.USE_SUBDIVIDED_ZONES = False
+        sql = compiled_condition(journey_search.journeys_in_zone, 5)
+        self.assertNotIn('subdivided', sql)
+
+    def test_geom_columns(self):
+        journey = Journey.from_route_model(synthetic_route(5))
+        columns = Journey.geom_columns(journey.wkt_obj)
+        line = journey.wkt_obj.linearized().obj
+        self.assertEqual(columns['min_lon'], min(p.x for p in line))
+        self.assertEqual(columns['max_lat'], max(p.y for p in line))
+        # without a distance, the length of the line, close to the legs sailed on a short route
+        self.assertAlmostEqual(columns['length_nm'], journey.distance, delta=journey.distance * 0.01)
+        self.assertEqual(Journey.geom_columns(journey.wkt_obj, 12.5)['length_nm'], 12.5)
+
+
+@unittest.skipUnless(spatialite_available(), 'the SpatiaLite extension cannot be loaded')
+class TestSpatiaLiteSearch(SpatiaLiteSettings):
+    """
+    The searches run on SpatiaLite, through the R*Tree of journey.line
+    """
+
+    JOURNEYS = [
+        (1, 'channel', 'LINESTRING(-1 50, 1 50.5)'),
+        (2, 'dateline', 'LINESTRING(179 0, 179.5 1)'),
+        (3, 'biscay', 'LINESTRING(-5 45, -3 46)'),
+    ]
+
+    def setUp(self):
+        super(TestSpatiaLiteSearch, self).setUp()
+        from ocean_efficiency.utils.db import initdb
+
+        initdb()
+        with settings.get_engine().begin() as connection:
+            for journey_id, name, wkt in self.JOURNEYS:
+                connection.execute(text(
+                    "INSERT INTO journey (journey_id, name, line, min_lon, min_lat, max_lon, max_lat, length_nm) "
+                    "SELECT :journey_id, :name, l, MbrMinX(l), MbrMinY(l), MbrMaxX(l), MbrMaxY(l), 1.0 "
+                    "FROM (SELECT GeomFromText(:wkt, 4326) AS l)"), journey_id=journey_id, name=name, wkt=wkt)
+
+    def ids(self, journeys):
+        return [j['journey_id'] for j in journeys]
+
+    def test_bbox(self):
+        self.assertEqual(self.ids(journey_search.journeys_in_bbox(-2, 49, 2, 51)), [1])
+        # the box crosses the line, which has neither end in it
+        self.assertEqual(self.ids(journey_search.journeys_in_bbox(-0.1, 49, 0.1, 51)), [1])
+        self.assertEqual(self.ids(journey_search.journeys_in_bbox(-10, 40, 2, 51)), [1, 3])
+        self.assertEqual(self.ids(journey_search.journeys_in_bbox(-10, 40, 2, 51, limit=1, after=1)), [3])
+        self.assertEqual(journey_search.journeys_in_bbox(10, 10, 20, 20), [])
+
+    def test_antimeridian_bbox(self):
+        self.assertEqual(self.ids(journey_search.journeys_in_bbox(170, -5, -170, 5)), [2])
+        self.assertEqual(journey_search.journeys_in_bbox(-179, -5, -170, 5), [])
+
+    def test_near(self):
+        self.assertEqual(self.ids(journey_search.journeys_near(0, 50.4, 10)), [1])
+        self.assertEqual(journey_search.journeys_near(0, 49, 10), [])
+        # the line is 8.4 NM away, on the spheroid
+        self.assertEqual(journey_search.journeys_near(0, 50.4, 8), [])
+
+
+class TestJourneyEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_bad_requests(self):
+        for url in ['/journeys/bbox?min_lon=0&min_lat=0&max_lon=1',
+                    '/journeys/bbox?min_lon=0&min_lat=5&max_lon=1&max_lat=1',
+                    '/journeys/near?lon=0&lat=0&radius_nm=x',
+                    '/journeys/near?lon=0&lat=0&radius_nm=0',
+                    '/journeys/zone/1?limit=0']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertIn('error', response.get_json())
+
+    def test_next_page(self):
+        journeys = [dict(journey_id=i, name=str(i), length_nm=1.0, bbox=[0, 0, 1, 1]) for i in (3, 7)]
+        with mock.patch.object(journey_search, 'journeys_near', return_value=journeys):
+            body = self.client.get('/journeys/near?lon=0&lat=0&radius_nm=5&limit=2').get_json()
+        self.assertEqual(body['next_after'], 7)
+
+        with mock.patch.object(journey_search, 'journeys_in_zone', return_value=None):
+            self.assertEqual(self.client.get('/journeys/zone/9').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import os
+import subprocess
+import sys
+import unittest
+
+from ocean_efficiency import settings
+
+
+class TestSettings(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = {name: getattr(settings, name) for name in ('SQL_ALCHEMY_POOL_SIZE', 'SQL_ALCHEMY_ECHO',
+                                                                   'SUBDIVIDED_ZONE_TABLES', 'APPROX_TOLERANCE')}
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(settings, name, value)
+            os.environ.pop(settings.ENV_PREFIX + name, None)
+
+    def test_environment_overrides(self):
+        os.environ['OCEAN_EFFICIENCY_SQL_ALCHEMY_POOL_SIZE'] = '12'
+        os.environ['OCEAN_EFFICIENCY_SQL_ALCHEMY_ECHO'] = 'true'
+        os.environ['OCEAN_EFFICIENCY_SUBDIVIDED_ZONE_TABLES'] = 'a, b'
+        os.environ['OCEAN_EFFICIENCY_APPROX_TOLERANCE'] = '0.5'
+        settings.configure_vars()
+        self.assertEqual(settings.SQL_ALCHEMY_POOL_SIZE, 12)
+        self.assertIs(settings.SQL_ALCHEMY_ECHO, True)
+        self.assertEqual(settings.SUBDIVIDED_ZONE_TABLES, ['a', 'b'])
+        self.assertEqual(settings.APPROX_TOLERANCE, 0.5)
+
+    def test_invalid_boolean(self):
+        os.environ['OCEAN_EFFICIENCY_SQL_ALCHEMY_ECHO'] = 'maybe'
+        self.assertRaises(ValueError, settings.configure_vars)
+
+    def test_geometry_import_leaves_db_alone(self):
+        probe = 'import sys; import ocean_efficiency.legacy_model.Journey; ' \
+                'from ocean_efficiency import settings; ' \
+                'print("sqlalchemy" in sys.modules, settings.engine is None)'
+        out = subprocess.check_output([sys.executable, '-c', probe], cwd=os.path.join(os.path.dirname(__file__), os.pardir))
+        self.assertEqual(out.decode().split(), ['False', 'True'])
+
+    def test_engine_created_on_first_use(self):
+        settings.dispose_orm()
+        self.assertIsNone(settings.engine)
+        # no connection is made until a query runs
+        engine = settings.get_engine()
+        self.assertIs(settings.get_engine(), engine)
+        self.assertIsNotNone(settings.Session)
+        settings.dispose_orm()
+        self.assertIsNone(settings.engine)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,290 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import binascii
+import math
+import sys
+import unittest
+
+import numpy as np
+from pygeodesy.sphericalTrigonometry import LatLon as SphericalLatLon
+from pygeodesy.utils import m2NM
+
+from ocean_efficiency.legacy_model.GeoWKT import CircularString, CompoundCurve, LineString, Point
+from ocean_efficiency.legacy_model.Journey import Journey
+from ocean_efficiency.legacy_model.ZoneCrossing import ZoneCrossing, distance_by_zone, merge_pieces
+from ocean_efficiency.utils.geodesy import segmentize_great_circles
+from ocean_efficiency.xmlparse.Waypoint import Waypoint
+
+from fixtures import RouteModelStub, synthetic_route
+
+
+class TestRouteGeometry(unittest.TestCase):
+
+    def assertClose(self, a, b):
+        self.assertTrue(math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9), '%r != %r' % (a, b))
+
+    def test_legs_match_per_leg_computation(self):
+        rm = synthetic_route(200)
+        vectorised = Journey.from_route_model(rm)
+        per_leg = Journey.from_route_model_per_leg(rm)
+
+        self.assertEqual(len(vectorised.legs), len(per_leg.legs))
+        for a, b in zip(vectorised.legs, per_leg.legs):
+            self.assertEqual(a.rhumb_mode, b.rhumb_mode)
+            self.assertClose(a.leg_distance, b.leg_distance)
+            self.assertClose(a.vector_distance, b.vector_distance)
+            self.assertClose(a.initial_bearing, b.initial_bearing)
+            self.assertClose(a.final_bearing, b.final_bearing)
+            for pa, pb in [
+                (a.leg_straight.incoming_point, b.leg_straight.incoming_point),
+                (a.leg_straight.outgoing_point, b.leg_straight.outgoing_point),
+                (a.incoming_arc.incoming_point, b.incoming_arc.incoming_point),
+                (a.incoming_arc.mid_arc_point, b.incoming_arc.mid_arc_point),
+            ]:
+                self.assertIs(type(pa), type(pb))
+                self.assertClose(pa.lat, pb.lat)
+                self.assertClose(pa.lon, pb.lon)
+
+    def test_summaries_without_geometry(self):
+        rm = synthetic_route(200)
+        lazy = Journey.from_route_model(rm)
+        summary = str(lazy), lazy.distance, lazy.leg_distances, lazy.leg_bearings
+        self.assertFalse(lazy.route_geometry.has_points)
+
+        legs = Journey.from_route_model(rm).legs
+        self.assertEqual(summary[0], '\n'.join(str(l) for l in legs))
+        self.assertEqual(summary[1], sum(l.leg_distance for l in legs))
+        self.assertEqual(summary[2], [l.leg_distance for l in legs])
+        self.assertEqual(summary[3], [(l.initial_bearing, l.final_bearing) for l in legs])
+
+    def test_legs_are_immutable(self):
+        leg = Journey.from_route_model_per_leg(synthetic_route(5)).legs[1]
+        self.assertFalse(hasattr(leg, '__dict__'))
+        with self.assertRaises(AttributeError):
+            leg.leg_distance = 0
+        with self.assertRaises(AttributeError):
+            leg.incoming_arc.incoming_point = None
+        # memoized on first access
+        self.assertIs(leg.incoming_arc.mid_arc_point, leg.incoming_arc.mid_arc_point)
+
+
+class TestJourneyEdits(unittest.TestCase):
+
+    def setUp(self):
+        self.waypoints = list(synthetic_route(60).waypoints)
+        self.journey = Journey.from_route_model(RouteModelStub('synthetic', list(self.waypoints)))
+        # segment the straights, so the edits have to keep them up to date too
+        self.journey.wkt_obj
+
+    def waypoint(self, name, lat, lon, sail_mode=0, radius=0):
+        return Waypoint(name=name, latitude=math.radians(lat), longitude=math.radians(lon),
+                        sail_mode=sail_mode, radius=radius)
+
+    def edit_args(self, wp):
+        # the units of RouteGeometry, exactly as it converts a route model
+        return float(np.degrees(wp.latitude)), float(np.degrees(wp.longitude)), m2NM(wp.radius), wp.sail_mode
+
+    def assertMatchesRebuild(self):
+        rebuilt = Journey.from_route_model(RouteModelStub('synthetic', self.waypoints))
+        self.assertEqual(len(self.journey.legs), len(rebuilt.legs))
+        for a, b in zip(self.journey.legs, rebuilt.legs):
+            self.assertEqual((a.origin_name, a.destination_name), (b.origin_name, b.destination_name))
+            self.assertEqual(a.leg_distance, b.leg_distance)
+        self.assertEqual(self.journey.distance, rebuilt.distance)
+        self.assertEqual(self.journey.wkt_obj.wkt, rebuilt.wkt_obj.wkt)
+
+    def test_move(self):
+        untouched = self.journey.legs[40]
+        wp = self.waypoints[10]
+        self.waypoints[10] = self.waypoint(wp.name, 50.2, -0.5, wp.sail_mode, wp.radius)
+        lat, lon, _, _ = self.edit_args(self.waypoints[10])
+        self.journey.move_waypoint(10, lat, lon)
+        self.assertMatchesRebuild()
+        # legs away from the edit are kept, not recomputed
+        self.assertIs(self.journey.legs[40], untouched)
+
+    def test_insert_and_delete(self):
+        for index, wp in [(20, self.waypoint('NEW', 50.5, 1.0, 1, 926)),
+                          (0, self.waypoint('FIRST', 49.0, -2.0)),
+                          (len(self.waypoints), self.waypoint('LAST', 55.0, 8.0, 1))]:
+            self.waypoints.insert(index, wp)
+            lat, lon, radius, sail_mode = self.edit_args(wp)
+            self.journey.insert_waypoint(index, wp.name, lat, lon, radius, sail_mode)
+            self.assertMatchesRebuild()
+
+        for index in [30, 0, -1]:
+            index %= len(self.waypoints)
+            del self.waypoints[index]
+            self.journey.delete_waypoint(index)
+            self.assertMatchesRebuild()
+
+    def test_edit_before_geometry(self):
+        journey = Journey.from_route_model(RouteModelStub('synthetic', list(self.waypoints)))
+        del self.waypoints[10]
+        journey.delete_waypoint(10)
+        self.assertFalse(journey.route_geometry.has_points)
+        self.journey = journey
+        self.assertMatchesRebuild()
+
+    def test_radius_and_sail_mode(self):
+        for index in [0, 5, 59]:
+            wp = self.waypoints[index]
+            self.waypoints[index] = Waypoint(name=wp.name, latitude=wp.latitude, longitude=wp.longitude,
+                                             sail_mode=1 - wp.sail_mode, radius=370.4)
+            _, _, radius, sail_mode = self.edit_args(self.waypoints[index])
+            self.journey.set_waypoint_radius(index, radius)
+            self.journey.set_waypoint_sail_mode(index, sail_mode)
+            self.assertMatchesRebuild()
+
+    def test_invalid_edits(self):
+        journey = Journey.from_route_model(RouteModelStub('short', self.waypoints[:2]))
+        self.assertRaises(ValueError, journey.delete_waypoint, 0)
+        self.assertRaises(IndexError, self.journey.delete_waypoint, 60)
+        per_leg = Journey.from_route_model_per_leg(RouteModelStub('per leg', self.waypoints[:3]))
+        self.assertRaises(ValueError, per_leg.move_waypoint, 1, 50, 0)
+
+
+class TestGreatCircleSegmentation(unittest.TestCase):
+
+    def test_points_on_great_circle(self):
+        max_segment_length = 20000
+        edges = [(50, -1, 60, 20), (10, 170, -10, -175)]
+        segmented = segmentize_great_circles(*zip(*edges), max_segment_length=max_segment_length)
+
+        for (lat1, lon1, lat2, lon2), (lat, lon) in zip(edges, segmented):
+            p1, p2 = SphericalLatLon(lat1, lon1), SphericalLatLon(lat2, lon2)
+            segments = len(lat) - 1
+            self.assertEqual(segments, math.ceil(p1.distanceTo(p2) / max_segment_length))
+            self.assertEqual((lat[0], lon[0], lat[-1], lon[-1]), (lat1, lon1, lat2, lon2))
+            for k in range(segments + 1):
+                p = p1.intermediateTo(p2, k / segments)
+                self.assertAlmostEqual(p.lat, lat[k], places=9)
+                self.assertAlmostEqual((p.lon - lon[k] + 180) % 360 - 180, 0, places=9)
+
+    def test_journey_wkt_without_database(self):
+        wkt = Journey.from_route_model(synthetic_route(20)).wkt_obj.wkt
+        self.assertTrue(wkt.startswith('SRID=4326;CompoundCurve(CircularString('))
+
+
+class TestWKT(unittest.TestCase):
+
+    def test_compound_curve_round_trip(self):
+        cs = CircularString.from_lon_lat_list([[-1.5, 50.25], [-1.0e-07, 50.5], [2.0, -3.0]])
+        ls = LineString.from_lon_lat_list([[2.0, -3.0], [179.5, -89.0]])
+        wkt = CompoundCurve([cs, ls], srid=4326).wkt
+
+        cc = CompoundCurve.from_wkt(wkt)
+        self.assertEqual(cc.srid, 4326)
+        self.assertEqual([type(o) for o in cc.obj], [CircularString, LineString])
+        self.assertEqual(cc.obj[0].obj[1].x, -1.0e-07)
+        self.assertEqual(cc.obj[1].obj[1].y, -89.0)
+        self.assertEqual(cc.wkt, wkt)
+
+    def test_simple_geometries(self):
+        self.assertEqual(Point.from_wkt('POINT(-1 2.5)').obj, [-1.0, 2.5])
+        self.assertEqual(LineString.from_wkt('LINESTRING (0 0, -1 1)').wkt, 'LineString(0.0 0.0, -1.0 1.0)')
+        self.assertEqual(CircularString.from_wkt('CIRCULARSTRING(0 0,1 1,1 0)').wkt,
+                         'CircularString(0.0 0.0, 1.0 1.0, 1.0 0.0)')
+
+    def test_ewkb_matches_postgis(self):
+        # SELECT ST_AsEWKB('SRID=4326;POINT(1 2)'::geometry), little endian
+        point = Point([1.0, 2.0])
+        point.srid = 4326
+        ewkb = binascii.unhexlify('0101000020e6100000000000000000f03f0000000000000040')
+        if sys.byteorder == 'little':
+            self.assertEqual(point.ewkb, ewkb)
+        self.assertEqual(Point.from_ewkb(ewkb).wkt, point.wkt)
+        self.assertEqual(Point.from_ewkb(ewkb).srid, 4326)
+
+        # ST_AsBinary('LINESTRING(1 2, -3 4)'::geometry, 'XDR'), big endian without SRID
+        xdr = binascii.unhexlify('000000000200000002'
+                                 '3ff00000000000004000000000000000'
+                                 'c0080000000000004010000000000000')
+        self.assertEqual(LineString.from_ewkb(xdr).wkt, 'LineString(1.0 2.0, -3.0 4.0)')
+
+    def test_journey_ewkb_round_trip(self):
+        cc = Journey.from_route_model(synthetic_route(20)).wkt_obj
+        read = CompoundCurve.from_ewkb(cc.ewkb)
+        self.assertEqual(read.srid, 4326)
+        self.assertEqual(read.wkt, cc.wkt)
+
+    def test_linearized(self):
+        # a half circle of radius 1 about (1, 0), clockwise, then a straight
+        cs = CircularString.from_lon_lat_list([[0.0, 0.0], [1.0, 1.0], [2.0, 0.0]])
+        ls = LineString.from_lon_lat_list([[2.0, 0.0], [3.0, 0.0]])
+        line = CompoundCurve([cs, ls], srid=4326).linearized(segments_per_quarter=8)
+
+        self.assertEqual(line.srid, 4326)
+        self.assertEqual(line.wkt_tag, 'LineString')
+        self.assertEqual(len(line.obj), 16 + 2)
+        self.assertEqual(line.obj[0].obj, [0, 0])
+        self.assertEqual(line.obj[-2].obj, [2, 0])
+        for p in line.obj[:17]:
+            self.assertAlmostEqual(math.hypot(p.x - 1, p.y), 1)
+            self.assertGreaterEqual(p.y, -1e-12)
+        # hex EWKB, as SpatiaLite AsEWKB returns it
+        self.assertEqual(LineString.from_ewkb(binascii.hexlify(line.ewkb).decode()).wkt, line.wkt)
+
+    def test_invalid_ewkb(self):
+        ewkb = CompoundCurve.from_wkt('COMPOUNDCURVE((0 0, 1 1))').ewkb
+        with self.assertRaises(ValueError):
+            CompoundCurve.from_ewkb(ewkb[:-1])
+        with self.assertRaises(ValueError):
+            CompoundCurve.from_ewkb(ewkb + b'\0')
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            CompoundCurve.from_wkt('COMPOUNDCURVE((0 0, 1))')
+        with self.assertRaises(ValueError):
+            CompoundCurve.from_wkt('COMPOUNDCURVE((0 0, 1 1)')
+        with self.assertRaises(NotImplementedError):
+            CompoundCurve.from_wkt('POLYGON((0 0, 1 1, 1 0, 0 0))')
+
+
+class TestZoneCrossing(unittest.TestCase):
+
+    def test_distance_by_zone(self):
+        p = Point([0, 0])
+        crossings = [
+            ZoneCrossing('country', 1, 'France', 0.5, 0.6, p, p, 3.0),
+            ZoneCrossing('eez', 2, 'France', 0.4, 0.7, p, p, 20.0),
+            ZoneCrossing('eez', 1, 'United Kingdom', 0.0, 0.3, p, p, 12.5),
+            ZoneCrossing('eez', 3, 'United Kingdom', 0.9, 1.0, p, p, 4.5),
+        ]
+        totals = distance_by_zone(crossings)
+        self.assertEqual(list(totals.items()), [
+            (('eez', 'United Kingdom'), 17.0),
+            (('eez', 'France'), 20.0),
+            (('country', 'France'), 3.0),
+        ])
+        self.assertEqual(str(crossings[0]), 'country France: enters at (0 0), leaves at (0 0), 3.00NM')
+
+    def test_round_trip(self):
+        # out of the home port's EEZ and back into it, the pieces of each
+        # segment of the journey inside a zone
+        pieces = [
+            ZoneCrossing(layer, None, name, entry, exit_, 'entry', 'exit', 1.0)
+            for layer, name, entry, exit_ in [
+                ('eez', 'United Kingdom', 0.9, 0.95),
+                ('eez', 'United Kingdom', 0.0, 0.1),
+                ('eez', 'France', 0.4, 0.6),
+                ('eez', 'United Kingdom', 0.95, 1.0),
+                ('eez', 'United Kingdom', 0.1, 0.2),
+                ('country', 'United Kingdom', 0.0, 0.05),
+                ('country', 'United Kingdom', 0.97, 1.0),
+            ]
+        ]
+        stays = merge_pieces(pieces)
+        self.assertEqual([(c.layer, c.seq, c.name, c.entry_fraction, c.exit_fraction, c.distance_nm) for c in stays], [
+            ('eez', 1, 'United Kingdom', 0.0, 0.2, 2.0),
+            ('eez', 2, 'France', 0.4, 0.6, 1.0),
+            ('eez', 3, 'United Kingdom', 0.9, 1.0, 2.0),
+            ('country', 1, 'United Kingdom', 0.0, 0.05, 1.0),
+            ('country', 2, 'United Kingdom', 0.97, 1.0, 1.0),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
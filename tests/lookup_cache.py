@@ -0,0 +1,169 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from ocean_efficiency import settings
+from ocean_efficiency.utils import instrumentation, lookup_cache, zone_index
+from ocean_efficiency.utils.lookup_cache import MISSING, LRUTTLCache, QuantizedLookupCache, estimate_size
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LRUTTLCache(max_entries=2, ttl=10, max_bytes=10 ** 6, clock=self.clock)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache.set('c', 3)
+        self.assertIs(self.cache.get('b'), MISSING)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('c'), 3)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_ttl(self):
+        self.cache.set('a', 1)
+        self.clock.now = 9.9
+        self.assertEqual(self.cache.get('a'), 1)
+        self.clock.now = 10
+        self.assertIs(self.cache.get('a'), MISSING)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_memory_cap(self):
+        value = ['x' * 100]
+        cache = LRUTTLCache(max_entries=100, ttl=None, max_bytes=3 * (estimate_size('k1') + estimate_size(value)))
+        for i in range(5):
+            cache.set('k%s' % i, value)
+        self.assertEqual(len(cache), 3)
+        self.assertLessEqual(cache.stats()['bytes'], cache.max_bytes)
+        self.assertIs(cache.get('k0'), MISSING)
+
+    def test_counters_and_invalidate(self):
+        self.cache.set('a', 1)
+        self.cache.get('a')
+        self.cache.get('b')
+        self.cache.invalidate()
+        self.assertIs(self.cache.get('a'), MISSING)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['invalidations'], stats['bytes']), (1, 2, 1, 0))
+
+
+class TestQuantizedLookupCache(unittest.TestCase):
+
+    def test_lookup_on_quantized_point(self):
+        calls = []
+
+        def lookup(lon, lat):
+            calls.append((lon, lat))
+            return ['zone'], []
+
+        cached = QuantizedLookupCache(lookup, 3, LRUTTLCache(10, None, 10 ** 6))
+        self.assertEqual(cached(1.00012, -2.00049), (['zone'], []))
+        self.assertEqual(cached(1.00004, -1.99951), (['zone'], []))
+        self.assertEqual(calls, [(1.0, -2.0)])
+
+
+class TestZoneTablesReloaded(unittest.TestCase):
+    """
+    The loader runs in another process: all it shares with the web workers is
+    the stamp file
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = settings.ZONE_RELOAD_STAMP, settings.ZONE_RELOAD_CHECK_SECONDS, settings.ZONE_INDEX_ENABLED
+        settings.ZONE_RELOAD_STAMP = os.path.join(self.directory, 'reloaded')
+        settings.ZONE_RELOAD_CHECK_SECONDS = 0
+        lookup_cache.reset_zone_tables_generation()
+
+    def tearDown(self):
+        settings.ZONE_RELOAD_STAMP, settings.ZONE_RELOAD_CHECK_SECONDS, settings.ZONE_INDEX_ENABLED = self.settings
+        lookup_cache.reset_zone_tables_generation()
+        zone_index._zone_index = zone_index._zone_index_generation = None
+        shutil.rmtree(self.directory)
+
+    def touch_stamp(self, mtime):
+        # as the loader process does, without this process' caches being told
+        with open(settings.ZONE_RELOAD_STAMP, 'a'):
+            pass
+        os.utime(settings.ZONE_RELOAD_STAMP, (mtime, mtime))
+
+    def test_cache_emptied(self):
+        calls = []
+
+        def lookup(lon, lat):
+            calls.append((lon, lat))
+            return [], []
+
+        cached = QuantizedLookupCache(lookup, 3, LRUTTLCache(10, None, 10 ** 6), lookup_cache.zone_tables_generation)
+        cached(1, 2)
+        cached(1, 2)
+        self.assertEqual(len(calls), 1)
+        self.touch_stamp(1000)
+        cached(1, 2)
+        cached(1, 2)
+        self.assertEqual(len(calls), 2)
+
+    def test_check_interval(self):
+        settings.ZONE_RELOAD_CHECK_SECONDS = 10
+        clock = FakeClock()
+        self.assertEqual(lookup_cache.zone_tables_generation(clock), 0)
+        self.touch_stamp(1000)
+        clock.now = 9
+        self.assertEqual(lookup_cache.zone_tables_generation(clock), 0)
+        clock.now = 10
+        self.assertEqual(lookup_cache.zone_tables_generation(clock), 1000)
+
+    def test_zone_index_reloaded(self):
+        settings.ZONE_INDEX_ENABLED = True
+        loads = []
+
+        def load():
+            loads.append(1)
+            return object()
+
+        with mock.patch.object(zone_index.ZoneIndex, 'load', side_effect=load):
+            first = zone_index.get_zone_index()
+            self.assertIs(zone_index.get_zone_index(), first)
+            self.touch_stamp(1000)
+            self.assertIsNot(zone_index.get_zone_index(), first)
+        self.assertEqual(len(loads), 2)
+
+    def test_mark_reloaded(self):
+        lookup_cache.mark_zone_tables_reloaded()
+        self.assertGreater(lookup_cache.zone_tables_generation(), 0)
+
+
+class TestLookupCacheMetrics(unittest.TestCase):
+
+    def test_prometheus_text(self):
+        cache = LRUTTLCache(10, None, 10 ** 6)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        with mock.patch.object(lookup_cache, '_caches', [cache]):
+            lines = instrumentation.lookup_cache_text().splitlines()
+        self.assertIn('# TYPE ocean_efficiency_lookup_cache_hits_total counter', lines)
+        self.assertIn('ocean_efficiency_lookup_cache_hits_total{cache="0"} 1', lines)
+        self.assertIn('ocean_efficiency_lookup_cache_misses_total{cache="0"} 1', lines)
+        self.assertIn('ocean_efficiency_lookup_cache_entries{cache="0"} 1', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
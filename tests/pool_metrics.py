@@ -0,0 +1,67 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import unittest
+
+from sqlalchemy import create_engine
+
+from ocean_efficiency.utils.sqlalchemy import InstrumentedQueuePool, needs_ping, pool_metrics, setup_event_handlers
+
+
+class TestHealthCheck(unittest.TestCase):
+
+    def test_needs_ping(self):
+        self.assertTrue(needs_ping('always', {}, 30))
+        self.assertFalse(needs_ping('idle', {}, 30, now=100))
+        self.assertFalse(needs_ping('idle', {'checkin_time': 80}, 30, now=100))
+        self.assertTrue(needs_ping('idle', {'checkin_time': 60}, 30, now=100))
+        self.assertFalse(needs_ping('pre_ping', {'checkin_time': 0}, 30, now=100))
+        self.assertFalse(needs_ping('none', {'checkin_time': 0}, 30, now=100))
+
+    def test_unknown_strategy(self):
+        engine = create_engine('sqlite://')
+        self.assertRaises(ValueError, setup_event_handlers, engine, 10, health_check='sometimes')
+
+
+class TestPoolMetrics(unittest.TestCase):
+
+    def run_queries(self, health_check, n=5):
+        pool_metrics.reset()
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, pool_size=2, max_overflow=0)
+        setup_event_handlers(engine, 10, health_check=health_check, ping_idle_seconds=3600)
+        for _ in range(n):
+            with engine.connect() as connection:
+                connection.execute('SELECT 1').scalar()
+        return pool_metrics.snapshot(engine.pool)
+
+    def test_always_pings(self):
+        metrics = self.run_queries('always')
+        self.assertEqual(metrics['pings'], 5)
+        self.assertEqual(metrics['pings_skipped'], 0)
+
+    def test_idle_skips_recent_connections(self):
+        metrics = self.run_queries('idle')
+        self.assertEqual(metrics['pings'], 0)
+        self.assertEqual(metrics['pings_skipped'], 5)
+        self.assertEqual(metrics['connects'], 1)
+        self.assertEqual(metrics['checkouts'], 5)
+        self.assertEqual(metrics['checkins'], 5)
+        self.assertEqual(metrics['checked_out'], 0)
+        self.assertEqual(metrics['pool_size'], 2)
+        self.assertGreater(metrics['checkout_wait_max_seconds'], 0)
+
+    def test_no_skips_without_idle(self):
+        for health_check in ('pre_ping', 'none'):
+            metrics = self.run_queries(health_check)
+            self.assertEqual(metrics['pings'], 0)
+            self.assertEqual(metrics['pings_skipped'], 0)
+
+    def test_prometheus_names(self):
+        metrics = self.run_queries('always')
+        for name in metrics:
+            self.assertFalse(name.endswith('_s'), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+from geoalchemy2 import WKTElement
+from sqlalchemy import text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import Query
+
+from fixtures import synthetic_route
+from ocean_efficiency import settings
+from ocean_efficiency.legacy_model.GeoWKT import LineString
+from ocean_efficiency.legacy_model.Journey import Journey
+from ocean_efficiency.model import Base, EEZ12, Journey as ORMJourney
+from ocean_efficiency.utils.spatialite import spatialite_available, spatialite_tables
+
+
+class SpatiaLiteSettings(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.conn = settings.SQL_ALCHEMY_CONN
+        settings.dispose_orm()
+        settings.SQL_ALCHEMY_CONN = 'sqlite:///' + os.path.join(self.directory, 'ocean_efficiency.db')
+
+    def tearDown(self):
+        settings.dispose_orm()
+        settings.SQL_ALCHEMY_CONN = self.conn
+        shutil.rmtree(self.directory)
+
+
+class TestSpatiaLiteQueries(SpatiaLiteSettings):
+
+    def test_lookup_uses_spatial_index(self):
+        point = WKTElement('POINT(1 2)', srid=4326)
+        sql = str(Query(EEZ12.geoname).filter(EEZ12.point_within(point)).statement.compile(dialect=sqlite.dialect()))
+        self.assertIn('"SpatialIndex".search_frame', sql)
+        self.assertIn('ST_Within', sql)
+        self.assertNotIn('subdivided', sql)
+
+    def test_journey_stored_linearized(self):
+        sql = str(Query(ORMJourney.geom).statement.compile(dialect=sqlite.dialect()))
+        self.assertIn('AsEWKB(journey.geom)', sql)
+
+        columns = Journey.geom_columns(Journey.from_route_model(synthetic_route(5)).wkt_obj)
+        hex_ewkb = columns['geom'].clauses.clauses[0].value
+        self.assertIsInstance(LineString.from_ewkb(hex_ewkb), LineString)
+        self.assertIs(columns['line'], columns['geom'])
+
+    def test_table_copies(self):
+        copies = {t.name: t for t in spatialite_tables(Base.metadata.sorted_tables)}
+        # the companion tables are built from the zone layers, not created empty
+        self.assertNotIn('eez_12nm_v2_approx', copies)
+        self.assertEqual(copies['journey'].c.geom.type.geometry_type, 'LINESTRING')
+        self.assertTrue(copies['eez_12nm_v2'].c.geom.type.management)
+        # the model is left as it is
+        self.assertEqual(ORMJourney.__table__.c.geom.type.geometry_type, 'COMPOUNDCURVE')
+        self.assertFalse(EEZ12.__table__.c.geom.type.management)
+
+
+@unittest.skipUnless(spatialite_available(), 'the SpatiaLite extension cannot be loaded')
+class TestSpatiaLiteBackend(SpatiaLiteSettings):
+
+    def setUp(self):
+        super(TestSpatiaLiteBackend, self).setUp()
+        from ocean_efficiency.utils.db import initdb
+
+        initdb()
+        with settings.get_engine().begin() as connection:
+            connection.execute(text(
+                "INSERT INTO eez_12nm_v2 (gid, geoname, geom) "
+                "VALUES (1, 'box', GeomFromText('MULTIPOLYGON(((0 0, 2 0, 2 2, 0 2, 0 0)))', 4326))"))
+
+    def test_lookup(self):
+        from oceanefficiency import lookup_zones_in_db
+
+        self.assertEqual(lookup_zones_in_db(1, 1), (['box'], []))
+        self.assertEqual(lookup_zones_in_db(3, 1), ([], []))
+        # ST_Within excludes the polygon boundary
+        self.assertEqual(lookup_zones_in_db(2, 1), ([], []))
+
+    def test_journey_round_trip(self):
+        journey = Journey.from_route_model(synthetic_route(10))
+        journey.write_to_db()
+        line = Journey.read_wkt_obj(journey.journey_id)
+        self.assertEqual(line.srid, 4326)
+        self.assertEqual(line.wkt, journey.wkt_obj.linearized().wkt)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from ocean_efficiency import settings
+from ocean_efficiency.utils import tiles
+from ocean_efficiency.utils.tiles import TileCache, clip_box, lod_level, tile_bounds, tile_range
+from oceanefficiency import app
+
+
+class TestTileGeometry(unittest.TestCase):
+
+    def test_bounds(self):
+        self.assertEqual(tile_bounds(0, 0, 0), (-tiles.ORIGIN, -tiles.ORIGIN, tiles.ORIGIN, tiles.ORIGIN))
+        xmin, ymin, xmax, ymax = tile_bounds(1, 1, 0)
+        self.assertEqual((xmin, ymin), (0, 0))
+
+    def test_clip_box(self):
+        min_lon, min_lat, max_lon, max_lat = clip_box(1, 1, 0, 4096, 0)
+        self.assertAlmostEqual(min_lon, 0)
+        self.assertAlmostEqual(min_lat, 0)
+        self.assertAlmostEqual(max_lat, tiles.MAX_LATITUDE)
+        # the buffer reaches into the neighbouring tiles
+        self.assertLess(clip_box(1, 1, 0, 4096, 64)[0], 0)
+
+    def test_tile_range(self):
+        self.assertEqual(tile_range(0, -10, -10, 10, 10), (0, 0, 0, 0))
+        self.assertEqual(tile_range(1, 10, 10, 20, 20), (1, 0, 1, 0))
+        self.assertEqual(tile_range(1, -10, -89, 10, 89), (0, 0, 1, 1))
+        # within the buffer of the tile to the west
+        self.assertEqual(tile_range(1, 0.1, 10, 20, 20), (1, 0, 1, 0))
+        self.assertEqual(tile_range(1, 0.1, 10, 20, 20, margin=64 / 4096), (0, 0, 1, 0))
+
+    def test_lod_level(self):
+        tolerances = [0.05, 0.01, 0.002]
+        self.assertEqual(lod_level(0, 4096, tolerances), 1)
+        self.assertEqual(lod_level(2, 4096, tolerances), 2)
+        self.assertIsNone(lod_level(8, 4096, tolerances))
+
+    def test_tile_sql(self):
+        sql = tiles.tile_sql(2).text
+        self.assertIn("ST_AsMVT(t, 'journey'", sql)
+        self.assertIn('eez_12nm_v2_lod z JOIN eez_12nm_v2 USING (gid)', sql)
+        self.assertIn('z.level = 2 AND', sql)
+        self.assertNotIn('_lod', tiles.tile_sql(None).text)
+
+    def test_render_without_companion_tables(self):
+        session = mock.Mock()
+        session.execute.return_value.scalar.return_value = b''
+        with mock.patch.object(settings, 'SQL_ALCHEMY_CONN', 'postgresql://localhost/ocean_efficiency'), \
+                mock.patch.object(settings, 'USE_SUBDIVIDED_ZONES', False):
+            tiles.render_tile(2, 1, 1, session=session)
+        self.assertNotIn('_lod', session.execute.call_args[0][0].text)
+        with mock.patch.object(settings, 'SQL_ALCHEMY_CONN', 'postgresql://localhost/ocean_efficiency'), \
+                mock.patch.object(settings, 'USE_SUBDIVIDED_ZONES', True):
+            tiles.render_tile(2, 1, 1, session=session)
+        self.assertIn('_lod', session.execute.call_args[0][0].text)
+
+
+class TestTileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = TileCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get(3, 1, 2))
+        self.cache.put(3, 1, 2, b'tile', time.time())
+        self.assertEqual(self.cache.get(3, 1, 2), b'tile')
+        self.cache.put(3, 1, 3, b'', time.time())
+        self.assertEqual(self.cache.get(3, 1, 3), b'')
+
+    def test_invalidate_bbox(self):
+        started = time.time() - 1
+        for z, x, y in [(0, 0, 0), (2, 1, 1), (2, 3, 3), (4, 8, 8), (4, 15, 15)]:
+            self.cache.put(z, x, y, b'tile', started)
+        # around (0, 0), the tiles of the south east corner of the world are kept
+        self.assertEqual(self.cache.invalidate_bbox(-1, -1, 1, 1), 3)
+        self.assertIsNone(self.cache.get(2, 1, 1))
+        self.assertEqual(self.cache.get(2, 3, 3), b'tile')
+        self.assertEqual(self.cache.get(4, 15, 15), b'tile')
+
+    def test_invalidate_bboxes(self):
+        started = time.time() - 1
+        for z, x, y in [(2, 1, 1), (2, 2, 1), (2, 3, 3), (4, 0, 0)]:
+            self.cache.put(z, x, y, b'tile', started)
+        # the tiles of each box, not of the box around them all
+        self.assertEqual(self.cache.invalidate_bboxes([(-10, 10, -5, 20), (100, -80, 110, -70)]), 2)
+        self.assertIsNone(self.cache.get(2, 1, 1))
+        self.assertIsNone(self.cache.get(2, 3, 3))
+        self.assertEqual(self.cache.get(2, 2, 1), b'tile')
+        self.assertEqual(self.cache.get(4, 0, 0), b'tile')
+
+    def test_invalidate_all(self):
+        self.cache.put(5, 3, 4, b'tile', time.time() - 1)
+        self.cache.invalidate_all()
+        self.assertIsNone(self.cache.get(5, 3, 4))
+        self.assertEqual(os.listdir(self.directory), [TileCache.STAMP])
+
+    def test_rendered_before_invalidation(self):
+        started = time.time() - 1
+        self.cache.invalidate_all()
+        self.cache.put(1, 0, 0, b'stale', started)
+        self.assertIsNone(self.cache.get(1, 0, 0))
+
+    def test_invalidated_while_written(self):
+        started = time.time() - 1
+        replace = os.replace
+
+        def invalidate_then_replace(src, dst):
+            # the invalidation lists the tiles before this one is in place
+            self.assertEqual(self.cache.invalidate_bbox(-180, -85, 180, 85), 0)
+            replace(src, dst)
+
+        with mock.patch.object(tiles.os, 'replace', side_effect=invalidate_then_replace):
+            self.cache.put(1, 0, 0, b'stale', started)
+        self.assertIsNone(self.cache.get(1, 0, 0))
+        self.assertEqual(os.listdir(os.path.join(self.directory, '1', '0')), [])
+
+
+class TestTileEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = settings.TILE_CACHE_DIR, settings.TILE_CACHE_ENABLED, settings.SQL_ALCHEMY_CONN
+        settings.TILE_CACHE_DIR, settings.TILE_CACHE_ENABLED = self.directory, True
+        settings.SQL_ALCHEMY_CONN = 'postgresql://localhost/ocean_efficiency'
+        self.client = app.test_client()
+
+    def tearDown(self):
+        settings.TILE_CACHE_DIR, settings.TILE_CACHE_ENABLED, settings.SQL_ALCHEMY_CONN = self.settings
+        shutil.rmtree(self.directory)
+
+    def test_cached(self):
+        with mock.patch.object(tiles, 'render_tile', return_value=b'mvt') as render_tile:
+            for _ in range(2):
+                response = self.client.get('/tiles/2/1/3.mvt')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.mimetype, tiles.MVT_MIMETYPE)
+                self.assertEqual(response.data, b'mvt')
+            self.assertEqual(render_tile.call_count, 1)
+
+            tiles.invalidate_journey_tiles(None, None, None, None)
+            self.client.get('/tiles/2/1/3.mvt')
+            self.assertEqual(render_tile.call_count, 2)
+
+    def test_out_of_range(self):
+        self.assertEqual(self.client.get('/tiles/2/4/0.mvt').status_code, 404)
+        self.assertEqual(self.client.get('/tiles/{}/0/0.mvt'.format(settings.TILE_MAX_ZOOM + 1)).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
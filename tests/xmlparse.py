@@ -3,7 +3,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 import unittest
-from ocean_efficiency.xmlparse.RouteModel import RouteModel
+from ocean_efficiency.xmlparse.RouteModel import RouteModel, RouteModelType
+from ocean_efficiency.xmlparse.route_model_iterparse import RouteModelReader
 
 
 # class TestStringMethods(unittest.TestCase):
@@ -52,6 +53,43 @@ class TestXMLParse(unittest.TestCase):
         rm = RouteModel.parse(self.demoxml.strip())
         print(rm.name)
 
+    def test_streaming_reader_matches_dexml(self):
+        expected = RouteModel.parse(self.demoxml.strip())
+        reader = RouteModelReader(self.demoxml.strip().encode('utf-8'))
+        rm = reader.read()
+
+        self.assertIs(type(rm), RouteModel)
+        self.assertEqual(reader.namespace, RouteModel.meta.namespace)
+        self.assertEqual(rm.name, expected.name)
+        self.assertEqual(len(rm.waypoints), 2)
+        for a, b in zip(rm.waypoints, expected.waypoints):
+            for f in a._fields:
+                self.assertEqual(getattr(a, f.field_name), getattr(b, f.field_name), f.field_name)
+
+    def test_streaming_reader_route_model_type(self):
+        xml = self.demoxml.strip().replace('RouteModel ', 'RouteModelType ').replace('</RouteModel>', '</RouteModelType>')
+        reader = RouteModelReader(xml)
+        waypoints = iter(reader)
+        self.assertEqual(next(waypoints).name, 'BASIN')
+        self.assertIs(reader.route_model_class, RouteModelType)
+        self.assertEqual(reader.name, 'AARHUS-OSLO')
+        self.assertEqual([wp.sail_mode for wp in waypoints], [1])
+
+    def test_streaming_reader_leading_space(self):
+        # demoxml starts with a newline before the XML declaration
+        for xml in (self.demoxml, '\ufeff' + self.demoxml, '\n\ufeff' + self.demoxml,
+                    self.demoxml.encode('utf-8')):
+            rm = RouteModelReader(xml).read()
+            self.assertEqual(rm.name, 'AARHUS-OSLO')
+            self.assertEqual(len(rm.waypoints), 2)
+
+    def test_streaming_reader_errors(self):
+        with self.assertRaises(ValueError):
+            RouteModelReader('<Route><Name>x</Name></Route>').read()
+        missing_radius = self.demoxml.strip().replace('<Radius>370.4</Radius>', '', 1)
+        with self.assertRaises(ValueError):
+            RouteModelReader(missing_radius).read()
+
 
 if __name__ == '__main__':
     unittest.main()
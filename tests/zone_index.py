@@ -0,0 +1,44 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import unittest
+
+from shapely import MultiPolygon, Polygon, box
+
+from ocean_efficiency.utils.zone_index import PolygonIndex
+
+
+class TestPolygonIndex(unittest.TestCase):
+
+    def setUp(self):
+        # labels in the order the db ORDER BY returned them
+        self.index = PolygonIndex(
+            ['Alpha', 'Bravo', 'Bravo', 'Charlie'],
+            [
+                box(0, 0, 10, 10),
+                box(5, 5, 15, 15),
+                MultiPolygon([box(20, 20, 21, 21), box(-1, -1, 1, 1)]),
+                Polygon([(0, 0), (10, 0), (0, 10)]),
+            ]
+        )
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup(7, 7), ['Alpha', 'Bravo'])
+        self.assertEqual(self.index.lookup(0.5, 0.5), ['Alpha', 'Bravo', 'Charlie'])
+        self.assertEqual(self.index.lookup(20.5, 20.5), ['Bravo'])
+        self.assertEqual(self.index.lookup(-50, 50), [])
+
+    def test_boundary_is_not_within(self):
+        # ST_Within excludes the polygon boundary
+        self.assertEqual(self.index.lookup(10, 3), [])
+        self.assertEqual(self.index.lookup(5, 5), ['Alpha'])
+
+    def test_lookup_many_matches_lookup(self):
+        points = [(7, 7), (0.5, 0.5), (20.5, 20.5), (-50, 50), (5, 5)]
+        lons, lats = zip(*points)
+        self.assertEqual(self.index.lookup_many(lons, lats), [self.index.lookup(*p) for p in points])
+
+
+if __name__ == '__main__':
+    unittest.main()